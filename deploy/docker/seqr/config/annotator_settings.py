@@ -8,6 +8,11 @@ install_dir = os.environ.get("SEQR_DIR", '/seqr')
 vep_perl_path = '%(install_dir)s/variant_effect_predictor/variant_effect_predictor.pl' % locals()
 vep_cache_dir = '%(install_dir)s/vep_cache_dir' % locals()
 vep_batch_size = 50000
+# number of VEP batches to annotate at the same time
+vep_processes = int(os.environ.get('VEP_PROCESSES', 1))
+# if set, VEP output for finished batches is kept in this directory until the load finishes, so that an interrupted
+# load doesn't re-annotate them
+vep_batch_cache_dir = os.environ.get('VEP_BATCH_CACHE_DIR') or None
 
 reference_populations = [
     {
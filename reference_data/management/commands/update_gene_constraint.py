@@ -2,6 +2,7 @@ import logging
 from django.core.management.base import CommandError
 from reference_data.management.commands.utils.update_utils import GeneCommand, ReferenceDataHandler
 from reference_data.models import TranscriptInfo, GeneConstraint
+from seqr.utils.gene_utils import reset_gene_constraint_cache
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +41,11 @@ class GeneConstraintReferenceDataHandler(ReferenceDataHandler):
             for i, model in enumerate(sorted(models, key=lambda model: -1 * getattr(model, field))):
                 setattr(model, '{}_rank'.format(field), i)
 
+    @staticmethod
+    def post_update():
+        # the constraint totals and ranks are cached for gene json
+        reset_gene_constraint_cache()
+
 
 class Command(GeneCommand):
     reference_data_handler = GeneConstraintReferenceDataHandler
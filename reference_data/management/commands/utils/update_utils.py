@@ -17,6 +17,7 @@ class ReferenceDataHandler(object):
     url = None
     header_fields = None
     post_process_models = None
+    post_update = None
     batch_size = None
     keep_existing_records = False
 
@@ -117,6 +118,9 @@ def update_records(reference_data_handler, file_path=None):
     logger.info("Creating {} {} records".format(len(models), model_name))
     model_objects.bulk_create(models)
 
+    if reference_data_handler.post_update:
+        reference_data_handler.post_update()
+
     logger.info("Done")
     logger.info("Loaded {} {} records from {}. Skipped {} records with unrecognized genes.".format(
         model_objects.count(), model_name, file_path, skip_counter))
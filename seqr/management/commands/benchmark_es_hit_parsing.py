@@ -0,0 +1,220 @@
+import json
+import logging
+import os
+import timeit
+from collections import defaultdict
+from StringIO import StringIO
+
+from django.core.management.base import BaseCommand
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.response import Response
+from pyliftover.liftover import LiftOver
+
+from reference_data.models import GENOME_VERSION_GRCh38, GENOME_VERSION_GRCh37
+from seqr.models import Sample, Individual
+from seqr.utils import es_utils
+from seqr.utils.es_utils import EsSearch, get_es_client, get_index_metadata, _get_population_field_plans, _get_sort, \
+    _parse_es_sort, _liftover_grch38_to_grch37, CORE_FIELDS_CONFIG, PREDICTION_FIELDS_CONFIG, GENOTYPE_FIELDS_CONFIG, \
+    NESTED_FIELDS, POPULATIONS, POPULATION_RESPONSE_FIELD_CONFIGS, GENOTYPES_FIELD_KEY, HAS_ALT_FIELD_KEYS, \
+    SORTED_TRANSCRIPTS_FIELD_KEY, QUERY_FIELD_NAMES, XPOS_SORT_KEY
+from seqr.views.utils.json_utils import _to_camel_case
+
+logger = logging.getLogger(__name__)
+
+RECORDED_RESPONSE_FILE = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'fixtures', 'es_variant_search_response.json')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark parsing a recorded elasticsearch variant search response into variant json'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--response-file', default=RECORDED_RESPONSE_FILE,
+                            help='json file with a recorded search response, and the index metadata and samples for it')
+        parser.add_argument('--index', help='optional elasticsearch index to record the response file from first')
+        parser.add_argument('--num-hits', type=int, default=1000)
+        parser.add_argument('--iterations', type=int, default=5)
+
+    def handle(self, *args, **options):
+        response_file = options['response_file']
+        if options['index']:
+            _record_response(options['index'], options['num_hits'], response_file)
+
+        with open(response_file) as f:
+            recorded = json.load(f)
+        search = _get_recorded_search(recorded)
+        # The recorded hits are repeated to make up the benchmarked number of hits
+        recorded_hits = recorded['response']['hits']['hits']
+        recorded['response']['hits']['hits'] = [
+            recorded_hits[i % len(recorded_hits)] for i in range(options['num_hits'])]
+        hits = list(Response(Search(), recorded['response']))
+
+        def _parse_hits():
+            lifted_over_positions = search._liftover_hits(hits)
+            return [search._parse_hit(hit, lifted_over_positions) for hit in hits]
+
+        def _parse_hits_legacy():
+            return [_parse_hit_legacy(search, hit) for hit in hits]
+
+        if _parse_hits_legacy() != _parse_hits():
+            raise ValueError('Parsed hits do not match the legacy parsed hits')
+
+        seconds = min(timeit.repeat(
+            lambda: _get_population_field_plans(search.index_metadata.values()[0]['fields']), number=1,
+            repeat=options['iterations']))
+        logger.info('population field plans for an index: {:.3f} ms'.format(seconds * 1000))
+
+        for name, parse_hits in [('legacy', _parse_hits_legacy), ('field plan', _parse_hits)]:
+            def _parse_hits_without_cached_liftover():
+                es_utils.LIFTOVER_GRCH38_TO_GRCH37_CACHE.clear()
+                parse_hits()
+
+            seconds = min(timeit.repeat(_parse_hits_without_cached_liftover, number=1, repeat=options['iterations']))
+            logger.info('{}: {:.1f} ms, {:.0f} hits/second'.format(name, seconds * 1000, len(hits) / seconds))
+
+
+def _record_response(index_name, num_hits, response_file):
+    client = get_es_client()
+    response = Search(index=index_name).using(client).source(QUERY_FIELD_NAMES).sort(
+        XPOS_SORT_KEY)[:num_hits].execute()
+    index_metadata = get_index_metadata(index_name, client)
+    samples = defaultdict(lambda: defaultdict(dict))
+    for sample in Sample.objects.filter(elasticsearch_index=index_name).select_related('individual__family'):
+        samples[index_name][sample.individual.family.guid][sample.sample_id] = sample.individual.guid
+    with open(response_file, 'w') as f:
+        json.dump({
+            'indexMetadata': {index_name: index_metadata[index_name]},
+            'samples': samples,
+            'sort': XPOS_SORT_KEY,
+            'liftoverChain': [],
+            'response': response.to_dict(),
+        }, f)
+    logger.info('Recorded {} hits from {} to {}'.format(len(response), index_name, response_file))
+
+
+def _get_recorded_search(recorded):
+    """Returns a search for the recorded indices and samples, without loading them from the database or elasticsearch"""
+    search = EsSearch.__new__(EsSearch)
+    search.samples_by_family_index = {
+        index_name: {
+            family_guid: {
+                sample_id: Sample(sample_id=sample_id, individual=Individual(guid=individual_guid))
+                for sample_id, individual_guid in samples_by_id.items()
+            } for family_guid, samples_by_id in family_samples.items()
+        } for index_name, family_samples in recorded['samples'].items()
+    }
+    search.index_metadata = recorded['indexMetadata']
+    search._population_field_plans = {
+        index_name: _get_population_field_plans(metadata['fields'])
+        for index_name, metadata in search.index_metadata.items()
+    }
+    search._sort = _get_sort(recorded['sort'])
+    if recorded['liftoverChain']:
+        # Both parsers lift over with the recorded chain, so the benchmark does not depend on downloading one
+        es_utils.LIFTOVER_GRCH38_TO_GRCH37 = LiftOver(StringIO('\n'.join(recorded['liftoverChain'])))
+    return search
+
+
+# The hit parsing as it was before field plans were precomputed, for comparison
+
+def _parse_hit_legacy(self, raw_hit):
+    hit = {k: raw_hit[k] for k in QUERY_FIELD_NAMES if k in raw_hit}
+    index_name = raw_hit.meta.index
+    index_family_samples = self.samples_by_family_index[index_name]
+
+    if hasattr(raw_hit.meta, 'matched_queries'):
+        family_guids = list(raw_hit.meta.matched_queries)
+    else:
+        # Searches for all inheritance and all families do not filter on inheritance so there are no matched_queries
+        alt_allele_samples = set()
+        for alt_samples_field in HAS_ALT_FIELD_KEYS:
+            alt_allele_samples.update(hit[alt_samples_field])
+        family_guids = [family_guid for family_guid, samples_by_id in index_family_samples.items()
+                        if any(sample_id in alt_allele_samples for sample_id in samples_by_id.keys())]
+
+    genotypes = {}
+    for family_guid in family_guids:
+        samples_by_id = index_family_samples[family_guid]
+        genotypes.update({
+            samples_by_id[genotype_hit['sample_id']].individual.guid: _get_field_values(genotype_hit, GENOTYPE_FIELDS_CONFIG)
+            for genotype_hit in hit[GENOTYPES_FIELD_KEY] if genotype_hit['sample_id'] in samples_by_id
+        })
+
+    genome_version = self.index_metadata[index_name].get('genomeVersion')
+    lifted_over_genome_version = None
+    lifted_over_chrom = None
+    lifted_over_pos = None
+    liftover_grch38_to_grch37 = _liftover_grch38_to_grch37()
+    if liftover_grch38_to_grch37 and genome_version == GENOME_VERSION_GRCh38:
+        if liftover_grch38_to_grch37:
+            grch37_coord = liftover_grch38_to_grch37.convert_coordinate(
+                'chr{}'.format(hit['contig'].lstrip('chr')), int(hit['start'])
+            )
+            if grch37_coord and grch37_coord[0]:
+                lifted_over_genome_version = GENOME_VERSION_GRCh37
+                lifted_over_chrom = grch37_coord[0][0].lstrip('chr')
+                lifted_over_pos = grch37_coord[0][1]
+
+    populations = {
+        population: _get_field_values(
+            hit, POPULATION_RESPONSE_FIELD_CONFIGS, format_response_key=lambda key: key.lower(),
+            lookup_field_prefix=population,
+            existing_fields=self.index_metadata[index_name]['fields'],
+            get_addl_fields=lambda field, field_config:
+            [pop_config.get(field)] + ['{}_{}'.format(population, custom_field) for custom_field in
+                                       field_config.get('fields', [])],
+        )
+        for population, pop_config in POPULATIONS.items()
+    }
+
+    sorted_transcripts = [
+        {_to_camel_case(k): v for k, v in transcript.to_dict().items()}
+        for transcript in hit[SORTED_TRANSCRIPTS_FIELD_KEY] or []
+    ]
+    transcripts = defaultdict(list)
+    for transcript in sorted_transcripts:
+        transcripts[transcript['geneId']].append(transcript)
+
+    result = _get_field_values(hit, CORE_FIELDS_CONFIG, format_response_key=str)
+    result.update({
+        field_name: _get_field_values(hit, fields, lookup_field_prefix=field_name)
+        for field_name, fields in NESTED_FIELDS.items()
+    })
+    if hasattr(raw_hit.meta, 'sort'):
+        result['_sort'] = [_parse_es_sort(sort, sort_config) for sort, sort_config in zip(raw_hit.meta.sort, self._sort)]
+
+    result.update({
+        'familyGuids': sorted(family_guids),
+        'genotypes': genotypes,
+        'genomeVersion': genome_version,
+        'liftedOverGenomeVersion': lifted_over_genome_version,
+        'liftedOverChrom': lifted_over_chrom,
+        'liftedOverPos': lifted_over_pos,
+        'mainTranscript': sorted_transcripts[0] if len(sorted_transcripts) else {},
+        'populations': populations,
+        'predictions': _get_field_values(
+            hit, PREDICTION_FIELDS_CONFIG, format_response_key=lambda key: key.split('_')[1].lower()
+        ),
+        'transcripts': transcripts,
+    })
+    return result
+
+
+def _get_field_values(hit, field_configs, format_response_key=_to_camel_case, get_addl_fields=None, lookup_field_prefix='', existing_fields=None):
+    return {
+        field_config.get('response_key', format_response_key(field)): _value_if_has_key(
+            hit,
+            (get_addl_fields(field, field_config) if get_addl_fields else []) +
+            ['{}_{}'.format(lookup_field_prefix, field) if lookup_field_prefix else field],
+            existing_fields=existing_fields,
+            **field_config
+        )
+        for field, field_config in field_configs.items()
+    }
+
+
+def _value_if_has_key(hit, keys, format_value=None, default_value=None, existing_fields=None, **kwargs):
+    for key in keys:
+        if key in hit:
+            return format_value(default_value if hit[key] is None else hit[key]) if format_value else hit[key]
+    return default_value if not existing_fields or any(key in existing_fields for key in keys) else None
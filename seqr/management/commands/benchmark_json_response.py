@@ -0,0 +1,64 @@
+import gzip
+import json
+import logging
+import timeit
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from seqr.views.pages.project_page import project_page_data
+from seqr.views.utils.json_utils import DjangoJSONEncoderWithSets, COMPACT_JSON_DUMPS_PARAMS, \
+    PRETTY_JSON_DUMPS_PARAMS
+
+logger = logging.getLogger(__name__)
+
+# The json encoding used for all API responses before responses were compact by default
+LEGACY_JSON_DUMPS_PARAMS = {'sort_keys': True, 'indent': 4}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark json response serialization on a recorded API payload, such as the project page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('payload_file', help='json file with a recorded API response payload')
+        parser.add_argument('--project', help='optional project guid to record the project page payload for first')
+        parser.add_argument('--iterations', type=int, default=5)
+
+    def handle(self, *args, **options):
+        payload_file = options['payload_file']
+        if options['project']:
+            _record_project_page_payload(options['project'], payload_file)
+
+        with open(payload_file) as f:
+            payload = json.load(f)
+
+        for name, dumps_params in [
+            ('legacy', LEGACY_JSON_DUMPS_PARAMS),
+            ('pretty', PRETTY_JSON_DUMPS_PARAMS),
+            ('compact', COMPACT_JSON_DUMPS_PARAMS),
+        ]:
+            def _dumps():
+                return json.dumps(payload, cls=DjangoJSONEncoderWithSets, **dumps_params)
+
+            seconds = min(timeit.repeat(_dumps, number=1, repeat=options['iterations']))
+            content = _dumps()
+            logger.info('{}: {:.1f} ms, {} bytes, {} bytes gzipped'.format(
+                name, seconds * 1000, len(content), len(_gzip(content))))
+
+
+def _record_project_page_payload(project_guid, payload_file):
+    request = RequestFactory().get('/api/project/{}/details'.format(project_guid))
+    request.user = User.objects.filter(is_staff=True).first()
+    response = project_page_data(request, project_guid)
+    with open(payload_file, 'w') as f:
+        f.write(response.content)
+    logger.info('Recorded project page payload for {} to {}'.format(project_guid, payload_file))
+
+
+def _gzip(content):
+    buf = StringIO()
+    with gzip.GzipFile(mode='wb', compresslevel=6, fileobj=buf) as f:
+        f.write(content)
+    return buf.getvalue()
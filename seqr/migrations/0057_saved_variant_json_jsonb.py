@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import django.contrib.postgres.fields.jsonb
+
+
+def clear_empty_saved_variant_json(apps, schema_editor):
+    # Empty strings can not be cast to jsonb, so they are stored as null instead
+    SavedVariant = apps.get_model("seqr", "SavedVariant")
+    db_alias = schema_editor.connection.alias
+    SavedVariant.objects.using(db_alias).filter(saved_variant_json='').update(saved_variant_json=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seqr', '0056_auto_20190513_1621'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_empty_saved_variant_json, reverse_code=migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='savedvariant',
+            name='saved_variant_json',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -1,18 +1,28 @@
-from collections import defaultdict
-from django.db.models import Max
+from collections import defaultdict, OrderedDict
+from copy import deepcopy
+from datetime import datetime
+from django.db.models import Max, Count, F, IntegerField, DateTimeField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 import elasticsearch
 from elasticsearch_dsl import Search, Q, Index, MultiSearch
+import heapq
 import json
 import logging
+import math
+from multiprocessing.pool import ThreadPool
+import os
 from pyliftover.liftover import LiftOver
 from sys import maxint
-import redis
+from threading import Lock
+import zlib
 
 import settings
 from reference_data.models import GENOME_VERSION_GRCh38, GENOME_VERSION_GRCh37, Omim, GeneConstraint
 from seqr.models import Sample, Individual
 from seqr.utils.xpos_utils import get_xpos, get_chrom_pos
-from seqr.utils.gene_utils import parse_locus_list_items
+from seqr.utils.gene_utils import parse_locus_list_items, get_reference_data_version
+from seqr.utils.redis_utils import get_redis_client
 from seqr.views.utils.json_utils import _to_camel_case
 
 logger = logging.getLogger(__name__)
@@ -22,13 +32,97 @@ VARIANT_DOC_TYPE = 'variant'
 MAX_COMPOUND_HET_GENES = 1000
 
 XPOS_SORT_KEY = 'xpos'
+# Unique within an index, so paging with search_after never skips variants with otherwise identical sort values
+VARIANT_ID_SORT_KEY = 'variantId'
+
+
+ES_CLIENTS = {}
+ES_CLIENTS_PID = None
+ES_CLIENTS_LOCK = Lock()
+
+
+def get_es_client(timeout=None):
+    """Returns the elasticsearch client for this process, creating it if needed.
+
+    Clients hold a pool of keep-alive connections that is shared by all requests in the process. Clients created before
+    a fork are discarded, as connections can not be safely shared between processes.
+    """
+    global ES_CLIENTS_PID
+    timeout = timeout or settings.ELASTICSEARCH_TIMEOUT
+    with ES_CLIENTS_LOCK:
+        if ES_CLIENTS_PID != os.getpid():
+            ES_CLIENTS.clear()
+            ES_CLIENTS_PID = os.getpid()
+        if timeout not in ES_CLIENTS:
+            ES_CLIENTS[timeout] = elasticsearch.Elasticsearch(
+                host=settings.ELASTICSEARCH_SERVICE_HOSTNAME,
+                timeout=timeout,
+                retry_on_timeout=True,
+                maxsize=settings.ELASTICSEARCH_CONNECTION_POOL_SIZE,
+            )
+        return ES_CLIENTS[timeout]
+
+
+ES_SEARCH_THREAD_POOL = None
+ES_SEARCH_THREAD_POOL_PID = None
+
+
+def _get_search_thread_pool():
+    global ES_SEARCH_THREAD_POOL, ES_SEARCH_THREAD_POOL_PID
+    with ES_CLIENTS_LOCK:
+        if ES_SEARCH_THREAD_POOL_PID != os.getpid():
+            ES_SEARCH_THREAD_POOL = ThreadPool(processes=settings.ELASTICSEARCH_MAX_CONCURRENT_SEARCHES)
+            ES_SEARCH_THREAD_POOL_PID = os.getpid()
+        return ES_SEARCH_THREAD_POOL
+
+
+def _execute_concurrent_searches(searches, client):
+    """Executes the given searches at the same time, using a thread pool shared across the process to bound the number of
+    concurrent requests. Responses are returned in the same order as the searches."""
+    if len(searches) == 1:
+        return [searches[0].using(client).execute()]
+    return _get_search_thread_pool().map(lambda search: search.using(client).execute(), searches)
+
+
+INDEX_METADATA_CACHE_TIMEOUT = 60 * 60 * 24
+# map of index name -> (cache generation, metadata)
+INDEX_METADATA_CACHE = {}
 
 
-def get_es_client(timeout=30):
-    return elasticsearch.Elasticsearch(host=settings.ELASTICSEARCH_SERVICE_HOSTNAME, timeout=timeout, retry_on_timeout=True)
+def get_index_metadata(index_name, client, use_cache=True):
+    """Returns the parsed "_meta" mapping for each of the given comma-separated indices.
 
+    Index mappings only change when a dataset is (re)loaded, so the metadata is cached in this process and in redis.
+    The cached value should be cleared with clear_index_metadata_cache whenever an index is attached to samples.
+    """
+    index_metadata, generations = _get_cached_index_metadata(index_name.split(',')) if use_cache else ({}, None)
 
-def get_index_metadata(index_name, client):
+    uncached_index_names = [name for name in index_name.split(',') if name not in index_metadata]
+    if uncached_index_names:
+        loaded_index_metadata = _load_index_metadata(','.join(uncached_index_names), client)
+        if generations:
+            _set_cached_index_metadata(loaded_index_metadata, generations)
+        index_metadata.update(loaded_index_metadata)
+
+    return index_metadata
+
+
+def clear_index_metadata_cache(index_name):
+    """Clears the cached metadata for the given indices in every process, by moving them to a new cache generation"""
+    index_names = index_name.split(',')
+    for name in index_names:
+        INDEX_METADATA_CACHE.pop(name, None)
+    try:
+        redis_client = get_redis_client()
+        pipeline = redis_client.pipeline()
+        for name in index_names:
+            pipeline.incr(_index_metadata_generation_key(name))
+        pipeline.execute()
+    except Exception as e:
+        logger.warn("Unable to clear cached index metadata: {}".format(e))
+
+
+def _load_index_metadata(index_name, client):
     index = Index(index_name, using=client)
     try:
         mappings = index.get_mapping(doc_type=[VARIANT_DOC_TYPE])
@@ -46,6 +140,68 @@ def get_index_metadata(index_name, client):
     return index_metadata
 
 
+def _index_metadata_generation_key(index_name):
+    return 'index_metadata_generation__{}'.format(index_name)
+
+
+def _index_metadata_cache_key(index_name, generation):
+    # Metadata loaded before the cache was cleared is written to the previous generation's key, so it is never read
+    return 'index_metadata__{}__{}'.format(index_name, generation)
+
+
+def _get_cached_index_metadata(index_names):
+    """Returns the cached metadata for the given indices, and the current cache generation of each index.
+
+    Metadata cached in this process is only used if it is from the current generation, so it is never used once any
+    process clears it. Nothing is cached if redis is unavailable, as the generations can not be checked.
+    """
+    try:
+        redis_client = get_redis_client()
+        generations = dict(zip(index_names, [
+            int(generation or 0) for generation in
+            redis_client.mget([_index_metadata_generation_key(name) for name in index_names])]))
+    except Exception as e:
+        logger.warn("Unable to load cached index metadata: {}".format(e))
+        return {}, None
+
+    index_metadata = {}
+    for index_name in index_names:
+        generation, metadata = INDEX_METADATA_CACHE.get(index_name, (None, None))
+        if generation == generations[index_name]:
+            index_metadata[index_name] = metadata
+
+    redis_index_names = [index_name for index_name in index_names if index_name not in index_metadata]
+    if redis_index_names:
+        try:
+            cached_values = redis_client.mget([
+                _index_metadata_cache_key(name, generations[name]) for name in redis_index_names])
+            for index_name, cached_value in zip(redis_index_names, cached_values):
+                if cached_value:
+                    index_metadata[index_name] = json.loads(cached_value)
+                    INDEX_METADATA_CACHE[index_name] = (generations[index_name], index_metadata[index_name])
+        except Exception as e:
+            logger.warn("Unable to load cached index metadata: {}".format(e))
+
+    return index_metadata, generations
+
+
+def _set_cached_index_metadata(index_metadata, generations):
+    # aliases are loaded under their concrete index names, which have no known generation so can not be cached
+    index_metadata = {name: metadata for name, metadata in index_metadata.items() if name in generations}
+    for index_name, metadata in index_metadata.items():
+        INDEX_METADATA_CACHE[index_name] = (generations[index_name], metadata)
+    try:
+        redis_client = get_redis_client()
+        pipeline = redis_client.pipeline()
+        for index_name, metadata in index_metadata.items():
+            pipeline.set(
+                _index_metadata_cache_key(index_name, generations[index_name]), json.dumps(metadata),
+                ex=INDEX_METADATA_CACHE_TIMEOUT)
+        pipeline.execute()
+    except Exception as e:
+        logger.warn("Unable to cache index metadata: {}".format(e))
+
+
 def get_single_es_variant(families, variant_id):
     variants = EsSearch(families).filter(_single_variant_id_filter(variant_id)).search(num_results=1)
     if not variants:
@@ -62,31 +218,108 @@ def get_es_variants_for_variant_tuples(families, xpos_ref_alt_tuples):
 def get_es_variants(search_model, sort=XPOS_SORT_KEY, page=1, num_results=100, load_all=False):
     cache_key = 'search_results__{}__{}'.format(search_model.guid, sort)
     redis_client = None
-    previous_search_results = {}
+    cached_search_results = {}
     try:
-        redis_client = redis.StrictRedis(host=settings.REDIS_SERVICE_HOSTNAME, socket_connect_timeout=3)
-        previous_search_results = json.loads(redis_client.get(cache_key) or '{}')
+        redis_client = get_redis_client()
+        cached_search_results = _load_cached_search_results_summary(redis_client, cache_key)
     except Exception as e:
         logger.warn("Unable to connect to redis host: {}".format(settings.REDIS_SERVICE_HOSTNAME) + str(e))
 
-    total_results = previous_search_results.get('total_results')
+    total_results = cached_search_results.get('total_results')
     if load_all:
         num_results = total_results or 10000
     start_index = (page-1)*num_results
     end_index = page * num_results
-    if previous_search_results.get('total_results') is not None:
-        end_index = min(end_index, previous_search_results['total_results'])
-
-    loaded_results = previous_search_results.get('all_results') or []
-    if len(loaded_results) >= end_index:
-        return loaded_results[start_index:end_index], total_results
+    if cached_search_results.get('total_results') is not None:
+        end_index = min(end_index, cached_search_results['total_results'])
 
-    grouped_results = previous_search_results.get('grouped_results')
-    if grouped_results:
-        results = _get_compound_het_page(grouped_results, start_index, end_index)
+    loaded_result_count = cached_search_results.get(CACHED_RESULT_LENGTHS_KEY, {}).get('all_results', 0)
+    if loaded_result_count >= end_index:
+        results = _load_cached_results_range(redis_client, cache_key, 'all_results', start_index, end_index)
         if results is not None:
             return results, total_results
 
+    grouped_result_variant_counts = cached_search_results.get(GROUPED_RESULT_VARIANT_COUNTS_KEY)
+    if grouped_result_variant_counts:
+        page_range = _get_compound_het_page_range(grouped_result_variant_counts, start_index, end_index)
+        if page_range is not None:
+            grouped_results = _load_cached_results_range(redis_client, cache_key, 'grouped_results', *page_range)
+            if grouped_results is not None:
+                return [variant for variants in grouped_results for variant in variants.values()[0]], total_results
+
+    previous_search_results = {}
+    if cached_search_results:
+        previous_search_results = _load_cached_search_results(redis_client, cache_key, summary=cached_search_results)
+
+    es_search = _get_es_search(search_model, sort, previous_search_results)
+
+    variant_results = es_search.search(page=page, num_results=num_results)
+
+    try:
+        _set_cached_search_results(redis_client, cache_key, es_search.previous_search_results)
+    except Exception as e:
+        logger.warn("Unable to write to redis: {}".format(settings.REDIS_SERVICE_HOSTNAME) + str(e))
+
+    search_model.save()
+
+    return variant_results, es_search.previous_search_results['total_results']
+
+
+def get_es_variant_pages(search_model, sort=XPOS_SORT_KEY, num_results=100, max_results=None):
+    """Yields contiguous pages of variants for the given search, until all the results or max_results are loaded.
+
+    The cached search results are read once up front, and pages that are not cached are searched for with a single
+    EsSearch that keeps the loaded results in memory. The cache is written once the pages are exhausted, so paging
+    through a large search reads and writes the cached results once instead of for every page.
+    """
+    cache_key = 'search_results__{}__{}'.format(search_model.guid, sort)
+    redis_client = None
+    previous_search_results = {}
+    try:
+        redis_client = get_redis_client()
+        previous_search_results = _load_cached_search_results(redis_client, cache_key)
+    except Exception as e:
+        logger.warn("Unable to connect to redis host: {}".format(settings.REDIS_SERVICE_HOSTNAME) + str(e))
+
+    es_search = None
+    page = 1
+    try:
+        while True:
+            total_results = previous_search_results.get('total_results')
+            end_index = page * num_results
+            if total_results is not None:
+                end_index = min(end_index, total_results)
+            if max_results is not None:
+                end_index = min(end_index, max_results)
+            start_index = (page - 1) * num_results
+            if end_index <= start_index:
+                return
+
+            variants = None
+            if len(previous_search_results.get('all_results', [])) >= end_index:
+                variants = previous_search_results['all_results'][start_index:end_index]
+            elif previous_search_results.get('grouped_results'):
+                variants = _get_compound_het_page(previous_search_results['grouped_results'], start_index, end_index)
+            if variants is None:
+                if not es_search:
+                    es_search = _get_es_search(search_model, sort, previous_search_results)
+                variants = es_search.search(page=page, num_results=num_results)
+                previous_search_results = es_search.previous_search_results
+
+            if not variants:
+                return
+            yield variants[:end_index - start_index]
+            page += 1
+    finally:
+        if es_search:
+            try:
+                _set_cached_search_results(redis_client, cache_key, es_search.previous_search_results)
+            except Exception as e:
+                logger.warn("Unable to write to redis: {}".format(settings.REDIS_SERVICE_HOSTNAME) + str(e))
+            search_model.save()
+
+
+def _get_es_search(search_model, sort, previous_search_results):
     search = search_model.variant_search.search
 
     genes, intervals, invalid_items = parse_locus_list_items(search.get('locus', {}))
@@ -115,35 +348,78 @@ def get_es_variants(search_model, sort=XPOS_SORT_KEY, page=1, num_results=100, l
         quality_filter=search.get('qualityFilter'),
     )
 
-    variant_results = es_search.search(page=page, num_results=num_results)
+    return es_search
 
-    try:
-        redis_client.set(cache_key, json.dumps(es_search.previous_search_results))
-    except Exception as e:
-        logger.warn("Unable to write to redis: {}".format(settings.REDIS_SERVICE_HOSTNAME) + str(e))
 
-    search_model.save()
+class InvalidIndexException(Exception):
+    pass
 
-    return variant_results, es_search.previous_search_results['total_results']
 
+MIN_LOADED_DATE = datetime(1900, 1, 1, tzinfo=timezone.utc)
+LATEST_LOADED_SAMPLES_CACHE = OrderedDict()
+MAX_LATEST_LOADED_SAMPLES_CACHE_SIZE = 100
 
-class InvalidIndexException(Exception):
-    pass
 
+def get_latest_loaded_samples(families=None, include_index_sample_counts=False):
+    """Returns the most recently loaded variant call sample for each individual in the given families.
 
-def get_latest_loaded_samples(families=None):
-    all_samples = Sample.objects.filter(
+    If include_index_sample_counts is set, each sample is annotated with index_sample_count, the total number of samples
+    in its elasticsearch index. Everything is loaded in a single query.
+    """
+    loaded_samples = Sample.objects.filter(
         dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS,
         sample_status=Sample.SAMPLE_STATUS_LOADED,
         elasticsearch_index__isnull=False,
-    ).prefetch_related('individual', 'individual__family')
+    )
+    # Samples without a loaded date are only the latest for individuals with no dated samples, so missing dates are
+    # compared as the earliest possible date
+    loaded_date = Coalesce('loaded_date', Value(MIN_LOADED_DATE), output_field=DateTimeField())
+    max_loaded_date = loaded_samples.filter(individual=OuterRef('individual')).order_by().values('individual').annotate(
+        max_loaded_date=Max(loaded_date)).values('max_loaded_date')
+
+    all_samples = loaded_samples.select_related('individual__family').annotate(
+        coalesced_loaded_date=loaded_date,
+        max_loaded_date=Subquery(max_loaded_date, output_field=DateTimeField()),
+    ).filter(coalesced_loaded_date=F('max_loaded_date'))
     if families:
-        all_samples = all_samples.filter(individual__family__in=families,)
-    sample_individual_max_loaded_date = {
-        agg['individual__guid']: agg['max_loaded_date'] for agg in
-        all_samples.values('individual__guid').annotate(max_loaded_date=Max('loaded_date'))
-    }
-    return [s for s in all_samples if s.loaded_date == sample_individual_max_loaded_date[s.individual.guid]]
+        all_samples = all_samples.filter(individual__family__in=families)
+
+    if include_index_sample_counts:
+        index_sample_count = Sample.objects.filter(elasticsearch_index=OuterRef('elasticsearch_index')).order_by().values(
+            'elasticsearch_index').annotate(count=Count('id')).values('count')
+        all_samples = all_samples.annotate(
+            index_sample_count=Subquery(index_sample_count, output_field=IntegerField()))
+
+    return list(all_samples)
+
+
+def get_latest_loaded_samples_for_search(families):
+    """Returns the same samples as get_latest_loaded_samples with index sample counts, memoized for the given families.
+
+    The memoized samples are keyed on a version stamp of all the samples in the families' indices, so they are reloaded
+    whenever a sample or individual in any of those indices is added, removed or edited.
+    """
+    family_guids = tuple(sorted(family.guid for family in families))
+    if not family_guids:
+        return get_latest_loaded_samples(include_index_sample_counts=True)
+
+    index_samples = Sample.objects.filter(elasticsearch_index__in=Sample.objects.filter(
+        individual__family__guid__in=family_guids).values('elasticsearch_index'))
+    version_stamp = index_samples.aggregate(
+        count=Count('id'),
+        sample_last_modified=Max('last_modified_date'),
+        individual_last_modified=Max('individual__last_modified_date'),
+    )
+    cache_key = (family_guids, version_stamp['count'], version_stamp['sample_last_modified'],
+                 version_stamp['individual_last_modified'])
+
+    samples = LATEST_LOADED_SAMPLES_CACHE.get(cache_key)
+    if samples is None:
+        samples = get_latest_loaded_samples(families, include_index_sample_counts=True)
+        if len(LATEST_LOADED_SAMPLES_CACHE) >= MAX_LATEST_LOADED_SAMPLES_CACHE_SIZE:
+            LATEST_LOADED_SAMPLES_CACHE.popitem(last=False)
+        LATEST_LOADED_SAMPLES_CACHE[cache_key] = samples
+    return samples
 
 
 class EsSearch(object):
@@ -152,8 +428,10 @@ class EsSearch(object):
         self._client = get_es_client()
 
         self.samples_by_family_index = defaultdict(lambda: defaultdict(dict))
-        for s in get_latest_loaded_samples(families):
+        self.index_sample_counts = {}
+        for s in get_latest_loaded_samples_for_search(families):
             self.samples_by_family_index[s.elasticsearch_index][s.individual.family.guid][s.sample_id] = s
+            self.index_sample_counts[s.elasticsearch_index] = s.index_sample_count
 
         if len(self.samples_by_family_index) < 1:
             raise InvalidIndexException('No es index found')
@@ -165,6 +443,11 @@ class EsSearch(object):
                 ', '.join(set(self.samples_by_family_index.keys()) - set(self.index_metadata.keys()))
             ))
 
+        self._population_field_plans = {
+            index_name: _get_population_field_plans(metadata['fields'])
+            for index_name, metadata in self.index_metadata.items()
+        }
+
         self.previous_search_results = previous_search_results or {}
 
         self._search = Search()
@@ -181,7 +464,7 @@ class EsSearch(object):
 
     def sort(self, sort):
         self._sort = _get_sort(sort)
-        self._search = self._search.sort(*self._sort)
+        self._search = self._search.sort(*(self._sort + [VARIANT_ID_SORT_KEY]))
 
     def filter_by_annotations(self, annotations, pathogenicity_filter):
         consequences_filter, allowed_consequences = _annotations_filter(annotations)
@@ -211,8 +494,7 @@ class EsSearch(object):
         for index, family_samples_by_id in self.samples_by_family_index.items():
             if not inheritance and not quality_filter['min_ab'] and not quality_filter['min_gq']:
                 search_sample_count = sum(len(samples) for samples in family_samples_by_id.values())
-                index_sample_count = Sample.objects.filter(elasticsearch_index=index).count()
-                if search_sample_count == index_sample_count:
+                if search_sample_count == self.index_sample_counts[index]:
                     # If searching across all families in an index with no inheritance mode we do not need to explicitly
                     # filter on inheritance, as all variants have some inheritance for at least one family
                     continue
@@ -270,8 +552,18 @@ class EsSearch(object):
 
     def _execute_single_search(self, page, num_results, deduplicate=False, start_index=None):
         index_name = ','.join(self.samples_by_family_index.keys())
+
+        # Identical variants in different indices have identical sort values, so search_after can only be used to continue
+        # from the previously loaded results if they are not being deduplicated across indices
+        search_after = None
+        query_start_index = (page - 1) * num_results if start_index is None else start_index
+        if not deduplicate and query_start_index and \
+                query_start_index == len(self.previous_search_results.get('all_results', [])):
+            search_after = self.previous_search_results.get('search_after')
+
         search = self._get_paginated_searches(
-            index_name, page, num_results*len(self.samples_by_family_index), start_index=start_index
+            index_name, page, num_results*len(self.samples_by_family_index), start_index=start_index,
+            search_after=search_after,
         )[0]
 
         response = self._execute_search(search)
@@ -293,6 +585,8 @@ class EsSearch(object):
         if len(previous_all_results) >= results_start_index:
             self.previous_search_results['all_results'] = self.previous_search_results.get('all_results', []) + variant_results
             variant_results = self.previous_search_results['all_results'][results_start_index:]
+            if not deduplicate and variant_results:
+                self.previous_search_results['search_after'] = _get_search_after(response)
 
         return variant_results[:num_results]
 
@@ -305,22 +599,27 @@ class EsSearch(object):
         ms = MultiSearch()
         for index_name in indices:
             start_index = 0
+            search_after = None
             if self.previous_search_results['loaded_variant_counts'].get(index_name):
                 index_total = self.previous_search_results['loaded_variant_counts'][index_name]['total']
                 start_index = self.previous_search_results['loaded_variant_counts'][index_name]['loaded']
                 if start_index >= index_total:
                     continue
+                if start_index:
+                    search_after = self.previous_search_results['loaded_variant_counts'][index_name].get('search_after')
             else:
                 self.previous_search_results['loaded_variant_counts'][index_name] = {'loaded': 0, 'total': 0}
 
-            searches = self._get_paginated_searches(index_name, page, num_results, start_index=start_index)
+            searches = self._get_paginated_searches(
+                index_name, page, num_results, start_index=start_index, search_after=search_after
+            )
             ms = ms.index(index_name)
             for search in searches:
                 ms = ms.add(search)
 
         responses = self._execute_search(ms)
 
-        new_results = []
+        sorted_result_streams = []
         compound_het_results = self.previous_search_results.get('compound_het_results', [])
         for response in responses:
             response_hits, response_total, is_compound_het = self._parse_response(response)
@@ -332,9 +631,12 @@ class EsSearch(object):
                 compound_het_results += response_hits
                 self.previous_search_results['loaded_variant_counts']['{}_compound_het'.format(index_name)] = {'total': response_total}
             else:
-                new_results += response_hits
+                sorted_result_streams.append(response_hits)
                 self.previous_search_results['loaded_variant_counts'][index_name]['total'] = response_total
                 self.previous_search_results['loaded_variant_counts'][index_name]['loaded'] += len(response_hits)
+                if response_hits:
+                    self.previous_search_results['loaded_variant_counts'][index_name]['search_after'] = \
+                        _get_search_after(response)
 
         self.previous_search_results['total_results'] = sum(counts['total'] for counts in self.previous_search_results['loaded_variant_counts'].values())
 
@@ -343,12 +645,12 @@ class EsSearch(object):
         previous_page_record_count = (page - 1) * num_results
         if len(all_loaded_results) >= previous_page_record_count:
             loaded_results = all_loaded_results[:previous_page_record_count]
-            new_results += all_loaded_results[previous_page_record_count:]
+            sorted_result_streams.append(all_loaded_results[previous_page_record_count:])
         else:
             loaded_results = []
-            new_results += self.previous_search_results.get('variant_results', [])
+            sorted_result_streams.append(self.previous_search_results.get('variant_results', []))
 
-        new_results = sorted(new_results, key=lambda variant: variant['_sort'])
+        new_results = _merge_sorted_variants(sorted_result_streams)
         variant_results = self._deduplicate_results(new_results)
 
         if compound_het_results or self.previous_search_results.get('grouped_results'):
@@ -359,7 +661,7 @@ class EsSearch(object):
             self.previous_search_results['all_results'] = loaded_results + variant_results
             return variant_results[:num_results]
 
-    def _get_paginated_searches(self, index_name, page, num_results, start_index=None):
+    def _get_paginated_searches(self, index_name, page, num_results, start_index=None, search_after=None):
         searches = []
         for search in self._index_searches.get(index_name, [self._search]):
             search = search.index(index_name)
@@ -373,7 +675,12 @@ class EsSearch(object):
                 if start_index is None:
                     start_index = end_index - num_results
 
-                search = search[start_index:end_index]
+                if search_after and self._sort:
+                    # Continue from the last loaded result instead of an offset, so ES does not need to re-collect
+                    # all the preceding results for every page
+                    search = search.extra(search_after=search_after, size=end_index - start_index)
+                else:
+                    search = search[start_index:end_index]
                 search = search.source(QUERY_FIELD_NAMES)
                 logger.info('Loading {} records {}-{}'.format(index_name, start_index, end_index))
 
@@ -383,6 +690,10 @@ class EsSearch(object):
     def _execute_search(self, search):
         logger.debug(json.dumps(search.to_dict(), indent=2))
         try:
+            if isinstance(search, MultiSearch):
+                # The searches are independent so they are sent separately and run concurrently, so the latency is that
+                # of the slowest search instead of all of them
+                return _execute_concurrent_searches(list(search), self._client)
             return search.using(self._client).execute()
         except elasticsearch.exceptions.ConnectionTimeout as e:
             canceled = self._delete_long_running_tasks()
@@ -397,7 +708,15 @@ class EsSearch(object):
         response_total = response.hits.total
         logger.info('Total hits: {} ({} seconds)'.format(response_total, response.took / 1000.0))
 
-        return [self._parse_hit(hit) for hit in response], response_total, False
+        hits = list(response)
+        lifted_over_positions = self._liftover_hits(hits)
+        return [self._parse_hit(hit, lifted_over_positions) for hit in hits], response_total, False
+
+    def _liftover_hits(self, hits):
+        return liftover_grch38_to_grch37_many([
+            (hit['contig'], int(hit['start'])) for hit in hits
+            if self.index_metadata[hit.meta.index].get('genomeVersion') == GENOME_VERSION_GRCh38
+        ])
 
     def _parse_compound_het_response(self, response):
         if len(response.aggregations.genes.buckets) > MAX_COMPOUND_HET_GENES:
@@ -413,7 +732,9 @@ class EsSearch(object):
 
         variants_by_gene = {}
         for gene_agg in response.aggregations.genes.buckets:
-            gene_variants = [self._parse_hit(hit) for hit in gene_agg['vars_by_gene']]
+            gene_hits = list(gene_agg['vars_by_gene'])
+            lifted_over_positions = self._liftover_hits(gene_hits)
+            gene_variants = [self._parse_hit(hit, lifted_over_positions) for hit in gene_hits]
             gene_id = gene_agg['key']
 
             if gene_id in variants_by_gene:
@@ -478,8 +799,9 @@ class EsSearch(object):
 
         return [{k: v} for k, v in variants_by_gene.items()], total_compound_het_results
 
-    def _parse_hit(self, raw_hit):
-        hit = {k: raw_hit[k] for k in QUERY_FIELD_NAMES if k in raw_hit}
+    def _parse_hit(self, raw_hit, lifted_over_positions=None):
+        # Read fields from the underlying source dict, as accessing them through the response object wraps each value
+        hit = raw_hit.to_dict()
         index_name = raw_hit.meta.index
         index_family_samples = self.samples_by_family_index[index_name]
 
@@ -496,53 +818,44 @@ class EsSearch(object):
         genotypes = {}
         for family_guid in family_guids:
             samples_by_id = index_family_samples[family_guid]
-            genotypes.update({
-                samples_by_id[genotype_hit['sample_id']].individual.guid: _get_field_values(genotype_hit, GENOTYPE_FIELDS_CONFIG)
-                for genotype_hit in hit[GENOTYPES_FIELD_KEY] if genotype_hit['sample_id'] in samples_by_id
-            })
+            for genotype_hit in hit[GENOTYPES_FIELD_KEY]:
+                sample = samples_by_id.get(genotype_hit['sample_id'])
+                if sample:
+                    genotypes[sample.individual.guid] = _apply_field_plan(genotype_hit, GENOTYPE_FIELD_PLAN)
 
         genome_version = self.index_metadata[index_name].get('genomeVersion')
         lifted_over_genome_version = None
         lifted_over_chrom = None
         lifted_over_pos = None
-        liftover_grch38_to_grch37 = _liftover_grch38_to_grch37()
-        if liftover_grch38_to_grch37 and genome_version == GENOME_VERSION_GRCh38:
-            if liftover_grch38_to_grch37:
-                grch37_coord = liftover_grch38_to_grch37.convert_coordinate(
-                    'chr{}'.format(hit['contig'].lstrip('chr')), int(hit['start'])
-                )
-                if grch37_coord and grch37_coord[0]:
-                    lifted_over_genome_version = GENOME_VERSION_GRCh37
-                    lifted_over_chrom = grch37_coord[0][0].lstrip('chr')
-                    lifted_over_pos = grch37_coord[0][1]
+        if genome_version == GENOME_VERSION_GRCh38:
+            position = (hit['contig'], int(hit['start']))
+            if lifted_over_positions and position in lifted_over_positions:
+                grch37_coord = lifted_over_positions[position]
+            else:
+                grch37_coord = liftover_grch38_to_grch37(*position)
+            if grch37_coord:
+                lifted_over_genome_version = GENOME_VERSION_GRCh37
+                lifted_over_chrom = grch37_coord[0].lstrip('chr')
+                lifted_over_pos = grch37_coord[1]
 
         populations = {
-            population: _get_field_values(
-                hit, POPULATION_RESPONSE_FIELD_CONFIGS, format_response_key=lambda key: key.lower(),
-                lookup_field_prefix=population,
-                existing_fields=self.index_metadata[index_name]['fields'],
-                get_addl_fields=lambda field, field_config:
-                [pop_config.get(field)] + ['{}_{}'.format(population, custom_field) for custom_field in
-                                           field_config.get('fields', [])],
-            )
-            for population, pop_config in POPULATIONS.items()
+            population: _apply_field_plan(hit, field_plan)
+            for population, field_plan in self._population_field_plans[index_name]
         }
 
         sorted_transcripts = [
-            {_to_camel_case(k): v for k, v in transcript.to_dict().items()}
-            for transcript in hit[SORTED_TRANSCRIPTS_FIELD_KEY] or []
+            {_transcript_response_key(k): v for k, v in transcript.items()}
+            for transcript in hit.get(SORTED_TRANSCRIPTS_FIELD_KEY) or []
         ]
         transcripts = defaultdict(list)
         for transcript in sorted_transcripts:
             transcripts[transcript['geneId']].append(transcript)
 
-        result = _get_field_values(hit, CORE_FIELDS_CONFIG, format_response_key=str)
-        result.update({
-            field_name: _get_field_values(hit, fields, lookup_field_prefix=field_name)
-            for field_name, fields in NESTED_FIELDS.items()
-        })
+        result = _apply_field_plan(hit, CORE_FIELD_PLAN)
+        for field_name, field_plan in NESTED_FIELD_PLANS:
+            result[field_name] = _apply_field_plan(hit, field_plan)
         if hasattr(raw_hit.meta, 'sort'):
-            result['_sort'] = [_parse_es_sort(sort, self._sort[i]) for i, sort in enumerate(raw_hit.meta.sort)]
+            result['_sort'] = [_parse_es_sort(sort, sort_config) for sort, sort_config in zip(raw_hit.meta.sort, self._sort)]
 
         result.update({
             'familyGuids': sorted(family_guids),
@@ -553,9 +866,7 @@ class EsSearch(object):
             'liftedOverPos': lifted_over_pos,
             'mainTranscript': sorted_transcripts[0] if len(sorted_transcripts) else {},
             'populations': populations,
-            'predictions': _get_field_values(
-                hit, PREDICTION_FIELDS_CONFIG, format_response_key=lambda key: key.split('_')[1].lower()
-            ),
+            'predictions': _apply_field_plan(hit, PREDICTION_FIELD_PLAN),
             'transcripts': transcripts,
         })
         return result
@@ -977,7 +1288,8 @@ SORT_FIELDS = {
             'type': 'number',
             'script': {
                 'params': {
-                    'omim_gene_ids': lambda *args: [omim.gene.gene_id for omim in Omim.objects.filter(phenotype_mim_number__isnull=False).only('gene__gene_id')]
+                    'omim_gene_ids': lambda *args: sorted(set(Omim.objects.filter(
+                        phenotype_mim_number__isnull=False).values_list('gene__gene_id', flat=True)))
                 },
                 'source': "params.omim_gene_ids.contains(doc['mainTranscript_gene_id'].value) ? 0 : 1"
             }
@@ -999,8 +1311,8 @@ SORT_FIELDS = {
             'script': {
                 'params': {
                     'constraint_ranks_by_gene': lambda *args: {
-                        constraint.gene.gene_id: constraint.mis_z_rank + constraint.pLI_rank
-                        for constraint in GeneConstraint.objects.all().only('gene__gene_id', 'mis_z_rank', 'pLI_rank')}
+                        gene_id: mis_z_rank + pLI_rank for gene_id, mis_z_rank, pLI_rank in
+                        GeneConstraint.objects.values_list('gene__gene_id', 'mis_z_rank', 'pLI_rank')}
                 },
                 'source': "params.constraint_ranks_by_gene.getOrDefault(doc['mainTranscript_gene_id'].value, 1000000000)"
             }
@@ -1010,20 +1322,45 @@ SORT_FIELDS = {
 }
 
 
+# Reference data models the sort script params are computed from
+SORT_SCRIPT_PARAMS_MODELS = {
+    'in_omim': Omim,
+    'constraint': GeneConstraint,
+}
+SORT_SCRIPT_PARAMS_CACHE = {}
+
+
 def _get_sort(sort_key):
-    sorts = SORT_FIELDS.get(sort_key, [])
+    sorts = list(SORT_FIELDS.get(sort_key, []))
 
     # Add parameters to scripts
     if len(sorts) and isinstance(sorts[0], dict) and sorts[0].get('_script', {}).get('script', {}).get('params'):
-        for key, val_func in sorts[0]['_script']['script']['params'].items():
-            if not (isinstance(val_func, dict) or isinstance(val_func, list)):
-                sorts[0]['_script']['script']['params'][key] = val_func()
+        script_sort = deepcopy(sorts[0])
+        script_sort['_script']['script']['params'] = _get_sort_script_params(
+            sort_key, sorts[0]['_script']['script']['params'])
+        sorts[0] = script_sort
 
     if XPOS_SORT_KEY not in sorts:
         sorts.append(XPOS_SORT_KEY)
     return sorts
 
 
+def _get_sort_script_params(sort_key, param_funcs):
+    """Returns the computed params for a sort script.
+
+    The params are memoized in process and recomputed only when the version of the reference data they are computed
+    from changes, i.e. after update_omim or update_gene_constraint reload the table.
+    """
+    version = get_reference_data_version(SORT_SCRIPT_PARAMS_MODELS[sort_key])
+    version_params = SORT_SCRIPT_PARAMS_CACHE.get(sort_key)
+    if version_params and version_params[0] == version:
+        return version_params[1]
+
+    params = {key: val_func() for key, val_func in param_funcs.items()}
+    SORT_SCRIPT_PARAMS_CACHE[sort_key] = (version, params)
+    return params
+
+
 CLINVAR_FIELDS = ['clinical_significance', 'variation_id', 'allele_id', 'gold_stars']
 HGMD_FIELDS = ['accession', 'class']
 GENOTYPES_FIELD_KEY = 'genotypes'
@@ -1092,23 +1429,124 @@ for population, pop_config in POPULATIONS.items():
         QUERY_FIELD_NAMES += ['{}_{}'.format(population, custom_field) for custom_field in field_config.get('fields', [])]
 
 
+def _merge_sorted_variants(sorted_variant_lists):
+    """Merges lists of variants that are each already sorted. Variants with the same sort are returned in the order of the
+    lists they came from, so the result is the same as a stable sort of the concatenated lists."""
+    def _decorate(list_index, variants):
+        for i, variant in enumerate(variants):
+            yield variant['_sort'], list_index, i, variant
+
+    decorated_lists = [_decorate(list_index, variants) for list_index, variants in enumerate(sorted_variant_lists)]
+    return [variant for _, _, _, variant in heapq.merge(*decorated_lists)]
+
+
 def _sort_compound_hets(grouped_variants):
     return sorted(grouped_variants, key=lambda variants: variants.values()[0][0]['_sort'])
 
 
 def _get_compound_het_page(grouped_variants, start_index, end_index):
+    page_range = _get_compound_het_page_range(
+        [len(variants.values()[0]) for variants in grouped_variants], start_index, end_index)
+    if page_range is None:
+        return None
+    start_group, end_group = page_range
+    return [variant for variants in grouped_variants[start_group:end_group] for variant in variants.values()[0]]
+
+
+def _get_compound_het_page_range(group_variant_counts, start_index, end_index):
+    """Returns the range of variant groups needed to return the requested page of variants, or None if more groups are
+    needed than are given."""
     skipped = 0
-    variant_results = []
-    for i, variants in enumerate(grouped_variants):
+    num_loaded = 0
+    start_group = None
+    for i, num_variants in enumerate(group_variant_counts):
         if skipped < start_index:
-            skipped += len(variants.values()[0])
+            skipped += num_variants
         else:
-            variant_results += variants.values()[0]
-        if len(variant_results) + skipped >= end_index:
-            return variant_results
+            if start_group is None:
+                start_group = i
+            num_loaded += num_variants
+        if num_loaded + skipped >= end_index:
+            return (i + 1 if start_group is None else start_group), i + 1
     return None
 
 
+# Search results are cached in redis as compressed json. Result lists are split into separately stored chunks so loading
+# a page of results only needs to fetch and decompress the chunks in that page
+SEARCH_RESULTS_CHUNK_SIZE = 100
+CHUNKED_SEARCH_RESULT_FIELDS = ['all_results', 'grouped_results']
+CACHED_RESULT_LENGTHS_KEY = 'chunked_result_lengths'
+GROUPED_RESULT_VARIANT_COUNTS_KEY = 'grouped_result_variant_counts'
+
+
+def _compress_json(value):
+    return zlib.compress(json.dumps(value))
+
+
+def _decompress_json(value):
+    return json.loads(zlib.decompress(value))
+
+
+def _chunk_cache_key(cache_key, field, chunk):
+    return '{}__{}__{}'.format(cache_key, field, chunk)
+
+
+def _load_cached_search_results_summary(redis_client, cache_key):
+    cached_summary = redis_client.get(cache_key)
+    return _decompress_json(cached_summary) if cached_summary else {}
+
+
+def _load_cached_results_range(redis_client, cache_key, field, start_index, end_index):
+    if end_index <= start_index:
+        return []
+    start_chunk = start_index // SEARCH_RESULTS_CHUNK_SIZE
+    end_chunk = (end_index - 1) // SEARCH_RESULTS_CHUNK_SIZE
+    cached_chunks = redis_client.mget([
+        _chunk_cache_key(cache_key, field, chunk) for chunk in range(start_chunk, end_chunk + 1)])
+    if any(cached_chunk is None for cached_chunk in cached_chunks):
+        logger.warn('Cached search results "{}" are missing {} records'.format(cache_key, field))
+        return None
+    results = []
+    for cached_chunk in cached_chunks:
+        results += _decompress_json(cached_chunk)
+    chunk_start_index = start_chunk * SEARCH_RESULTS_CHUNK_SIZE
+    return results[start_index - chunk_start_index:end_index - chunk_start_index]
+
+
+def _load_cached_search_results(redis_client, cache_key, summary=None):
+    if summary is None:
+        summary = _load_cached_search_results_summary(redis_client, cache_key)
+    search_results = {
+        k: v for k, v in summary.items() if k not in {CACHED_RESULT_LENGTHS_KEY, GROUPED_RESULT_VARIANT_COUNTS_KEY}
+    }
+    for field, num_results in summary.get(CACHED_RESULT_LENGTHS_KEY, {}).items():
+        search_results[field] = _load_cached_results_range(redis_client, cache_key, field, 0, num_results)
+        if search_results[field] is None:
+            # Partially evicted results can not be reused, so the search is rerun from scratch
+            return {}
+    return search_results
+
+
+def _set_cached_search_results(redis_client, cache_key, search_results):
+    summary = {k: v for k, v in search_results.items() if k not in CHUNKED_SEARCH_RESULT_FIELDS}
+    summary[CACHED_RESULT_LENGTHS_KEY] = {}
+    if search_results.get('grouped_results'):
+        summary[GROUPED_RESULT_VARIANT_COUNTS_KEY] = [
+            len(variants.values()[0]) for variants in search_results['grouped_results']]
+
+    pipeline = redis_client.pipeline()
+    for field in CHUNKED_SEARCH_RESULT_FIELDS:
+        results = search_results.get(field)
+        if results is None:
+            continue
+        summary[CACHED_RESULT_LENGTHS_KEY][field] = len(results)
+        for chunk, i in enumerate(range(0, len(results), SEARCH_RESULTS_CHUNK_SIZE)):
+            pipeline.set(
+                _chunk_cache_key(cache_key, field, chunk), _compress_json(results[i:i + SEARCH_RESULTS_CHUNK_SIZE]))
+    pipeline.set(cache_key, _compress_json(summary))
+    pipeline.execute()
+
+
 #  TODO move liftover to hail pipeline once upgraded to 0.2
 LIFTOVER_GRCH38_TO_GRCH37 = None
 def _liftover_grch38_to_grch37():
@@ -1121,6 +1559,75 @@ def _liftover_grch38_to_grch37():
     return LIFTOVER_GRCH38_TO_GRCH37
 
 
+LIFTOVER_CACHE_SIZE = 100000
+LIFTOVER_GRCH38_TO_GRCH37_CACHE = OrderedDict()
+LIFTOVER_CACHE_LOCK = Lock()
+
+
+def liftover_grch38_to_grch37(chrom, pos):
+    """Returns the GRCh37 (chrom, pos) for the given GRCh38 position, or None if it can not be lifted over"""
+    return liftover_grch38_to_grch37_many([(chrom, pos)])[(chrom, pos)]
+
+
+def liftover_grch38_to_grch37_many(positions):
+    """Lifts over all the given GRCh38 (chrom, pos) positions at once.
+
+    Returns a dictionary mapping each position to its GRCh37 (chrom, pos), or to None if it can not be lifted over.
+    Conversions are memoized in a least recently used cache, as the same positions are searched repeatedly
+    """
+    lifted_over = {}
+    positions_to_convert = defaultdict(list)
+    with LIFTOVER_CACHE_LOCK:
+        for chrom, pos in set(positions):
+            key = ('chr{}'.format(chrom.lstrip('chr')), int(pos))
+            if key in LIFTOVER_GRCH38_TO_GRCH37_CACHE:
+                # Re-insert to mark as recently used
+                coord = LIFTOVER_GRCH38_TO_GRCH37_CACHE.pop(key)
+                LIFTOVER_GRCH38_TO_GRCH37_CACHE[key] = coord
+                lifted_over[(chrom, pos)] = coord
+            else:
+                positions_to_convert[key].append((chrom, pos))
+
+    if not positions_to_convert:
+        return lifted_over
+
+    liftover = _liftover_grch38_to_grch37()
+    converted = {}
+    for key, input_positions in positions_to_convert.items():
+        coord = None
+        if liftover:
+            grch37_coord = liftover.convert_coordinate(*key)
+            if grch37_coord and grch37_coord[0]:
+                coord = (grch37_coord[0][0], grch37_coord[0][1])
+            converted[key] = coord
+        for position in input_positions:
+            lifted_over[position] = coord
+
+    with LIFTOVER_CACHE_LOCK:
+        LIFTOVER_GRCH38_TO_GRCH37_CACHE.update(converted)
+        while len(LIFTOVER_GRCH38_TO_GRCH37_CACHE) > LIFTOVER_CACHE_SIZE:
+            LIFTOVER_GRCH38_TO_GRCH37_CACHE.popitem(last=False)
+
+    return lifted_over
+
+
+def _get_search_after(response):
+    """Returns the raw sort values of the last hit in the response, to be used as search_after for the next page.
+
+    Returns None if there are no sort values or they can not be passed back to ES (ie. missing or infinite values)
+    """
+    hits = list(response)
+    sort = getattr(hits[-1].meta, 'sort', None) if hits else None
+    if not sort:
+        return None
+    sort = list(sort)
+    for value in sort:
+        if value is None or value in {'Infinity', '-Infinity'} or (
+                isinstance(value, float) and (math.isinf(value) or math.isnan(value))):
+            return None
+    return sort
+
+
 def _parse_es_sort(sort, sort_config):
     if hasattr(sort_config, 'values') and any(cfg.get('order') == 'desc' for cfg in sort_config.values()):
         if sort == 'Infinity':
@@ -1141,21 +1648,68 @@ def _parse_es_sort(sort, sort_config):
     return sort
 
 
-def _get_field_values(hit, field_configs, format_response_key=_to_camel_case, get_addl_fields=None, lookup_field_prefix='', existing_fields=None):
-    return {
-        field_config.get('response_key', format_response_key(field)): _value_if_has_key(
-            hit,
-            (get_addl_fields(field, field_config) if get_addl_fields else []) +
-            ['{}_{}'.format(lookup_field_prefix, field) if lookup_field_prefix else field],
+def _get_field_plan(field_configs, format_response_key=_to_camel_case, get_addl_fields=None, lookup_field_prefix='', existing_fields=None):
+    """Precomputes how each configured field is looked up in and formatted from a hit, so the configs are not rebuilt
+    for every parsed hit.
+
+    Returns a list of (response_key, lookup_keys, format_value, default_value, missing_value) tuples, to be used with
+    _apply_field_plan
+    """
+    field_plan = []
+    for field, field_config in field_configs.items():
+        keys = (get_addl_fields(field, field_config) if get_addl_fields else []) + \
+               ['{}_{}'.format(lookup_field_prefix, field) if lookup_field_prefix else field]
+        default_value = field_config.get('default_value')
+        missing_value = default_value if not existing_fields or any(key in existing_fields for key in keys) else None
+        field_plan.append((
+            field_config.get('response_key', format_response_key(field)), keys, field_config.get('format_value'),
+            default_value, missing_value,
+        ))
+    return field_plan
+
+
+def _apply_field_plan(hit, field_plan):
+    """Returns the values for the fields in the plan, using the first lookup key present in the hit"""
+    result = {}
+    for response_key, keys, format_value, default_value, missing_value in field_plan:
+        value = missing_value
+        for key in keys:
+            if key in hit:
+                value = hit[key]
+                if format_value:
+                    value = format_value(default_value if value is None else value)
+                break
+        result[response_key] = value
+    return result
+
+
+def _get_population_field_plans(existing_fields):
+    return [(
+        population, _get_field_plan(
+            POPULATION_RESPONSE_FIELD_CONFIGS, format_response_key=lambda key: key.lower(),
+            lookup_field_prefix=population,
             existing_fields=existing_fields,
-            **field_config
-        )
-        for field, field_config in field_configs.items()
-    }
+            get_addl_fields=lambda field, field_config:
+            [pop_config.get(field)] + ['{}_{}'.format(population, custom_field) for custom_field in
+                                       field_config.get('fields', [])],
+        )) for population, pop_config in POPULATIONS.items()]
+
+
+TRANSCRIPT_RESPONSE_KEYS = {}
+
+
+def _transcript_response_key(key):
+    response_key = TRANSCRIPT_RESPONSE_KEYS.get(key)
+    if response_key is None:
+        response_key = _to_camel_case(key)
+        TRANSCRIPT_RESPONSE_KEYS[key] = response_key
+    return response_key
 
 
-def _value_if_has_key(hit, keys, format_value=None, default_value=None, existing_fields=None, **kwargs):
-    for key in keys:
-        if key in hit:
-            return format_value(default_value if hit[key] is None else hit[key]) if format_value else hit[key]
-    return default_value if not existing_fields or any(key in existing_fields for key in keys) else None
+CORE_FIELD_PLAN = _get_field_plan(CORE_FIELDS_CONFIG, format_response_key=str)
+PREDICTION_FIELD_PLAN = _get_field_plan(
+    PREDICTION_FIELDS_CONFIG, format_response_key=lambda key: key.split('_')[1].lower())
+GENOTYPE_FIELD_PLAN = _get_field_plan(GENOTYPE_FIELDS_CONFIG)
+NESTED_FIELD_PLANS = [
+    (field_name, _get_field_plan(fields, lookup_field_prefix=field_name)) for field_name, fields in NESTED_FIELDS.items()
+]
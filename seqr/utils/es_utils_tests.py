@@ -1,12 +1,18 @@
 from copy import deepcopy
 import mock
 import json
+from elasticsearch_dsl import Search
 
 from django.test import TestCase
+from django.utils import timezone
 
+from reference_data.models import Omim
 from seqr.models import Family, Sample, VariantSearch, VariantSearchResults
 from seqr.utils.es_utils import get_es_variants_for_variant_tuples, get_single_es_variant, get_es_variants, \
-    _genotype_inheritance_filter
+    get_es_variant_pages, get_es_client, get_index_metadata, clear_index_metadata_cache, get_latest_loaded_samples, \
+    get_latest_loaded_samples_for_search, _genotype_inheritance_filter, _load_cached_search_results, \
+    _set_cached_search_results, _execute_concurrent_searches, _merge_sorted_variants, liftover_grch38_to_grch37, \
+    liftover_grch38_to_grch37_many, LIFTOVER_GRCH38_TO_GRCH37_CACHE, _get_sort
 
 INDEX_NAME = 'test_index'
 SECOND_INDEX_NAME = 'test_index_second'
@@ -764,6 +770,8 @@ def _set_cache(k, v):
 MOCK_REDIS = mock.MagicMock()
 MOCK_REDIS.get.side_effect = REDIS_CACHE.get
 MOCK_REDIS.set.side_effect =_set_cache
+MOCK_REDIS.mget.side_effect = lambda keys: [REDIS_CACHE.get(key) for key in keys]
+MOCK_REDIS.pipeline.return_value = MOCK_REDIS
 
 
 class MockHit:
@@ -783,16 +791,13 @@ class MockHit:
         else:
             del self.meta.sort
         self._dict = _source
-        mock_transcripts = []
-        for transcript in self._dict['sortedTranscriptConsequences']:
-            mock_transcript = mock.MagicMock()
-            mock_transcript.to_dict.return_value = transcript
-            mock_transcripts.append(mock_transcript)
-        self._dict['sortedTranscriptConsequences'] = mock_transcripts
 
     def __getitem__(self, key):
         return self._dict[key]
 
+    def to_dict(self):
+        return self._dict
+
     def __iter__(self):
         return self._dict.__iter__()
 
@@ -828,7 +833,7 @@ def create_mock_response(search, index=INDEX_NAME):
     return mock_response
 
 
-@mock.patch('seqr.utils.es_utils.redis.StrictRedis', lambda **kwargs: MOCK_REDIS)
+@mock.patch('seqr.utils.redis_utils.redis.StrictRedis', lambda **kwargs: MOCK_REDIS)
 @mock.patch('seqr.utils.es_utils.get_index_metadata', lambda index_name, client: {k: {'genomeVersion': '37', 'fields': MAPPING_FIELDS} for k in index_name.split(',')})
 class EsUtilsTest(TestCase):
     fixtures = ['users', '1kg_project', 'reference_data']
@@ -852,11 +857,14 @@ class EsUtilsTest(TestCase):
         patcher.start().side_effect = mock_execute_search
         self.addCleanup(patcher.stop)
 
-    def assertExecutedSearch(self, filters=None, start_index=0, size=2, sort=None, gene_aggs=False, index=INDEX_NAME):
+    def assertExecutedSearch(self, filters=None, start_index=0, size=2, sort=None, gene_aggs=False, index=INDEX_NAME, search_after=None):
         self.assertIsInstance(self.executed_search, dict)
         self.assertEqual(self.searched_indices, [index])
         self.assertSameSearch(
-            self.executed_search, dict(filters=filters, start_index=start_index, size=size, sort=sort, gene_aggs=gene_aggs)
+            self.executed_search, dict(
+                filters=filters, start_index=start_index, size=size, sort=sort, gene_aggs=gene_aggs,
+                search_after=search_after,
+            )
         )
         self.executed_search = None
         self.searched_indices = []
@@ -877,12 +885,16 @@ class EsUtilsTest(TestCase):
                     'filter': expected_search_params['filters']
                 }
             },
-            'from': expected_search_params['start_index'],
             'size': expected_search_params['size']
         }
 
+        if expected_search_params.get('search_after'):
+            expected_search['search_after'] = expected_search_params['search_after']
+        else:
+            expected_search['from'] = expected_search_params['start_index']
+
         if expected_search_params.get('sort'):
-            expected_search['sort'] = expected_search_params['sort']
+            expected_search['sort'] = expected_search_params['sort'] + ['variantId']
 
         if expected_search_params.get('gene_aggs'):
             expected_search['aggs'] = {
@@ -901,7 +913,10 @@ class EsUtilsTest(TestCase):
         self.assertSetEqual(SOURCE_FIELDS, set(source))
 
     def assertCachedResults(self, results_model, expected_results, sort='xpos'):
-        self.assertDictEqual(json.loads(REDIS_CACHE.get('search_results__{}__{}'.format(results_model.guid, sort))), expected_results)
+        self.assertDictEqual(
+            _load_cached_search_results(MOCK_REDIS, 'search_results__{}__{}'.format(results_model.guid, sort)),
+            expected_results
+        )
 
     def test_get_es_variants_for_variant_tuples(self):
         variants = get_es_variants_for_variant_tuples(
@@ -935,22 +950,28 @@ class EsUtilsTest(TestCase):
         self.assertDictEqual(variants[1], PARSED_VARIANTS[1])
         self.assertEqual(total_results, 5)
 
-        self.assertCachedResults(results_model, {'all_results': variants, 'total_results': 5})
+        self.assertCachedResults(results_model, {
+            'all_results': variants, 'total_results': 5, 'search_after': [2103343353],
+        })
 
         self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'])
 
         # does not save non-consecutive pages
         variants, total_results = get_es_variants(results_model, page=3, num_results=2)
         self.assertEqual(total_results, 5)
-        self.assertCachedResults(results_model, {'all_results': variants, 'total_results': 5})
+        self.assertCachedResults(results_model, {
+            'all_results': variants, 'total_results': 5, 'search_after': [2103343353],
+        })
         self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'], start_index=4, size=2)
 
-        # test pagination
+        # test pagination continues from the last loaded variant
         variants, total_results = get_es_variants(results_model, page=2, num_results=2)
         self.assertEqual(len(variants), 2)
         self.assertEqual(total_results, 5)
-        self.assertCachedResults(results_model, {'all_results': PARSED_VARIANTS + PARSED_VARIANTS, 'total_results': 5})
-        self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'], start_index=2, size=2)
+        self.assertCachedResults(results_model, {
+            'all_results': PARSED_VARIANTS + PARSED_VARIANTS, 'total_results': 5, 'search_after': [2103343353],
+        })
+        self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'], search_after=[2103343353], size=2)
 
         # test does not re-fetch page
         variants, total_results = get_es_variants(results_model, page=1, num_results=3)
@@ -961,10 +982,36 @@ class EsUtilsTest(TestCase):
 
         # test load_all
         variants, _ = get_es_variants(results_model, page=1, load_all=True)
-        self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'], start_index=4, size=1)
+        self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'], search_after=[2103343353], size=1)
         self.assertEqual(len(variants), 5)
         self.assertListEqual(variants, PARSED_VARIANTS + PARSED_VARIANTS + PARSED_VARIANTS[:1])
 
+    def test_get_es_variant_pages(self):
+        search_model = VariantSearch.objects.create(search={})
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        results_model.families.set(self.families)
+
+        MOCK_REDIS.pipeline.reset_mock()
+        pages = get_es_variant_pages(results_model, num_results=2)
+        self.assertListEqual(next(pages), PARSED_VARIANTS)
+        self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'])
+        self.assertListEqual(next(pages), PARSED_VARIANTS)
+        self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'], search_after=[2103343353], size=2)
+        self.assertListEqual(list(pages), [PARSED_VARIANTS[:1]])
+        self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'], search_after=[2103343353], size=2)
+
+        # the cached results are written once all the pages are loaded
+        MOCK_REDIS.pipeline.assert_called_once_with()
+        self.assertCachedResults(results_model, {
+            'all_results': PARSED_VARIANTS + PARSED_VARIANTS + PARSED_VARIANTS, 'total_results': 5,
+            'search_after': [2103343353],
+        })
+
+        # cached pages are not searched again
+        pages = list(get_es_variant_pages(results_model, num_results=2, max_results=3))
+        self.assertIsNone(self.executed_search)
+        self.assertListEqual(pages, [PARSED_VARIANTS, PARSED_VARIANTS[:1]])
+
     def test_filtered_get_es_variants(self):
         search_model = VariantSearch.objects.create(search={
             'locus': {'rawItems': 'DDX11L1, chr2:1234-5678'},
@@ -1252,7 +1299,10 @@ class EsUtilsTest(TestCase):
             'variant_results': [PARSED_VARIANTS[1]],
             'grouped_results': [{'null': [PARSED_VARIANTS[0]]}, {'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS}],
             'duplicate_doc_count': 0,
-            'loaded_variant_counts': {'test_index_compound_het': {'total': 2}, INDEX_NAME: {'loaded': 2, 'total': 5}},
+            'loaded_variant_counts': {
+                'test_index_compound_het': {'total': 2},
+                INDEX_NAME: {'loaded': 2, 'total': 5, 'search_after': [2103343353]},
+            },
             'total_results': 7,
         })
 
@@ -1284,11 +1334,17 @@ class EsUtilsTest(TestCase):
                 {'null': [PARSED_VARIANTS[0]]}, {'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS},
                 {'null': [PARSED_VARIANTS[0]]}, {'null': [PARSED_VARIANTS[1]]}],
             'duplicate_doc_count': 1,
-            'loaded_variant_counts': {'test_index_compound_het': {'total': 2}, INDEX_NAME: {'loaded': 4, 'total': 5}},
+            'loaded_variant_counts': {
+                'test_index_compound_het': {'total': 2},
+                INDEX_NAME: {'loaded': 4, 'total': 5, 'search_after': [2103343353]},
+            },
             'total_results': 6,
         })
 
-        self.assertExecutedSearches([dict(filters=[annotation_query, pass_filter_query, RECESSIVE_INHERITANCE_QUERY], start_index=2, size=4, sort=['xpos'])])
+        self.assertExecutedSearches([dict(
+            filters=[annotation_query, pass_filter_query, RECESSIVE_INHERITANCE_QUERY], search_after=[2103343353], size=4,
+            sort=['xpos'],
+        )])
 
         get_es_variants(results_model, page=2, num_results=2)
         self.assertIsNone(self.executed_search)
@@ -1326,9 +1382,9 @@ class EsUtilsTest(TestCase):
             'grouped_results': [{'null': [PARSED_VARIANTS[0]]}, {'ENSG00000135953': PARSED_COMPOUND_HET_VARIANTS_PROJECT_2}],
             'duplicate_doc_count': 3,
             'loaded_variant_counts': {
-                SECOND_INDEX_NAME: {'loaded': 1, 'total': 5},
+                SECOND_INDEX_NAME: {'loaded': 1, 'total': 5, 'search_after': [2103343353]},
                 '{}_compound_het'.format(SECOND_INDEX_NAME): {'total': 4},
-                INDEX_NAME: {'loaded': 2, 'total': 5},
+                INDEX_NAME: {'loaded': 2, 'total': 5, 'search_after': [2103343353]},
                 '{}_compound_het'.format(INDEX_NAME): {'total': 2},
             },
             'total_results': 13,
@@ -1405,17 +1461,17 @@ class EsUtilsTest(TestCase):
             ],
             'duplicate_doc_count': 5,
             'loaded_variant_counts': {
-                SECOND_INDEX_NAME: {'loaded': 2, 'total': 5},
+                SECOND_INDEX_NAME: {'loaded': 2, 'total': 5, 'search_after': [2103343353]},
                 '{}_compound_het'.format(SECOND_INDEX_NAME): {'total': 4},
-                INDEX_NAME: {'loaded': 4, 'total': 5},
+                INDEX_NAME: {'loaded': 4, 'total': 5, 'search_after': [2103343353]},
                 '{}_compound_het'.format(INDEX_NAME): {'total': 2},
             },
             'total_results': 11,
         })
 
-        project_2_search['start_index'] = 1
+        project_2_search['search_after'] = [2103343353]
         project_2_search['size'] = 3
-        project_1_search['start_index'] = 2
+        project_1_search['search_after'] = [2103343353]
         self.assertExecutedSearches([project_2_search, project_1_search])
 
     def test_multi_project_all_samples_all_inheritance_get_es_variants(self):
@@ -1636,3 +1692,215 @@ class EsUtilsTest(TestCase):
         self.assertDictEqual(inheritance_filter.to_dict(), {'bool': {'_name': 'F000002_2', 'must': [{
             'bool': {'should': [custom_affected_recessive_filter, custom_affected_x_linked_filter]}
         }]}})
+
+    @mock.patch('seqr.utils.es_utils.SEARCH_RESULTS_CHUNK_SIZE', 2)
+    def test_cached_search_result_chunks(self):
+        search_model = VariantSearch.objects.create(search={})
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        results_model.families.set(self.families)
+        cache_key = 'search_results__{}__xpos'.format(results_model.guid)
+
+        all_results = PARSED_VARIANTS + PARSED_VARIANTS + PARSED_VARIANTS[:1]
+        _set_cached_search_results(MOCK_REDIS, cache_key, {'all_results': all_results, 'total_results': 5})
+        self.assertSetEqual(
+            {key for key in REDIS_CACHE.keys() if key.startswith(cache_key)},
+            {cache_key, cache_key + '__all_results__0', cache_key + '__all_results__1', cache_key + '__all_results__2'}
+        )
+        self.assertDictEqual(
+            _load_cached_search_results(MOCK_REDIS, cache_key), {'all_results': all_results, 'total_results': 5})
+
+        # only the chunks for the requested page are loaded
+        MOCK_REDIS.mget.reset_mock()
+        variants, total_results = get_es_variants(results_model, page=2, num_results=2)
+        self.assertIsNone(self.executed_search)
+        self.assertListEqual(variants, PARSED_VARIANTS)
+        self.assertEqual(total_results, 5)
+        MOCK_REDIS.mget.assert_called_once_with([cache_key + '__all_results__1'])
+
+        # evicted chunks are reloaded from elasticsearch
+        del REDIS_CACHE[cache_key + '__all_results__1']
+        get_es_variants(results_model, page=2, num_results=2)
+        self.assertExecutedSearch(filters=[ALL_INHERITANCE_QUERY], sort=['xpos'], start_index=2)
+
+    def test_get_latest_loaded_samples_for_search(self):
+        samples = get_latest_loaded_samples_for_search(self.families)
+        self.assertSetEqual({sample.sample_id for sample in samples}, {'HG00731', 'HG00732', 'HG00733', 'NA20870'})
+        self.assertSetEqual({sample.index_sample_count for sample in samples}, {
+            Sample.objects.filter(elasticsearch_index=INDEX_NAME).count()})
+
+        # reloading samples for the same families only checks the dataset version
+        with self.assertNumQueries(1):
+            self.assertListEqual(get_latest_loaded_samples_for_search(self.families), samples)
+
+        sample = Sample.objects.get(sample_id='NA20870')
+        sample.sample_status = Sample.SAMPLE_STATUS_LOADING
+        sample.save()
+        self.assertSetEqual(
+            {sample.sample_id for sample in get_latest_loaded_samples_for_search(self.families)},
+            {'HG00731', 'HG00732', 'HG00733'}
+        )
+
+        # samples without a loaded date are used unless the individual has a sample with a loaded date
+        Sample.objects.filter(sample_id='HG00731').update(loaded_date=None)
+        Sample.objects.create(
+            individual=sample.individual, sample_id='NA20870_undated', elasticsearch_index=SECOND_INDEX_NAME,
+            dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS, sample_status=Sample.SAMPLE_STATUS_LOADED)
+        self.assertSetEqual(
+            {sample.sample_id for sample in get_latest_loaded_samples(self.families)},
+            {'HG00731', 'HG00732', 'HG00733', 'NA20870_undated'}
+        )
+        Sample.objects.create(
+            individual=sample.individual, sample_id='NA20870_dated', elasticsearch_index=SECOND_INDEX_NAME,
+            dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS, sample_status=Sample.SAMPLE_STATUS_LOADED,
+            loaded_date=timezone.now())
+        self.assertSetEqual(
+            {sample.sample_id for sample in get_latest_loaded_samples(self.families)},
+            {'HG00731', 'HG00732', 'HG00733', 'NA20870_dated'}
+        )
+
+    @mock.patch('seqr.utils.es_utils.os.getpid')
+    @mock.patch('seqr.utils.es_utils.elasticsearch.Elasticsearch')
+    def test_get_es_client(self, mock_es, mock_getpid):
+        mock_getpid.return_value = 1
+        mock_es.side_effect = lambda **kwargs: mock.MagicMock()
+
+        client = get_es_client()
+        self.assertIs(get_es_client(), client)
+        mock_es.assert_called_once_with(host='localhost', timeout=30, retry_on_timeout=True, maxsize=25)
+
+        # different timeouts get different clients
+        self.assertIsNot(get_es_client(timeout=10), client)
+        self.assertEqual(mock_es.call_count, 2)
+
+        # forked processes do not reuse the parent's connections
+        mock_getpid.return_value = 2
+        self.assertIsNot(get_es_client(), client)
+        self.assertEqual(mock_es.call_count, 3)
+
+    def test_execute_concurrent_searches(self):
+        mock_client = mock.MagicMock()
+        mock_client.search.side_effect = lambda index=None, **kwargs: {
+            'hits': {'total': 1, 'hits': [{'_index': index[0], '_id': index[0], '_source': {}}]}}
+
+        searches = [Search(index=index) for index in [INDEX_NAME, SECOND_INDEX_NAME, 'third_index']]
+        responses = _execute_concurrent_searches(searches, mock_client)
+        self.assertListEqual([response.hits[0].meta.index for response in responses], [
+            INDEX_NAME, SECOND_INDEX_NAME, 'third_index'])
+        self.assertEqual(mock_client.search.call_count, 3)
+
+    def test_merge_sorted_variants(self):
+        merged = _merge_sorted_variants([
+            [{'_sort': [1], 'id': 'a1'}, {'_sort': [3], 'id': 'a3'}],
+            [],
+            [{'_sort': [1], 'id': 'b1'}, {'_sort': [2], 'id': 'b2'}, {'_sort': [5], 'id': 'b5'}],
+            [{'_sort': [3], 'id': 'c3'}],
+        ])
+        self.assertListEqual([variant['id'] for variant in merged], ['a1', 'b1', 'b2', 'a3', 'c3', 'b5'])
+
+    def test_get_sort_script_params(self):
+        def _omim_gene_ids(sort):
+            return sort[0]['_script']['script']['params']['omim_gene_ids']
+
+        sort = _get_sort('in_omim')
+        self.assertListEqual(_omim_gene_ids(sort), ['ENSG00000223972', 'ENSG00000243485', 'ENSG00000268020'])
+        self.assertEqual(sort[-1], 'xpos')
+
+        # params are not recomputed if the reference data is unchanged
+        with self.assertNumQueries(1):
+            self.assertListEqual(_omim_gene_ids(_get_sort('in_omim')), _omim_gene_ids(sort))
+
+        # reloaded reference data is used in subsequent searches
+        omim = Omim.objects.get(phenotype_mim_number=616126)
+        Omim.objects.filter(gene=omim.gene).delete()
+        self.assertNotIn(omim.gene.gene_id, _omim_gene_ids(_get_sort('in_omim')))
+        omim.pk = None
+        omim.save()
+        self.assertListEqual(_omim_gene_ids(_get_sort('in_omim')), _omim_gene_ids(sort))
+
+    @mock.patch('seqr.utils.es_utils.LIFTOVER_CACHE_SIZE', 2)
+    @mock.patch('seqr.utils.es_utils._liftover_grch38_to_grch37')
+    def test_liftover_grch38_to_grch37(self, mock_liftover):
+        LIFTOVER_GRCH38_TO_GRCH37_CACHE.clear()
+        mock_convert = mock_liftover.return_value.convert_coordinate
+        mock_convert.side_effect = lambda chrom, pos: [] if pos == 3 else [(chrom, pos - 100, '+', 20)]
+
+        self.assertDictEqual(liftover_grch38_to_grch37_many([('1', 1000), ('chr1', 1000), ('2', 3)]), {
+            ('1', 1000): ('chr1', 900), ('chr1', 1000): ('chr1', 900), ('2', 3): None,
+        })
+        self.assertEqual(mock_convert.call_count, 2)
+
+        # memoized positions are not converted again
+        self.assertTupleEqual(liftover_grch38_to_grch37('1', 1000), ('chr1', 900))
+        self.assertEqual(mock_convert.call_count, 2)
+
+        # least recently used positions are evicted
+        self.assertTupleEqual(liftover_grch38_to_grch37('X', 500), ('chrX', 400))
+        self.assertListEqual(LIFTOVER_GRCH38_TO_GRCH37_CACHE.keys(), [('chr1', 1000), ('chrX', 500)])
+        self.assertEqual(mock_convert.call_count, 3)
+
+        # positions are not memoized if liftover is unavailable
+        mock_liftover.return_value = None
+        self.assertIsNone(liftover_grch38_to_grch37('2', 200))
+        self.assertListEqual(LIFTOVER_GRCH38_TO_GRCH37_CACHE.keys(), [('chr1', 1000), ('chrX', 500)])
+
+
+class IndexMetadataCacheTest(TestCase):
+
+    @mock.patch('seqr.utils.redis_utils.redis.StrictRedis')
+    @mock.patch('seqr.utils.es_utils.Index')
+    def test_get_index_metadata(self, mock_index, mock_redis):
+        redis_cache = {}
+        mock_redis.return_value.mget.side_effect = lambda keys: [redis_cache.get(key) for key in keys]
+        mock_redis.return_value.pipeline.return_value.set.side_effect = \
+            lambda key, value, **kwargs: redis_cache.update({key: value})
+        mock_redis.return_value.pipeline.return_value.incr.side_effect = \
+            lambda key: redis_cache.update({key: str(int(redis_cache.get(key, 0)) + 1)})
+
+        mock_index.return_value.get_mapping.return_value = {INDEX_NAME: {'mappings': {'variant': {
+            '_meta': {'genomeVersion': '37'}, 'properties': {'samples_num_alt_1': {'type': 'keyword'}, 'xpos': {'type': 'long'}},
+        }}}}
+        expected_metadata = {INDEX_NAME: {'genomeVersion': '37', 'fields': mock.ANY}}
+
+        self.assertDictEqual(get_index_metadata(INDEX_NAME, None), expected_metadata)
+        self.assertSetEqual(set(get_index_metadata(INDEX_NAME, None)[INDEX_NAME]['fields']), {'samples_num_alt_1', 'xpos'})
+        mock_index.assert_called_once_with(INDEX_NAME, using=None)
+        self.assertListEqual(redis_cache.keys(), ['index_metadata__{}__0'.format(INDEX_NAME)])
+
+        # metadata cached by other processes is loaded from redis
+        clear_index_metadata_cache(INDEX_NAME)
+        self.assertEqual(redis_cache['index_metadata_generation__{}'.format(INDEX_NAME)], '1')
+        mock_index.reset_mock()
+        redis_cache['index_metadata__{}__1'.format(INDEX_NAME)] = json.dumps({'genomeVersion': '38', 'fields': []})
+        self.assertDictEqual(get_index_metadata(INDEX_NAME, None), {INDEX_NAME: {'genomeVersion': '38', 'fields': []}})
+        mock_index.assert_not_called()
+
+        # metadata cached in process is not used once another process clears it
+        redis_cache['index_metadata_generation__{}'.format(INDEX_NAME)] = '2'
+        self.assertDictEqual(get_index_metadata(INDEX_NAME, None), expected_metadata)
+        mock_index.assert_called_once_with(INDEX_NAME, using=None)
+        mock_index.reset_mock()
+        redis_cache['index_metadata__{}__2'.format(INDEX_NAME)] = json.dumps({'genomeVersion': '38', 'fields': []})
+
+        # only uncached indices are loaded from elasticsearch
+        mock_index.return_value.get_mapping.return_value = {SECOND_INDEX_NAME: {'mappings': {'variant': {
+            '_meta': {'genomeVersion': '37'}, 'properties': {'samples_num_alt_1': {'type': 'keyword'}},
+        }}}}
+        index_metadata = get_index_metadata('{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME), None)
+        self.assertSetEqual(set(index_metadata.keys()), {INDEX_NAME, SECOND_INDEX_NAME})
+        self.assertEqual(index_metadata[INDEX_NAME]['genomeVersion'], '37')
+        mock_index.assert_called_once_with(SECOND_INDEX_NAME, using=None)
+
+        # cache can be bypassed
+        mock_index.return_value.get_mapping.return_value = {INDEX_NAME: {'mappings': {'variant': {
+            '_meta': {'genomeVersion': '38'}, 'properties': {'samples_num_alt_1': {'type': 'keyword'}},
+        }}}}
+        self.assertEqual(get_index_metadata(INDEX_NAME, None, use_cache=False)[INDEX_NAME]['genomeVersion'], '38')
+        self.assertEqual(get_index_metadata(INDEX_NAME, None)[INDEX_NAME]['genomeVersion'], '37')
+
+        # nothing is cached without redis
+        mock_redis.return_value.mget.side_effect = Exception('redis unavailable')
+        mock_index.reset_mock()
+        self.assertEqual(get_index_metadata(INDEX_NAME, None)[INDEX_NAME]['genomeVersion'], '38')
+        mock_index.assert_called_once_with(INDEX_NAME, using=None)
+
+        clear_index_metadata_cache('{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME))
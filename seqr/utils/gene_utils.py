@@ -1,9 +1,11 @@
 import re
+import time
 from collections import defaultdict
-from django.db.models import Q
+from threading import Lock
+from django.db.models import Q, Count, Max
 from django.db.models.functions import Length
 
-from reference_data.models import GeneInfo
+from reference_data.models import GeneInfo, GeneConstraint
 from seqr.utils.xpos_utils import get_xpos
 from seqr.views.utils.orm_to_json_utils import get_json_for_genes, get_json_for_gene
 
@@ -36,6 +38,87 @@ def get_filtered_gene_ids(gene_filter):
     return [gene.gene_id for gene in GeneInfo.objects.only('gene_id').filter(**gene_filter)]
 
 
+GENE_CONSTRAINT_CACHE = {}
+GENE_CONSTRAINT_CACHE_LOCK = Lock()
+# seconds between checks of the gene constraint table version
+GENE_CONSTRAINT_VERSION_CHECK_INTERVAL = 60
+
+
+def get_gene_constraints_by_gene_id():
+    """Returns the constraint json for all genes, keyed by gene id.
+
+    The constraints and their total count are memoized in process. The version of the gene constraint table is only
+    checked once every GENE_CONSTRAINT_VERSION_CHECK_INTERVAL seconds, so other processes reload the constraints soon
+    after update_gene_constraint reloads the table, and the process running it reloads them right away.
+    """
+    now = time.time()
+    if GENE_CONSTRAINT_CACHE and now - GENE_CONSTRAINT_CACHE['checked_time'] < GENE_CONSTRAINT_VERSION_CHECK_INTERVAL:
+        return GENE_CONSTRAINT_CACHE['constraints']
+
+    with GENE_CONSTRAINT_CACHE_LOCK:
+        if not GENE_CONSTRAINT_CACHE or \
+                now - GENE_CONSTRAINT_CACHE['checked_time'] >= GENE_CONSTRAINT_VERSION_CHECK_INTERVAL:
+            version = get_reference_data_version(GeneConstraint)
+            if GENE_CONSTRAINT_CACHE.get('version') != version:
+                GENE_CONSTRAINT_CACHE.update({'constraints': _load_gene_constraints(), 'version': version})
+            GENE_CONSTRAINT_CACHE['checked_time'] = now
+        return GENE_CONSTRAINT_CACHE['constraints']
+
+
+def reset_gene_constraint_cache():
+    with GENE_CONSTRAINT_CACHE_LOCK:
+        GENE_CONSTRAINT_CACHE.clear()
+
+
+def _load_gene_constraints():
+    gene_constraints = GeneConstraint.objects.order_by('-mis_z', '-pLI').values_list(
+        'gene__gene_id', 'mis_z', 'mis_z_rank', 'pLI', 'pLI_rank')
+    total_gene_constraints = len(gene_constraints)
+    constraints_by_gene_id = {}
+    for gene_id, mis_z, mis_z_rank, pli, pli_rank in gene_constraints:
+        if gene_id not in constraints_by_gene_id:
+            constraints_by_gene_id[gene_id] = {
+                'misZ': mis_z, 'misZRank': mis_z_rank, 'pli': pli, 'pliRank': pli_rank, 'totalGenes': total_gene_constraints,
+            }
+    return constraints_by_gene_id
+
+
+def get_all_gene_summaries():
+    """Returns the locations, coding region size and constraint for all genes, keyed by gene id.
+
+    Only the fields needed for the summary are loaded, so that all genes can be cached in memory.
+    """
+    constraints_by_gene_id = get_gene_constraints_by_gene_id()
+
+    fields = ['gene_id', 'gene_symbol', 'chrom_grch37', 'start_grch37', 'end_grch37', 'chrom_grch38', 'start_grch38',
+              'end_grch38', 'coding_region_size_grch37']
+    return {gene['gene_id']: {
+        'geneId': gene['gene_id'],
+        'geneSymbol': gene['gene_symbol'],
+        'chromGrch37': gene['chrom_grch37'],
+        'startGrch37': gene['start_grch37'],
+        'endGrch37': gene['end_grch37'],
+        'chromGrch38': gene['chrom_grch38'],
+        'startGrch38': gene['start_grch38'],
+        'endGrch38': gene['end_grch38'],
+        'codingRegionSizeGrch37': gene['coding_region_size_grch37'],
+        'constraints': dict(constraints_by_gene_id.get(gene['gene_id'], {})),
+    } for gene in GeneInfo.objects.values(*fields)}
+
+
+def get_reference_data_version(*model_classes):
+    """Returns a value that changes whenever the given reference data tables are reloaded.
+
+    Reference data is reloaded by deleting and recreating records or by adding new ones, so any reload changes the
+    record count or max id.
+    """
+    version = []
+    for model_cls in model_classes:
+        counts = model_cls.objects.aggregate(count=Count('id'), max_id=Max('id'))
+        version += [counts['count'], counts['max_id']]
+    return tuple(version)
+
+
 def get_queried_genes(query, max_results):
     matching_genes = GeneInfo.objects.filter(
         Q(gene_id__icontains=query) | Q(gene_symbol__icontains=query)
@@ -1,6 +1,7 @@
+from django.middleware.gzip import GZipMiddleware
 from django.utils.deprecation import MiddlewareMixin
 import logging
-from seqr.views.utils.json_utils import create_json_response
+from seqr.views.utils.json_utils import create_json_response, JSON_CONTENT_TYPE
 import settings, traceback
 
 logger = logging.getLogger()
@@ -17,4 +18,13 @@ class JsonErrorMiddleware(MiddlewareMixin):
             if hasattr(settings, 'DEBUG'):
                 exception_json['traceback'] = traceback_message.split('\n')
             return create_json_response(exception_json, status=500)
-        return None
\ No newline at end of file
+        return None
+
+
+class JsonGZipMiddleware(GZipMiddleware):
+    """Compresses json responses for clients that accept gzip"""
+
+    def process_response(self, request, response):
+        if not response.get('Content-Type', '').startswith(JSON_CONTENT_TYPE):
+            return response
+        return super(JsonGZipMiddleware, self).process_response(request, response)
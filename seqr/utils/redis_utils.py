@@ -0,0 +1,13 @@
+import redis
+
+import settings
+
+REDIS_CONNECTION_POOL = None
+
+
+def get_redis_client():
+    """Returns a redis client that reuses connections from a pool shared by the whole process"""
+    global REDIS_CONNECTION_POOL
+    if not REDIS_CONNECTION_POOL:
+        REDIS_CONNECTION_POOL = redis.ConnectionPool(host=settings.REDIS_SERVICE_HOSTNAME, socket_connect_timeout=3)
+    return redis.StrictRedis(connection_pool=REDIS_CONNECTION_POOL)
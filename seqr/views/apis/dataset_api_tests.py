@@ -18,9 +18,10 @@ class DatasetAPITest(TransactionTestCase):
 
     @mock.patch('seqr.views.apis.dataset_api._deprecated_update_vcfffiles', lambda *args: args)
     @mock.patch('seqr.views.utils.dataset_utils.file_utils')
+    @mock.patch('seqr.views.utils.dataset_utils.clear_index_metadata_cache')
     @mock.patch('seqr.views.utils.dataset_utils.get_index_metadata')
     @mock.patch('seqr.views.utils.dataset_utils.elasticsearch_dsl.Search')
-    def test_add_variants_dataset(self, mock_es_search, mock_get_index_metadata, mock_file_utils):
+    def test_add_variants_dataset(self, mock_es_search, mock_get_index_metadata, mock_clear_index_metadata_cache, mock_file_utils):
         url = reverse(add_variants_dataset_handler, args=[PROJECT_GUID])
         _check_login(self, url)
 
@@ -124,6 +125,8 @@ class DatasetAPITest(TransactionTestCase):
             'mappingFilePath': 'mapping.csv',
         }))
         self.assertEqual(response.status_code, 200)
+        mock_get_index_metadata.assert_called_with(INDEX_NAME, mock.ANY, use_cache=False)
+        mock_clear_index_metadata_cache.assert_called_with(INDEX_NAME)
 
         response_json = response.json()
         new_sample = Sample.objects.get(sample_id='NA19678_1')
@@ -186,3 +186,6 @@ def _update_locus_list_items(locus_list, genes_by_id, intervals, request_json, u
         )
         interval_guids.add(interval_model.guid)
     locus_list.locuslistinterval_set.exclude(guid__in=interval_guids).delete()
+
+    # Cached interval lookups are keyed on the locus list's last modified date, so it needs to reflect item changes
+    locus_list.save()
@@ -1,6 +1,7 @@
 import logging
 import json
-from collections import defaultdict
+from bisect import bisect_right
+from collections import defaultdict, OrderedDict
 from django.contrib.auth.decorators import login_required
 from django.db.models import Q
 from django.views.decorators.csrf import csrf_exempt
@@ -74,7 +75,7 @@ def create_saved_variant_handler(request):
         alt=alt,
         family=family,
         project=family.project,
-        saved_variant_json=json.dumps(variant_json)
+        saved_variant_json=variant_json
     )
 
     if non_variant_json.get('note'):
@@ -218,6 +219,74 @@ def update_saved_variant_json(request, project_guid):
     return create_json_response({variant_guid: None for variant_guid in updated_saved_variant_guids})
 
 
+LOCUS_LIST_INTERVAL_INDEX_CACHE = OrderedDict()
+LOCUS_LIST_INTERVAL_INDEX_CACHE_SIZE = 100
+
+
+def _get_locus_list_interval_index(locus_lists):
+    """Returns the intervals in the given locus lists, indexed by chrom and genome version for fast lookups by position.
+
+    The index for each chrom/ genome version is an implicit interval tree: a tuple of the intervals sorted by start,
+    the interval starts and the max end of each subtree (see _set_subtree_max_ends). Indices are cached in process,
+    keyed on the locus lists' last modified dates, so they are only rebuilt when a locus list changes.
+    """
+    cache_key = tuple(sorted((locus_list.guid, locus_list.last_modified_date) for locus_list in locus_lists))
+    if cache_key in LOCUS_LIST_INTERVAL_INDEX_CACHE:
+        return LOCUS_LIST_INTERVAL_INDEX_CACHE[cache_key]
+
+    intervals_by_chrom = defaultdict(lambda: defaultdict(list))
+    for chrom, genome_version, start, end, locus_list_guid in LocusListInterval.objects.filter(
+            locus_list__in=locus_lists).values_list('chrom', 'genome_version', 'start', 'end', 'locus_list__guid'):
+        intervals_by_chrom[chrom][genome_version].append((start, end, locus_list_guid))
+
+    index = {}
+    for chrom, intervals_by_genome_version in intervals_by_chrom.items():
+        index[chrom] = {}
+        for genome_version, intervals in intervals_by_genome_version.items():
+            intervals = sorted(intervals)
+            max_ends = [None] * len(intervals)
+            _set_subtree_max_ends(intervals, max_ends, 0, len(intervals))
+            index[chrom][genome_version] = (intervals, [start for start, _, _ in intervals], max_ends)
+
+    LOCUS_LIST_INTERVAL_INDEX_CACHE[cache_key] = index
+    if len(LOCUS_LIST_INTERVAL_INDEX_CACHE) > LOCUS_LIST_INTERVAL_INDEX_CACHE_SIZE:
+        LOCUS_LIST_INTERVAL_INDEX_CACHE.popitem(last=False)
+    return index
+
+
+def _set_subtree_max_ends(intervals, max_ends, lo, hi):
+    """The sorted intervals in [lo, hi) form a balanced binary tree rooted at the middle interval. The max end of each
+    subtree is stored at its root, so a query can skip any subtree that ends before the position."""
+    if lo >= hi:
+        return None
+    mid = (lo + hi) // 2
+    max_ends[mid] = max(
+        intervals[mid][1], _set_subtree_max_ends(intervals, max_ends, lo, mid),
+        _set_subtree_max_ends(intervals, max_ends, mid + 1, hi))
+    return max_ends[mid]
+
+
+def _get_overlapping_interval_locus_list_guids(chrom_intervals, pos):
+    intervals, starts, max_ends = chrom_intervals
+    locus_list_guids = []
+    # Only intervals starting before the position can overlap it
+    num_started = bisect_right(starts, pos)
+
+    def _add_overlapping(lo, hi):
+        if lo >= hi or lo >= num_started:
+            return
+        mid = (lo + hi) // 2
+        if max_ends[mid] < pos:
+            return
+        _add_overlapping(lo, mid)
+        if mid < num_started and intervals[mid][1] >= pos:
+            locus_list_guids.append(intervals[mid][2])
+        _add_overlapping(mid + 1, hi)
+
+    _add_overlapping(0, len(intervals))
+    return locus_list_guids
+
+
 def _saved_variant_genes(variants):
     gene_ids = set()
     for variant in variants:
@@ -236,15 +305,13 @@ def _add_locus_lists(projects, variants, genes):
     for variant in variants:
         variant['locusListGuids'] = []
 
-    locus_list_intervals_by_chrom = defaultdict(list)
-    for interval in LocusListInterval.objects.filter(locus_list__in=locus_lists):
-        locus_list_intervals_by_chrom[interval.chrom].append(interval)
-    if locus_list_intervals_by_chrom:
+    locus_list_interval_index = _get_locus_list_interval_index(locus_lists)
+    if locus_list_interval_index:
         for variant in variants:
-            for interval in locus_list_intervals_by_chrom[variant['chrom']]:
-                pos = variant['pos'] if variant['genomeVersion'] == interval.genome_version else variant['liftedOverPos']
-                if pos and interval.start <= int(pos) <= interval.end:
-                    variant['locusListGuids'].append(interval.locus_list.guid)
+            for genome_version, chrom_intervals in locus_list_interval_index.get(variant['chrom'], {}).items():
+                pos = variant['pos'] if variant['genomeVersion'] == genome_version else variant['liftedOverPos']
+                if pos:
+                    variant['locusListGuids'] += _get_overlapping_interval_locus_list_guids(chrom_intervals, int(pos))
 
     for locus_list_gene in LocusListGene.objects.filter(locus_list__in=locus_lists, gene_id__in=genes.keys()).prefetch_related('locus_list'):
         genes[locus_list_gene.gene_id]['locusListGuids'].append(locus_list_gene.locus_list.guid)
\ No newline at end of file
@@ -4,9 +4,10 @@ import mock
 from django.test import TransactionTestCase
 from django.urls.base import reverse
 
-from seqr.models import SavedVariant, VariantNote, VariantTag, VariantFunctionalData
+from seqr.models import SavedVariant, VariantNote, VariantTag, VariantFunctionalData, LocusList, LocusListInterval
 from seqr.views.apis.saved_variant_api import saved_variant_data, create_variant_note_handler, create_saved_variant_handler, \
-    update_variant_note_handler, delete_variant_note_handler, update_variant_tags_handler, update_saved_variant_json
+    update_variant_note_handler, delete_variant_note_handler, update_variant_tags_handler, update_saved_variant_json, \
+    _get_locus_list_interval_index, _get_overlapping_interval_locus_list_guids
 from seqr.views.utils.test_utils import _check_login
 
 
@@ -53,6 +54,52 @@ class ProjectAPITest(TransactionTestCase):
         response = self.client.get('{}foo'.format(url))
         self.assertEqual(response.status_code, 404)
 
+    def test_locus_list_interval_index(self):
+        locus_lists = LocusList.objects.filter(guid__in=['LL00049_pid_genes_autosomal_do', 'LL00005_retina_proteome'])
+        LocusListInterval.objects.create(
+            locus_list=locus_lists.get(guid='LL00005_retina_proteome'), chrom='1', start=248367000, end=248367210)
+        LocusListInterval.objects.create(
+            locus_list=locus_lists.get(guid='LL00005_retina_proteome'), chrom='1', start=1000, end=248368000)
+
+        index = _get_locus_list_interval_index(locus_lists)
+        self.assertSetEqual(set(index.keys()), {'1', '3'})
+        self.assertSetEqual(set(index['1'].keys()), {'37'})
+        self.assertSetEqual(set(index['3'].keys()), {'38'})
+
+        self.assertListEqual(_get_overlapping_interval_locus_list_guids(index['1']['37'], 248367205), [
+            'LL00005_retina_proteome', 'LL00005_retina_proteome', 'LL00049_pid_genes_autosomal_do'])
+        self.assertListEqual(
+            _get_overlapping_interval_locus_list_guids(index['1']['37'], 248367250),
+            ['LL00005_retina_proteome', 'LL00049_pid_genes_autosomal_do'])
+        self.assertListEqual(
+            _get_overlapping_interval_locus_list_guids(index['1']['37'], 248367500), ['LL00005_retina_proteome'])
+        self.assertListEqual(_get_overlapping_interval_locus_list_guids(index['1']['37'], 500), [])
+        self.assertListEqual(_get_overlapping_interval_locus_list_guids(index['3']['38'], 3000), [
+            'LL00049_pid_genes_autosomal_do'])
+
+        # index is cached until a locus list changes
+        with self.assertNumQueries(0):
+            self.assertIs(_get_locus_list_interval_index(locus_lists), index)
+
+        locus_list = locus_lists.get(guid='LL00005_retina_proteome')
+        locus_list.locuslistinterval_set.filter(start=1000).delete()
+        locus_list.save()
+        index = _get_locus_list_interval_index(LocusList.objects.filter(
+            guid__in=['LL00049_pid_genes_autosomal_do', 'LL00005_retina_proteome']))
+        self.assertListEqual(
+            _get_overlapping_interval_locus_list_guids(index['1']['37'], 248367500), [])
+
+        # a long interval does not hide overlapping intervals or make lookups scan the other intervals
+        for start, end in [(500, 10000)] + [(start, start + 50) for start in range(1000, 5000, 100)]:
+            LocusListInterval.objects.create(locus_list=locus_list, chrom='2', start=start, end=end)
+        locus_list.save()
+        index = _get_locus_list_interval_index(LocusList.objects.filter(guid='LL00005_retina_proteome'))
+        intervals = index['2']['37'][0]
+        for pos in range(0, 11000, 25):
+            self.assertEqual(
+                len(_get_overlapping_interval_locus_list_guids(index['2']['37'], pos)),
+                len([start for start, end, _ in intervals if start <= pos <= end]))
+
     def test_create_saved_variant(self):
         create_saved_variant_url = reverse(create_saved_variant_handler)
         _check_login(self, create_saved_variant_url)
@@ -91,7 +138,7 @@ class ProjectAPITest(TransactionTestCase):
         variant_guid = response.json()['savedVariantsByGuid'].keys()[0]
 
         saved_variant = SavedVariant.objects.get(guid=variant_guid, family__guid='F000001_1')
-        self.assertDictEqual(variant_json, json.loads(saved_variant.saved_variant_json))
+        self.assertDictEqual(variant_json, saved_variant.saved_variant_json)
 
         variant_json.update({
             'variantId': variant_guid,
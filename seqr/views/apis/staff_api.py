@@ -483,7 +483,7 @@ def _generate_rows(project, loaded_samples_by_project_family, saved_variants_by_
                 rows.append(row)
                 continue
 
-            saved_variant_json = variant_details(json.loads(variant.saved_variant_json), project, user=None)
+            saved_variant_json = variant_details(variant.saved_variant_json, project, user=None)
 
             if not saved_variant_json['transcripts']:
                 errors.append("%s - no gene ids" % variant)
@@ -8,8 +8,8 @@ from django.views.decorators.csrf import csrf_exempt
 from elasticsearch.exceptions import ConnectionTimeout
 
 from seqr.models import Project, Family, Individual, SavedVariant, VariantSearch, VariantSearchResults
-from seqr.utils.es_utils import get_es_variants, get_single_es_variant, InvalidIndexException, XPOS_SORT_KEY, \
-    PATHOGENICTY_SORT_KEY, PATHOGENICTY_HGMD_SORT_KEY
+from seqr.utils.es_utils import get_es_variants, get_es_variant_pages, get_single_es_variant, InvalidIndexException, \
+    XPOS_SORT_KEY, PATHOGENICTY_SORT_KEY, PATHOGENICTY_HGMD_SORT_KEY
 from seqr.views.apis.auth_api import API_LOGIN_REQUIRED_URL
 from seqr.views.apis.saved_variant_api import _saved_variant_genes, _add_locus_lists
 from seqr.views.pages.project_page import get_project_variant_tag_types, get_project_child_entities
@@ -179,6 +179,20 @@ VARIANT_GENOTYPE_EXPORT_DATA = [
 ]
 
 
+def _compile_export_fields(export_configs):
+    return [
+        (jmespath.compile(config.get('value_path', config['header'])), config.get('process'))
+        for config in export_configs
+    ]
+
+VARIANT_EXPORT_FIELDS = _compile_export_fields(VARIANT_EXPORT_DATA)
+VARIANT_FAMILY_EXPORT_FIELDS = _compile_export_fields(VARIANT_FAMILY_EXPORT_DATA)
+VARIANT_GENOTYPE_EXPORT_FIELDS = _compile_export_fields(VARIANT_GENOTYPE_EXPORT_DATA)
+
+EXPORT_PAGE_SIZE = 1000
+MAX_EXPORT_VARIANTS = 10000
+
+
 @login_required(login_url=API_LOGIN_REQUIRED_URL)
 @csrf_exempt
 def export_variants_handler(request, search_hash):
@@ -188,30 +202,11 @@ def export_variants_handler(request, search_hash):
 
     family_ids_by_guid = {family.guid: family.family_id for family in results_model.families.all()}
 
-    variants, _ = get_es_variants(results_model, page=1, load_all=True)
-
-    saved_variants_by_guid = _get_saved_variants(variants)
-    saved_variants_by_family = defaultdict(dict)
-    for var in saved_variants_by_guid.values():
-        for family_guid in var['familyGuids']:
-            saved_variants_by_family[family_guid]['{}-{}-{}'.format(var['xpos'], var['ref'], var['alt'])] = var
-
-    max_families_per_variant = max([len(variant['familyGuids']) for variant in variants])
-    max_samples_per_variant = max([len(variant['genotypes']) for variant in variants])
-
-    rows = []
-    for variant in variants:
-        row = [_get_field_value(variant, config) for config in VARIANT_EXPORT_DATA]
-        for i in range(max_families_per_variant):
-            family_guid = variant['familyGuids'][i] if i < len(variant['familyGuids']) else ''
-            family_tags = saved_variants_by_family[family_guid].get('{}-{}-{}'.format(variant['xpos'], variant['ref'], variant['alt'])) or {}
-            family_tags['family_id'] = family_ids_by_guid.get(family_guid)
-            row += [_get_field_value(family_tags, config) for config in VARIANT_FAMILY_EXPORT_DATA]
-        genotypes = variant['genotypes'].values()
-        for i in range(max_samples_per_variant):
-            genotype = genotypes[i] if i < len(genotypes) else {}
-            row += [_get_field_value(genotype, config) for config in VARIANT_GENOTYPE_EXPORT_DATA]
-        rows.append(row)
+    # The number of family and sample columns depends on the variants, so the capped results are loaded before the
+    # header is written. The rows are then built and written one page at a time
+    variant_pages = list(get_es_variant_pages(results_model, num_results=EXPORT_PAGE_SIZE, max_results=MAX_EXPORT_VARIANTS))
+    max_families_per_variant = max([len(variant['familyGuids']) for variants in variant_pages for variant in variants] or [0])
+    max_samples_per_variant = max([len(variant['genotypes']) for variants in variant_pages for variant in variants] or [0])
 
     header = [config['header'] for config in VARIANT_EXPORT_DATA]
     for i in range(max_families_per_variant):
@@ -219,15 +214,38 @@ def export_variants_handler(request, search_hash):
     for i in range(max_samples_per_variant):
         header += ['{}_{}'.format(config['header'], i+1) for config in VARIANT_GENOTYPE_EXPORT_DATA]
 
+    def _get_rows():
+        for variants in variant_pages:
+            saved_variants_by_guid = _get_saved_variants(variants)
+            saved_variants_by_family = defaultdict(dict)
+            for var in saved_variants_by_guid.values():
+                for family_guid in var['familyGuids']:
+                    saved_variants_by_family[family_guid]['{}-{}-{}'.format(var['xpos'], var['ref'], var['alt'])] = var
+
+            for variant in variants:
+                row = [_get_field_value(variant, field) for field in VARIANT_EXPORT_FIELDS]
+                for i in range(max_families_per_variant):
+                    family_guid = variant['familyGuids'][i] if i < len(variant['familyGuids']) else ''
+                    family_tags = saved_variants_by_family[family_guid].get('{}-{}-{}'.format(variant['xpos'], variant['ref'], variant['alt'])) or {}
+                    family_tags['family_id'] = family_ids_by_guid.get(family_guid)
+                    row += [_get_field_value(family_tags, field) for field in VARIANT_FAMILY_EXPORT_FIELDS]
+                genotypes = variant['genotypes'].values()
+                for i in range(max_samples_per_variant):
+                    genotype = genotypes[i] if i < len(genotypes) else {}
+                    row += [_get_field_value(genotype, field) for field in VARIANT_GENOTYPE_EXPORT_FIELDS]
+                yield row
+
     file_format = request.GET.get('file_format', 'tsv')
 
-    return export_table('search_results_{}'.format(search_hash), header, rows, file_format, titlecase_header=False)
+    return export_table(
+        'search_results_{}'.format(search_hash), header, _get_rows(), file_format, titlecase_header=False, stream=True)
 
 
-def _get_field_value(value, config):
-    field_value = jmespath.search(config.get('value_path', config['header']), value)
-    if config.get('process'):
-        field_value = config['process'](field_value)
+def _get_field_value(value, field):
+    expression, process = field
+    field_value = expression.search(value)
+    if process:
+        field_value = process(field_value)
     return field_value
 
 
@@ -385,12 +403,19 @@ def _get_saved_variants(variants):
     if not variants:
         return {}
 
-    variant_q = Q()
-    for variant in variants:
-        variant_q |= Q(xpos_start=variant['xpos'], ref=variant['ref'], alt=variant['alt'], family__guid__in=variant['familyGuids'])
-    saved_variants = SavedVariant.objects.filter(variant_q)
-
     variants_by_id = {'{}-{}-{}'.format(var['xpos'], var['ref'], var['alt']): var for var in variants}
+
+    # Prefilter on the indexed position and match the alleles and families in python, as a query with a separate clause
+    # for every variant is very slow to plan
+    family_guids = {family_guid for variant in variants for family_guid in variant['familyGuids']}
+    saved_variants = [
+        saved_variant for saved_variant in SavedVariant.objects.filter(
+            xpos_start__in={variant['xpos'] for variant in variants}, family__guid__in=family_guids,
+        ).select_related('family')
+        if saved_variant.family.guid in variants_by_id.get(
+            '{}-{}-{}'.format(saved_variant.xpos_start, saved_variant.ref, saved_variant.alt), {}).get('familyGuids', [])
+    ]
+
     saved_variants_json = get_json_for_saved_variants(saved_variants, add_tags=True)
     saved_variants_by_guid = {}
     for saved_variant in saved_variants_json:
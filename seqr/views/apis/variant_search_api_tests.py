@@ -2,7 +2,9 @@ import json
 import mock
 from copy import deepcopy
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls.base import reverse
 
 from seqr.models import VariantSearchResults, VariantSearch, Family
@@ -10,7 +12,7 @@ from seqr.utils.es_utils import InvalidIndexException
 from seqr.views.apis.locus_list_api import add_project_locus_lists
 from seqr.views.apis.variant_search_api import query_variants_handler, query_single_variant_handler, \
     export_variants_handler, search_context_handler, get_saved_search_handler, create_saved_search_handler, \
-    update_saved_search_handler, delete_saved_search_handler
+    update_saved_search_handler, delete_saved_search_handler, _get_saved_variants
 from seqr.views.utils.test_utils import _check_login
 
 
@@ -41,8 +43,9 @@ def _get_es_variants(results_model, **kwargs):
 class VariantSearchAPITest(TestCase):
     fixtures = ['users', '1kg_project', 'reference_data', 'variant_searches']
 
+    @mock.patch('seqr.views.apis.variant_search_api.get_es_variant_pages')
     @mock.patch('seqr.views.apis.variant_search_api.get_es_variants')
-    def test_query_variants(self, mock_get_variants):
+    def test_query_variants(self, mock_get_variants, mock_get_variant_pages):
         url = reverse(query_variants_handler, args=[SEARCH_HASH])
         _check_login(self, url)
 
@@ -110,10 +113,11 @@ class VariantSearchAPITest(TestCase):
         mock_get_variants.assert_called_with(results_model, sort='consequence', page=1, num_results=100)
 
         # Test export
+        mock_get_variant_pages.side_effect = lambda results_model, **kwargs: iter([deepcopy(VARIANTS)])
         export_url = reverse(export_variants_handler, args=[SEARCH_HASH])
         response = self.client.get(export_url)
         self.assertEqual(response.status_code, 200)
-        export_content = [row.split('\t') for row in response.content.rstrip('\n').split('\n')]
+        export_content = [row.split('\t') for row in ''.join(response.streaming_content).rstrip('\n').split('\n')]
         self.assertEqual(len(export_content), 4)
         self.assertListEqual(
             export_content[0],
@@ -128,7 +132,27 @@ class VariantSearchAPITest(TestCase):
              '', '1', 'Tier 1 - Novel gene and phenotype (None)|Review (None)', '', '2', '', '', 'NA19675', '1',
              '14,33', '50', '46.0', '0.702127659574', 'NA19679', '0', '45,0', '45', '99.0', '0.0'])
 
-        mock_get_variants.assert_called_with(results_model, page=1, load_all=True)
+        mock_get_variant_pages.assert_called_with(results_model, num_results=1000, max_results=10000)
+
+    def test_get_saved_variants(self):
+        with CaptureQueriesContext(connection) as small_page_queries:
+            saved_variants = _get_saved_variants(deepcopy(VARIANTS))
+        self.assertSetEqual(
+            set(saved_variants.keys()), {'SV0000001_2103343353_r0390_100', 'SV0000002_1248367227_r0390_100'})
+
+        # the number of queries does not depend on the number of variants
+        with CaptureQueriesContext(connection) as page_queries:
+            saved_variants = _get_saved_variants(deepcopy(VARIANTS) + [
+                dict(VARIANTS[1], xpos=3000000835 + i, familyGuids=['F000001_1', 'F000002_2']) for i in range(1, 100)
+            ])
+        self.assertEqual(len(page_queries), len(small_page_queries))
+        self.assertSetEqual(
+            set(saved_variants.keys()), {'SV0000001_2103343353_r0390_100', 'SV0000002_1248367227_r0390_100'})
+        self.assertListEqual(saved_variants['SV0000002_1248367227_r0390_100']['familyGuids'], ['F000002_2'])
+
+        # saved variants are only returned for the families they are saved in
+        saved_variants = _get_saved_variants([dict(VARIANTS[2], familyGuids=['F000001_1'])])
+        self.assertDictEqual(saved_variants, {})
 
     def test_search_context(self):
         search_context_url = reverse(search_context_handler)
@@ -1,4 +1,3 @@
-import json
 import logging
 from django.contrib.admin.views.decorators import staff_member_required
 
@@ -27,7 +26,7 @@ def komp_export(request):
             'project': v.saved_variant.project.name,
             'family_id': v.saved_variant.family.family_id,
             'timestamp': v.created_date.strftime('%Y-%m-%d %H:%M:%S'),
-            'genes': ', '.join(json.loads(v.saved_variant.saved_variant_json)['extras']['gene_names'].values()),
+            'genes': ', '.join(v.saved_variant.saved_variant_json['extras']['gene_names'].values()),
             'chrom': get_chrom_pos(v.saved_variant.xpos)[0],
             'pos': get_chrom_pos(v.saved_variant.xpos)[1],
             'ref': v.saved_variant.ref,
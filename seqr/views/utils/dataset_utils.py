@@ -6,7 +6,7 @@ from django.db.models.query_utils import Q
 
 from seqr.views.apis.igv_api import proxy_to_igv
 from seqr.models import Sample, Individual
-from seqr.utils.es_utils import get_es_client, get_index_metadata
+from seqr.utils.es_utils import get_es_client, get_index_metadata, clear_index_metadata_cache
 from seqr.utils import file_utils
 from seqr.views.utils.file_utils import load_uploaded_file, parse_file
 
@@ -16,7 +16,7 @@ logger = logging.getLogger(__name__)
 def get_elasticsearch_index_samples(elasticsearch_index):
     es_client = get_es_client()
 
-    index_metadata = get_index_metadata(elasticsearch_index, es_client).get(elasticsearch_index)
+    index_metadata = get_index_metadata(elasticsearch_index, es_client, use_cache=False).get(elasticsearch_index)
 
     s = elasticsearch_dsl.Search(using=es_client, index=elasticsearch_index)
     s = s.params(size=0)
@@ -151,6 +151,10 @@ def match_sample_ids_to_sample_records(
             [1] array: array of the sample_ids of any samples that were created
     """
 
+    if elasticsearch_index:
+        # The index may have been reloaded with a new mapping, so searches should not use any previously cached metadata
+        clear_index_metadata_cache(elasticsearch_index)
+
     sample_id_to_sample_record = find_matching_sample_records(
         project, sample_ids, sample_type, dataset_type, elasticsearch_index
     )
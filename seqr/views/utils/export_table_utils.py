@@ -1,23 +1,28 @@
 import datetime
 from collections import OrderedDict
+from itertools import chain
 import json
 import openpyxl as xl
+import tempfile
+from wsgiref.util import FileWrapper
 
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, StreamingHttpResponse
 
 from seqr.views.utils.json_utils import _to_title_case
 
 
-def export_table(filename_prefix, header, rows, file_format, titlecase_header=True):
+def export_table(filename_prefix, header, rows, file_format, titlecase_header=True, stream=False):
     """Generates an HTTP response for a table with the given header and rows, exported into the given file_format.
 
     Args:
         filename_prefix (string): Filename without the extension.
         header (list): List of column names
-        rows (list): List of rows, where each row is a list of column values
+        rows (iterable): Iterable of rows, where each row is a list of column values or a dict keyed by column
         file_format (string): "tsv", "xls", or "json"
+        stream (bool): Whether to return a streaming response. Rows are then formatted and written as they are read, so
+            they may be a generator and the table is never held in memory.
     Returns:
-        Django HttpResponse object with the table data as an attachment.
+        Django HttpResponse or StreamingHttpResponse object with the table data as an attachment.
     """
     if isinstance(header, dict):
         # it's a mapping of row keys to values
@@ -26,52 +31,38 @@ def export_table(filename_prefix, header, rows, file_format, titlecase_header=Tr
     else:
         column_keys = header
 
-    for i, row in enumerate(rows):
-        if isinstance(row, dict):
-            for column_key in column_keys:
-                if column_key not in row:
-                    raise ValueError("row #%d doesn't have key '%s': %s" % (i, column_key, row))
-        else:
-            if len(header) != len(row):
-                raise ValueError('len(header) != len(row): %s != %s\n%s\n%s' % (len(header), len(row), header, row))
-
-        for i, value in enumerate(row):
-            if value is None:
-                row[i] = ""
-            elif type(value) == datetime.datetime:
-                row[i] = value.strftime("%m/%d/%Y %H:%M:%S %p %Z")
+    formatted_rows = (_format_row_values(header, column_keys, i, row) for i, row in enumerate(rows))
+    response_cls = StreamingHttpResponse if stream else HttpResponse
 
     if file_format == "tsv":
-        response = HttpResponse(content_type='text/tsv')
+        response = response_cls(
+            ('\t'.join(map(unicode, row))+'\n' for row in chain([header], formatted_rows)), content_type='text/tsv')
         response['Content-Disposition'] = 'attachment; filename="{}.tsv"'.format(filename_prefix)
-        response.writelines(['\t'.join(header)+'\n'])
-        response.writelines(('\t'.join(map(unicode, row))+'\n' for row in rows))
         return response
     elif file_format == "json":
-        response = HttpResponse(content_type='application/json')
+        json_keys = map(lambda s: s.replace(" ", "_").lower(), header)
+        response = response_cls(
+            (json.dumps(OrderedDict(zip(json_keys, map(unicode, row))))+'\n' for row in formatted_rows),
+            content_type='application/json')
         response['Content-Disposition'] = 'attachment; filename="{}.json"'.format(filename_prefix)
-        for row in rows:
-            json_keys = map(lambda s: s.replace(" ", "_").lower(), header)
-            json_values = map(unicode, row)
-            response.write(json.dumps(OrderedDict(zip(json_keys, json_values)))+'\n')
         return response
     elif file_format == "xls":
-        response = HttpResponse(content_type="application/ms-excel")
-        response['Content-Disposition'] = 'attachment; filename="{}.xlsx"'.format(filename_prefix)
+        # Write-only workbooks write rows to disk as they are appended, and the saved file is read back in chunks
         wb = xl.Workbook(write_only=True)
         ws = wb.create_sheet()
         if titlecase_header:
             header = map(_to_title_case, header)
         ws.append(header)
-        for row in rows:
+        for row in formatted_rows:
             try:
-                if isinstance(row, dict):
-                    row = [row[column_key] for column_key in column_keys]
                 ws.append(row)
-            except ValueError as e:
-                raise ValueError("Unable to append row to xls writer: " + ','.join(row))
-
-        wb.save(response)
+            except ValueError:
+                raise ValueError("Unable to append row to xls writer: " + ','.join(map(unicode, row)))
+        temp_file = tempfile.TemporaryFile()
+        wb.save(temp_file)
+        temp_file.seek(0)
+        response = response_cls(FileWrapper(temp_file), content_type="application/ms-excel")
+        response['Content-Disposition'] = 'attachment; filename="{}.xlsx"'.format(filename_prefix)
         return response
     else:
         if not file_format:
@@ -80,6 +71,23 @@ def export_table(filename_prefix, header, rows, file_format, titlecase_header=Tr
             raise ValueError("Invalid file_format: %s" % file_format)
 
 
+def _format_row_values(header, column_keys, row_index, row):
+    if isinstance(row, dict):
+        for column_key in column_keys:
+            if column_key not in row:
+                raise ValueError("row #%d doesn't have key '%s': %s" % (row_index, column_key, row))
+        row = [row[column_key] for column_key in column_keys]
+    elif len(header) != len(row):
+        raise ValueError('len(header) != len(row): %s != %s\n%s\n%s' % (len(header), len(row), header, row))
+
+    for i, value in enumerate(row):
+        if value is None:
+            row[i] = ""
+        elif type(value) == datetime.datetime:
+            row[i] = value.strftime("%m/%d/%Y %H:%M:%S %p %Z")
+    return row
+
+
 # def export_samples(filename_prefix, samples, file_format):
 #     """Export Projects table.
 #
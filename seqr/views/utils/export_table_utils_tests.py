@@ -35,3 +35,36 @@ class ExportTableUtilsTest(TestCase):
         self.assertRaisesRegexp(ValueError, '.*format.*',
             lambda: export_table('test_file', header, rows, file_format='unknown_format')
         )
+
+    def test_export_table_stream(self):
+        header = ['column1', 'column2']
+        rows = [['row1_v1', 'row1_v2'], ['row2_v1', None]]
+
+        # test tsv format
+        response = export_table('test_file', header, iter(rows), file_format='tsv', stream=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            ''.join(response.streaming_content), 'column1\tcolumn2\nrow1_v1\trow1_v2\nrow2_v1\t\n')
+
+        # test json format
+        response = export_table('test_file', header, iter(rows), file_format='json', stream=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(''.join(response.streaming_content), '{"column1": "row1_v1", "column2": "row1_v2"}\n{"column1": "row2_v1", "column2": ""}\n')
+
+        # test Excel format
+        response = export_table('test_file', header, iter(rows), file_format='xls', stream=True)
+        self.assertEqual(response.status_code, 200)
+        wb = load_workbook(StringIO(''.join(response.streaming_content)))
+        worksheet = wb.active
+
+        self.assertListEqual([cell.value for cell in worksheet['A']], ['Column1', 'row1_v1', 'row2_v1'])
+        self.assertListEqual([cell.value for cell in worksheet['B']], ['Column2', 'row1_v2', None])
+
+        # test invalid rows
+        response = export_table('test_file', header, iter([['row1_v1']]), file_format='tsv', stream=True)
+        self.assertRaisesRegexp(ValueError, 'len\(header\) != len\(row\).*', lambda: list(response.streaming_content))
+
+        # test unknown format
+        self.assertRaisesRegexp(ValueError, '.*format.*',
+            lambda: export_table('test_file', header, iter(rows), file_format='unknown_format', stream=True)
+        )
@@ -2,7 +2,7 @@ import json
 import logging
 import re
 
-from django.http import JsonResponse
+from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
 from django.template import loader
 from django.http import HttpResponse
@@ -48,24 +48,35 @@ def render_with_initial_json(html_page, initial_json):
     return HttpResponse(html, content_type="text/html")
 
 
-def create_json_response(obj, **kwargs):
-    """Encodes the give object into json and create a django JsonResponse object with it.
+JSON_CONTENT_TYPE = 'application/json'
+
+PRETTY_JSON_DUMPS_PARAMS = {'sort_keys': True, 'indent': 4}
+COMPACT_JSON_DUMPS_PARAMS = {'separators': (',', ':')}
+
+
+def create_json_response(obj, pretty=None, **kwargs):
+    """Encodes the give object into json and create a django response object with it.
+
+    Responses are compact by default, and are gzipped by the JsonGZipMiddleware for clients that accept it.
 
     Args:
         obj (object): json response object
-        **kwargs: any addition args to pass to the JsonResponse constructor
+        pretty (bool): whether to indent and sort the json keys, for debugging. Defaults to the
+            JSON_RESPONSE_PRETTY_PRINT setting
+        **kwargs: any addition args to pass to the HttpResponse constructor
     Returns:
-        JsonResponse
+        HttpResponse: django HttpRepsonse object to send back to the client
     """
+    if not isinstance(obj, dict):
+        raise TypeError('Only dict objects can be serialized as a json response')
 
-    dumps_params = {
-        'sort_keys': True,
-        'indent': 4,
-        'default': DjangoJSONEncoderWithSets().default
-    }
+    if pretty is None:
+        pretty = settings.JSON_RESPONSE_PRETTY_PRINT
+    content = json.dumps(
+        obj, cls=DjangoJSONEncoderWithSets, **(PRETTY_JSON_DUMPS_PARAMS if pretty else COMPACT_JSON_DUMPS_PARAMS))
 
-    return JsonResponse(
-        obj, json_dumps_params=dumps_params, encoder=DjangoJSONEncoderWithSets, **kwargs)
+    kwargs.setdefault('content_type', JSON_CONTENT_TYPE)
+    return HttpResponse(content, **kwargs)
 
 
 CAMEL_CASE_MAP = {}
@@ -0,0 +1,38 @@
+import gzip
+import json
+from StringIO import StringIO
+
+from django.test import TestCase, RequestFactory, override_settings
+
+from seqr.utils.middleware import JsonGZipMiddleware
+from seqr.views.utils.json_utils import create_json_response
+
+
+class JSONUtilsTest(TestCase):
+
+    def test_create_json_response(self):
+        obj = {'b': [1, 2], 'a': {'c': set(['x'])}}
+
+        response = create_json_response(obj)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get('Content-Type'), 'application/json')
+        self.assertFalse(response.streaming)
+        self.assertNotIn(' ', response.content)
+        self.assertDictEqual(json.loads(response.content), {'b': [1, 2], 'a': {'c': ['x']}})
+
+        response = create_json_response(obj, pretty=True, status=400)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.content, '{\n    "a": {\n        "c": [\n            "x"\n        ]\n    }, \n    "b": [\n        1, \n        2\n    ]\n}')
+
+        with override_settings(JSON_RESPONSE_PRETTY_PRINT=True):
+            self.assertTrue(create_json_response(obj).content.startswith('{\n    "a"'))
+
+        request = RequestFactory().get('/api/test', HTTP_ACCEPT_ENCODING='gzip')
+        response = JsonGZipMiddleware().process_response(request, create_json_response({'a': 'x' * 100000}))
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.get('Content-Encoding'), 'gzip')
+        self.assertEqual(int(response.get('Content-Length')), len(response.content))
+        self.assertDictEqual(json.loads(gzip.GzipFile(fileobj=StringIO(response.content)).read()), {'a': 'x' * 100000})
+
+        with self.assertRaises(TypeError):
+            create_json_response([obj])
@@ -6,17 +6,20 @@ import json
 import logging
 import os
 from collections import defaultdict
-from copy import copy
-from django.db.models import prefetch_related_objects, Prefetch
+from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.fields.jsonb import KeyTransform
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import prefetch_related_objects, Case, When, F, Func, Value
+from django.db.models.query import QuerySet
 from django.db.models.fields.files import ImageFieldFile
 
-from reference_data.models import GeneConstraint, dbNSFPGene
+from reference_data.models import dbNSFPGene
 from seqr.models import CAN_EDIT, Sample, GeneNote, VariantFunctionalData
 from seqr.views.utils.json_utils import _to_camel_case
 logger = logging.getLogger(__name__)
 
 
-def _get_json_for_models(models, nested_fields=None, user=None, process_result=None, guid_key=None):
+def _get_json_for_models(models, nested_fields=None, user=None, process_result=None, guid_key=None, use_values=None):
     """Returns an array JSON representations of the given models.
 
     Args:
@@ -25,34 +28,43 @@ def _get_json_for_models(models, nested_fields=None, user=None, process_result=N
         nested_fields (array): Optional array of fields to get from the model that are nested on related objects
         process_result (lambda): Optional function to post-process a given model json
         guid_key (string): Optional key to use for the model's guid
+        use_values (bool): Whether to build the json from a single .values() query instead of model instances, if models
+            is an unevaluated QuerySet. In this case process_result is called with None for the model, and foreign key
+            fields are returned as ids. Defaults to True for models with no process_result or foreign key fields
     Returns:
         array: json objects
     """
+    if _is_unevaluated_queryset(models):
+        model_class = models.model
+        field_plan = _get_json_field_plan(model_class, user, guid_key)
+        if use_values is None:
+            use_values = not process_result and _is_values_field_plan(model_class, field_plan)
+        if use_values:
+            return _get_json_for_values(models, field_plan, nested_fields, process_result)
 
     if not models:
         return []
 
     model_class = type(models[0])
-    fields = copy(model_class._meta.json_fields)
-    if user and user.is_staff:
-        fields += getattr(model_class._meta, 'internal_json_fields', [])
+    field_plan = _get_json_field_plan(model_class, user, guid_key)
+    nested_field_plan = [
+        (nested_field.get('key', _to_camel_case('_'.join(nested_field['fields']))), nested_field.get('value'),
+         nested_field['fields']) for nested_field in (nested_fields or [])
+    ]
 
     results = []
     for model in models:
-        result = {_to_camel_case(field): getattr(model, field) for field in fields}
-        for nested_field in (nested_fields or []):
-            field_value = nested_field.get('value')
+        result = {}
+        for field, key, convert in field_plan:
+            value = getattr(model, field)
+            result[key] = convert(value) if convert and value else value
+        for key, field_value, fields in nested_field_plan:
             if not field_value:
                 field_value = model
-                for field in nested_field['fields']:
+                for field in fields:
                     field_value = getattr(field_value, field) if field_value else None
-            result[nested_field.get('key', _to_camel_case('_'.join(nested_field['fields'])))] = field_value
+            result[key] = field_value
 
-        if result.get('guid'):
-            guid_key = guid_key or '{}{}Guid'.format(model_class.__name__[0].lower(), model_class.__name__[1:])
-            result[guid_key] = result.pop('guid')
-        if result.get('createdBy'):
-            result['createdBy'] = result['createdBy'].get_full_name() or result['createdBy'].email
         if process_result:
             process_result(result, model)
         results.append(result)
@@ -60,6 +72,72 @@ def _get_json_for_models(models, nested_fields=None, user=None, process_result=N
     return results
 
 
+def _get_json_for_values(queryset, field_plan, nested_fields, process_result):
+    values_fields = list(field_plan)
+    constant_fields = {}
+    for nested_field in (nested_fields or []):
+        key = nested_field.get('key', _to_camel_case('_'.join(nested_field['fields'])))
+        if nested_field.get('value'):
+            constant_fields[key] = nested_field['value']
+        else:
+            values_fields.append(('__'.join(nested_field['fields']), key, None))
+
+    results = []
+    for row in queryset.values(*[field for field, _, _ in values_fields]):
+        result = {key: convert(row[field]) if convert and row[field] else row[field] for field, key, convert in values_fields}
+        result.update(constant_fields)
+        if process_result:
+            process_result(result, None)
+        results.append(result)
+
+    return results
+
+
+def _is_unevaluated_queryset(models):
+    return isinstance(models, QuerySet) and models._result_cache is None
+
+
+JSON_FIELD_PLANS = {}
+
+
+def _get_json_field_plan(model_class, user, guid_key):
+    """Returns (attribute, json key, converter) tuples for the json fields of the given model, computed once per model"""
+    is_staff = bool(user and user.is_staff)
+    plan_key = (model_class, is_staff, guid_key)
+    if plan_key not in JSON_FIELD_PLANS:
+        fields = list(model_class._meta.json_fields)
+        if is_staff:
+            fields += getattr(model_class._meta, 'internal_json_fields', [])
+        guid_key = guid_key or '{}{}Guid'.format(model_class.__name__[0].lower(), model_class.__name__[1:])
+        JSON_FIELD_PLANS[plan_key] = [
+            (field, guid_key if field == 'guid' else _to_camel_case(field), JSON_FIELD_CONVERTERS.get(field))
+            for field in fields
+        ]
+    return JSON_FIELD_PLANS[plan_key]
+
+
+def _is_values_field_plan(model_class, field_plan):
+    for field, _, convert in field_plan:
+        if convert:
+            return False
+        try:
+            model_field = model_class._meta.get_field(field)
+        except FieldDoesNotExist:
+            return False
+        if not model_field.concrete or model_field.is_relation:
+            return False
+    return True
+
+
+def _get_created_by_json(created_by):
+    return created_by.get_full_name() or created_by.email
+
+
+JSON_FIELD_CONVERTERS = {
+    'created_by': _get_created_by_json,
+}
+
+
 def _get_json_for_model(model, get_json_for_models=_get_json_for_models, **kwargs):
     """Helper function to return a JSON representations of the given model.
 
@@ -200,9 +278,6 @@ def _get_json_for_individuals(individuals, user=None, project_guid=None, family_
         array: array of json objects
     """
 
-    def _get_case_review_status_modified_by(modified_by):
-        return modified_by.email or modified_by.username if hasattr(modified_by, 'email') else modified_by
-
     def _load_phenotips_data(phenotips_data):
         phenotips_json = None
         if phenotips_data:
@@ -213,16 +288,15 @@ def _get_json_for_individuals(individuals, user=None, project_guid=None, family_
         return phenotips_json
 
     def _process_result(result, individual):
-        mother = result.pop('mother', None)
-        father = result.pop('father', None)
+        result.pop('mother', None)
+        result.pop('father', None)
+        result.pop('caseReviewStatusLastModifiedBy', None)
+        modified_by_email = result.pop('caseReviewStatusLastModifiedByEmail', None)
+        modified_by_username = result.pop('caseReviewStatusLastModifiedByUsername', None)
 
         result.update({
-            'caseReviewStatusLastModifiedBy': _get_case_review_status_modified_by(result.get('caseReviewStatusLastModifiedBy')),
+            'caseReviewStatusLastModifiedBy': modified_by_email or modified_by_username,
             'phenotipsData': _load_phenotips_data(result['phenotipsData']),
-            'maternalGuid': mother.guid if mother else None,
-            'paternalGuid': father.guid if father else None,
-            'maternalId': mother.individual_id if mother else None,
-            'paternalId': father.individual_id if father else None,
             'displayName': result['displayName'] or result['individualId'],
         })
 
@@ -232,19 +306,32 @@ def _get_json_for_individuals(individuals, user=None, project_guid=None, family_
     nested_fields = [
         {'fields': ('family', 'guid'), 'value': family_guid},
         {'fields': ('family', 'project', 'guid'), 'key': 'projectGuid', 'value': project_guid},
+        {'fields': ('mother', 'guid'), 'key': 'maternalGuid'},
+        {'fields': ('father', 'guid'), 'key': 'paternalGuid'},
+        {'fields': ('mother', 'individual_id'), 'key': 'maternalId'},
+        {'fields': ('father', 'individual_id'), 'key': 'paternalId'},
     ]
+    if user and user.is_staff:
+        nested_fields += [
+            {'fields': ('case_review_status_last_modified_by', 'email'), 'key': 'caseReviewStatusLastModifiedByEmail'},
+            {'fields': ('case_review_status_last_modified_by', 'username'), 'key': 'caseReviewStatusLastModifiedByUsername'},
+        ]
     if family_fields:
         for field in family_fields:
             nested_fields.append({'fields': ('family', field), 'key': _to_camel_case(field)})
 
-    prefetch_related_objects(individuals, 'family')
-    prefetch_related_objects(individuals, 'mother')
-    prefetch_related_objects(individuals, 'father')
-    prefetch_related_objects(individuals, 'case_review_status_last_modified_by')
-    if add_sample_guids_field:
-        prefetch_related_objects(individuals, 'sample_set')
+    # The sample guids are looked up from the individual models, otherwise no model instances are needed
+    use_values = not add_sample_guids_field
+    if not (use_values and _is_unevaluated_queryset(individuals)):
+        prefetch_related_objects(individuals, 'family')
+        prefetch_related_objects(individuals, 'mother')
+        prefetch_related_objects(individuals, 'father')
+        prefetch_related_objects(individuals, 'case_review_status_last_modified_by')
+        if add_sample_guids_field:
+            prefetch_related_objects(individuals, 'sample_set')
 
-    return _get_json_for_models(individuals, nested_fields=nested_fields, user=user, process_result=_process_result)
+    return _get_json_for_models(
+        individuals, nested_fields=nested_fields, user=user, process_result=_process_result, use_values=use_values)
 
 
 def _get_json_for_individual(individual, user=None, **kwargs):
@@ -322,6 +409,41 @@ def get_json_for_analysis_group(analysis_group, **kwargs):
     return _get_json_for_model(analysis_group, get_json_for_models=get_json_for_analysis_groups, **kwargs)
 
 
+# Top-level keys of legacy saved_variant_json read by variant_details. Variants saved from elasticsearch are already in
+# their display format (and so have a "populations" key), and are loaded in full.
+SAVED_VARIANT_DETAILS_JSON_KEYS = ['xpos', 'annotation', 'extras', 'genotypes']
+
+
+def _annotate_saved_variant_details_json(saved_variants):
+    """Loads only the parts of saved_variant_json needed for the variant details, rather than the full annotation blob.
+
+    Args:
+        saved_variants (object): QuerySet of SavedVariant models
+    Returns:
+        object: QuerySet with a "saved_variant_details_json" annotation
+    """
+    details_json = Func(
+        *[arg for key in SAVED_VARIANT_DETAILS_JSON_KEYS for arg in (Value(key), KeyTransform(key, 'saved_variant_json'))],
+        function='jsonb_build_object', output_field=JSONField()
+    )
+    return saved_variants.defer('saved_variant_json').annotate(saved_variant_details_json=Case(
+        When(saved_variant_json__has_key='populations', then=F('saved_variant_json')),
+        default=details_json,
+        output_field=JSONField(),
+    ))
+
+
+def _get_saved_variant_details_json(saved_variant):
+    if not hasattr(saved_variant, 'saved_variant_details_json'):
+        return saved_variant.saved_variant_json or {}
+
+    details_json = saved_variant.saved_variant_details_json or {}
+    if 'populations' in details_json:
+        return details_json
+    # jsonb_build_object includes keys missing from the stored json as nulls
+    return {key: value for key, value in details_json.items() if value is not None}
+
+
 def get_json_for_saved_variants(saved_variants, add_tags=False, add_details=False, project=None, user=None, **kwargs):
     """Returns a JSON representation of the given variant.
 
@@ -341,7 +463,7 @@ def get_json_for_saved_variants(saved_variants, add_tags=False, add_details=Fals
                 'notes': [get_json_for_variant_note(tag) for tag in saved_variant.variantnote_set.all()],
             })
         if add_details:
-            saved_variant_json = json.loads(saved_variant.saved_variant_json or '{}')
+            saved_variant_json = _get_saved_variant_details_json(saved_variant)
             variant_json.update(variant_details(saved_variant_json, project or saved_variant.project, user, **kwargs))
         variant_json.update({
             'variantId': saved_variant.guid,  # TODO get from json
@@ -349,6 +471,8 @@ def get_json_for_saved_variants(saved_variants, add_tags=False, add_details=Fals
         })
         return variant_json
 
+    if add_details and isinstance(saved_variants, QuerySet):
+        saved_variants = _annotate_saved_variant_details_json(saved_variants)
     prefetch_related_objects(saved_variants, 'family')
     if not project:
         prefetch_related_objects(saved_variants, 'project')
@@ -523,12 +647,12 @@ def get_json_for_genes(genes, user=None, add_dbnsfp=False, add_omim=False, add_c
     Returns:
         array: array of json objects
     """
-    total_gene_constraints = GeneConstraint.objects.count()
+    from seqr.utils.gene_utils import get_gene_constraints_by_gene_id
+
     if add_notes:
         gene_notes_json = get_json_for_gene_notes_by_gene_id([gene.gene_id for gene in genes], user)
-
-    def _add_total_constraint_count(result, *args):
-        result['totalGenes'] = total_gene_constraints
+    if add_constraints:
+        constraints_by_gene_id = get_gene_constraints_by_gene_id()
 
     def _process_result(result, gene):
         if add_dbnsfp:
@@ -552,8 +676,7 @@ def get_json_for_genes(genes, user=None, add_dbnsfp=False, add_omim=False, add_c
             result['omimPhenotypes'] = [phenotype for phenotype in omim_phenotypes if phenotype['phenotypeMimNumber']]
             result['mimNumber'] = omim_phenotypes[0]['mimNumber'] if omim_phenotypes else None
         if add_constraints:
-            constraint = next((constraint for constraint in gene.geneconstraint_set.all()), None)
-            result['constraints'] = _get_json_for_model(constraint, process_result=_add_total_constraint_count) if constraint else {}
+            result['constraints'] = dict(constraints_by_gene_id.get(result['geneId'], {}))
         if add_notes:
             result['notes'] = gene_notes_json.get(result['geneId'], [])
         if add_expression:
@@ -563,8 +686,6 @@ def get_json_for_genes(genes, user=None, add_dbnsfp=False, add_omim=False, add_c
         prefetch_related_objects(genes, 'dbnsfpgene_set')
     if add_omim:
         prefetch_related_objects(genes, 'omim_set')
-    if add_constraints:
-        prefetch_related_objects(genes, Prefetch('geneconstraint_set', queryset=GeneConstraint.objects.order_by('-mis_z', '-pLI')))
     if add_primate_ai:
         prefetch_related_objects(genes, 'primateai_set')
     if add_mgi:
@@ -1,12 +1,14 @@
+import mock
 from django.contrib.auth.models import User
 from django.test import TestCase
-from reference_data.models import GeneInfo
+from reference_data.models import GeneInfo, GeneConstraint
+from seqr.utils.gene_utils import reset_gene_constraint_cache, GENE_CONSTRAINT_VERSION_CHECK_INTERVAL
 from seqr.models import Project, Family, Individual, Sample, SavedVariant, VariantTag, VariantFunctionalData, \
     VariantNote, LocusList, VariantSearch
 from seqr.views.utils.orm_to_json_utils import _get_json_for_user, _get_json_for_project, _get_json_for_family, \
-    _get_json_for_individual, _get_json_for_sample, get_json_for_saved_variant, get_json_for_variant_tag, \
+    _get_json_for_individual, _get_json_for_individuals, get_json_for_samples, _get_json_for_sample, get_json_for_saved_variant, get_json_for_variant_tag, \
     get_json_for_variant_functional_data, get_json_for_variant_note, get_json_for_locus_list, get_json_for_gene, \
-    get_json_for_saved_search
+    get_json_for_saved_search, get_json_for_saved_variants
 
 
 class JSONUtilsTest(TestCase):
@@ -71,6 +73,22 @@ class JSONUtilsTest(TestCase):
         json = _get_json_for_individual(individual, user)
         self.assertSetEqual(set(json.keys()), individual_fields)
 
+        # Unevaluated querysets are loaded with a single values query, which should give the same json as the models
+        individuals = Individual.objects.filter(family__project__guid='R0001_1kg').order_by('guid')
+        Individual.objects.filter(guid=individuals[0].guid).update(case_review_status_last_modified_by=user)
+        for json_user in [None, user]:
+            with self.assertNumQueries(1):
+                values_json = _get_json_for_individuals(individuals.all(), user=json_user, family_fields=['family_id'])
+            self.assertListEqual(
+                values_json, _get_json_for_individuals(list(individuals), user=json_user, family_fields=['family_id']))
+        self.assertTrue(any(individual['maternalGuid'] for individual in values_json))
+        self.assertEqual(values_json[0]['caseReviewStatusLastModifiedBy'], user.email)
+
+        samples = Sample.objects.order_by('guid')
+        with self.assertNumQueries(1):
+            values_json = get_json_for_samples(samples)
+        self.assertListEqual(values_json, get_json_for_samples(list(samples)))
+
     def test_json_for_sample(self):
         sample = Sample.objects.first()
         json = _get_json_for_sample(sample)
@@ -94,6 +112,16 @@ class JSONUtilsTest(TestCase):
         json = get_json_for_saved_variant(variant, add_tags=True, add_details=True)
         self.assertSetEqual(set(json.keys()), fields)
 
+        # Querysets only load the needed keys of saved_variant_json, and should give the same details as the full json
+        saved_variants = SavedVariant.objects.filter(saved_variant_json__isnull=False).order_by('guid')
+        full_json = [get_json_for_saved_variant(variant, add_details=True) for variant in saved_variants]
+        self.assertListEqual(get_json_for_saved_variants(saved_variants, add_details=True), full_json)
+        es_variant_json = dict(full_json[0], populations={'callset': {'af': 0.1}})
+        SavedVariant.objects.filter(guid=es_variant_json['variantGuid']).update(saved_variant_json=es_variant_json)
+        self.assertDictEqual(
+            get_json_for_saved_variants(SavedVariant.objects.filter(guid=es_variant_json['variantGuid']), add_details=True)[0],
+            es_variant_json)
+
     def test_json_for_variant_tag(self):
         tag = VariantTag.objects.first()
         json = get_json_for_variant_tag(tag)
@@ -164,3 +192,28 @@ class JSONUtilsTest(TestCase):
             'constraints', 'diseaseDesc', 'expression', 'functionDesc', 'notes', 'omimPhenotypes', 'mimNumber', 'primateAi'
         })
         self.assertSetEqual(set(json.keys()), fields)
+
+    @mock.patch('seqr.utils.gene_utils.time')
+    def test_json_for_gene_constraints(self, mock_time):
+        mock_time.time.return_value = 1000
+        reset_gene_constraint_cache()
+        GeneConstraint.objects.create(gene_id=1, mis_z=1.5, mis_z_rank=1, pLI=0.9, pLI_rank=0)
+        GeneConstraint.objects.create(gene_id=2, mis_z=2.5, mis_z_rank=0, pLI=0.1, pLI_rank=1)
+        gene = GeneInfo.objects.get(id=1)
+
+        json = get_json_for_gene(gene, add_constraints=True)
+        self.assertDictEqual(json['constraints'], {'misZ': 1.5, 'misZRank': 1, 'pli': 0.9, 'pliRank': 0, 'totalGenes': 2})
+
+        # Constraints are cached, so gene json does not query them again
+        with self.assertNumQueries(0):
+            json = get_json_for_gene(gene, add_constraints=True)
+        self.assertEqual(json['constraints']['totalGenes'], 2)
+
+        # Constraints are reloaded once the table changes and its version is checked again
+        GeneConstraint.objects.create(gene_id=3, mis_z=0.5, mis_z_rank=2, pLI=0.5, pLI_rank=2)
+        self.assertEqual(get_json_for_gene(gene, add_constraints=True)['constraints']['totalGenes'], 2)
+        mock_time.time.return_value += GENE_CONSTRAINT_VERSION_CHECK_INTERVAL
+        json = get_json_for_gene(gene, add_constraints=True)
+        self.assertEqual(json['constraints']['totalGenes'], 3)
+        self.assertDictEqual(get_json_for_gene(GeneInfo.objects.get(id=4), add_constraints=True)['constraints'], {})
+        reset_gene_constraint_cache()
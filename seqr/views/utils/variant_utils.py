@@ -1,13 +1,11 @@
-import json
 import logging
-import redis
 from collections import defaultdict
 from django.contrib.auth.models import User
 
 from seqr.models import SavedVariant, VariantSearchResults, Individual
 from seqr.utils.es_utils import get_es_variants_for_variant_tuples, InvalidIndexException
+from seqr.utils.redis_utils import get_redis_client
 from seqr.utils.xpos_utils import get_chrom_pos
-from settings import REDIS_SERVICE_HOSTNAME
 
 from xbrowse_server.api.utils import add_extra_info_to_variants_project
 from xbrowse_server.mall import get_reference
@@ -64,7 +62,7 @@ def update_project_saved_variant_json(project, family_id=None):
 
 def reset_cached_search_results(project):
     try:
-        redis_client = redis.StrictRedis(host=REDIS_SERVICE_HOSTNAME, socket_connect_timeout=3)
+        redis_client = get_redis_client()
         keys_to_delete = []
         if project:
             result_guids = [res.guid for res in VariantSearchResults.objects.filter(families__project=project)]
@@ -110,7 +108,7 @@ def _deprecated_retrieve_saved_variants_json(project, variant_tuples, create_if_
 
 
 def _update_saved_variant_json(saved_variant, saved_variant_json):
-    saved_variant.saved_variant_json = json.dumps(saved_variant_json)
+    saved_variant.saved_variant_json = saved_variant_json
     saved_variant.save()
 
 
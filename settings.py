@@ -1,4 +1,5 @@
 import logging
+import multiprocessing
 import os
 import random
 import string
@@ -63,6 +64,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'seqr.utils.middleware.JsonGZipMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,6 +75,9 @@ MIDDLEWARE = [
     'seqr.utils.middleware.JsonErrorMiddleware',
 ]
 
+# API json responses are compact by default. Set to "true" to indent them and sort their keys for debugging
+JSON_RESPONSE_PRETTY_PRINT = os.environ.get('JSON_RESPONSE_PRETTY_PRINT', 'false').lower() == 'true'
+
 # django-hijack plugin
 HIJACK_DISPLAY_WARNING = True
 HIJACK_LOGIN_REDIRECT_URL = '/dashboard'
@@ -174,6 +179,11 @@ LOGGING = {
 ELASTICSEARCH_SERVICE_HOSTNAME = os.environ.get('ELASTICSEARCH_SERVICE_HOSTNAME', 'localhost')
 ELASTICSEARCH_PORT = os.environ.get('ELASTICSEARCH_SERVICE_PORT', "9200")
 ELASTICSEARCH_SERVER = "%s:%s" % (ELASTICSEARCH_SERVICE_HOSTNAME, ELASTICSEARCH_PORT)
+# max number of keep-alive connections each worker process holds open to elasticsearch
+ELASTICSEARCH_CONNECTION_POOL_SIZE = int(os.environ.get('ELASTICSEARCH_CONNECTION_POOL_SIZE', 25))
+ELASTICSEARCH_TIMEOUT = int(os.environ.get('ELASTICSEARCH_TIMEOUT', 30))
+# max number of searches each worker process sends to elasticsearch at the same time
+ELASTICSEARCH_MAX_CONCURRENT_SEARCHES = int(os.environ.get('ELASTICSEARCH_MAX_CONCURRENT_SEARCHES', 8))
 
 DEPLOYMENT_TYPE_DEV = "dev"
 DEPLOYMENT_TYPE_PROD = "prod"
@@ -295,6 +305,9 @@ SHELL_PLUS_POST_IMPORTS = (
 
 FAMILY_LOAD_BATCH_SIZE = 25000
 
+# number of worker processes used to parse bgzipped, tabix-indexed VCFs when loading them. Defaults to the number of CPUs
+VCF_PARSER_PROCESSES = int(os.environ.get('VCF_PARSER_PROCESSES', multiprocessing.cpu_count()))
+
 # defaults for optional local settings
 CONSTRUCTION_TEMPLATE = None
 
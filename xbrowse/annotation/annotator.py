@@ -20,6 +20,10 @@ from xbrowse_server.xbrowse_annotation_controls import CustomAnnotator
 import vcf
 
 
+# max number of variants to look up in the annotator db with a single query
+ANNOTATION_LOOKUP_CHUNK_SIZE = 5000
+
+
 class VariantAnnotator():
 
     def __init__(self,  custom_annotator=None):
@@ -31,6 +35,8 @@ class VariantAnnotator():
             vep_perl_path=settings.ANNOTATOR_SETTINGS.vep_perl_path,
             vep_cache_dir=settings.ANNOTATOR_SETTINGS.vep_cache_dir,
             vep_batch_size=settings.ANNOTATOR_SETTINGS.vep_batch_size,
+            vep_processes=getattr(settings.ANNOTATOR_SETTINGS, 'vep_processes', 1),
+            vep_batch_cache_dir=getattr(settings.ANNOTATOR_SETTINGS, 'vep_batch_cache_dir', None),
             human_ancestor_fa=None,
             #human_ancestor_fa=settings_module.human_ancestor_fa,
         )
@@ -72,7 +78,20 @@ class VariantAnnotator():
         doc = self.get_annotator_datastore().variants.find_one({'xpos': xpos, 'ref': ref, 'alt': alt})
         if doc is None:
             raise ValueError("Could not find annotations for variant: " + str((xpos, ref, alt)))
-        annotation = doc['annotation']
+        return self._restrict_to_populations(doc['annotation'], populations)
+
+    def get_annotations_many(self, variant_t_list, populations=None):
+        """
+        Batched version of get_annotation. Looks up the annotations for many variants with one
+        query per ANNOTATION_LOOKUP_CHUNK_SIZE variants
+        Returns a dict of (xpos, ref, alt) tuple -> annotation. Variants without annotations are left out
+        """
+        annotations = {}
+        for doc in self._find_variant_docs(variant_t_list, {'xpos': True, 'ref': True, 'alt': True, 'annotation': True}):
+            annotations[(doc['xpos'], doc['ref'], doc['alt'])] = self._restrict_to_populations(doc['annotation'], populations)
+        return annotations
+
+    def _restrict_to_populations(self, annotation, populations):
         if populations is None:
             populations = self.reference_population_slugs
         if populations is not None:
@@ -82,34 +101,59 @@ class VariantAnnotator():
             annotation['freqs'] = freqs
         return annotation
 
+    def _find_variant_docs(self, variant_t_list, projection):
+        """
+        Yields the annotator docs for the given variant tuples. Docs are looked up by xpos with $in - which
+        the (xpos, ref, alt) index serves - and other alleles at the same positions are filtered out here
+        """
+        variants_collection = self.get_annotator_datastore().variants
+        variant_t_list = list(variant_t_list)
+        for i in range(0, len(variant_t_list), ANNOTATION_LOOKUP_CHUNK_SIZE):
+            variant_t_set = set(variant_t_list[i:i + ANNOTATION_LOOKUP_CHUNK_SIZE])
+            docs = variants_collection.find(
+                {'xpos': {'$in': list({variant_t[0] for variant_t in variant_t_set})}}, projection,
+            ).batch_size(ANNOTATION_LOOKUP_CHUNK_SIZE)
+            for doc in docs:
+                if (doc['xpos'], doc['ref'], doc['alt']) in variant_t_set:
+                    yield doc
+
     def add_variants_to_annotator(self, variant_t_list, force_all=False):
         """
         Make sure that all the variants in variant_t_list are in annotator
         For the ones that are not, go through the whole load cycle
+        variant_t_list can be a generator, eg. over a whole VCF file, so that it is annotated in a single run of VEP
+        batches. The annotations are added in chunks as VEP finishes the batches
         """
-        if force_all:
-            variants_to_add = variant_t_list
-        else:
-            variants_to_add = self._get_missing_annotations(variant_t_list)
-        custom_annotations = None
-        if self._custom_annotator:
-            print "Getting custom annotations..."
-            custom_annotations = self._custom_annotator.get_annotations_for_variants(variants_to_add)
-            print "...done"
-        for variant_t, vep_annotation in self._vep_annotator.get_vep_annotations_for_variants(variants_to_add):
-            annotation = {
-                'vep_annotation': vep_annotation,
-                'freqs': self._population_frequency_store.get_frequencies(variant_t[0], variant_t[1], variant_t[2]),
-            }
-            add_convenience_annotations(annotation)
-            if self._custom_annotator:
-                annotation.update(custom_annotations[variant_t])
-            self.get_annotator_datastore().variants.update({
-                'xpos': variant_t[0],
-                'ref': variant_t[1],
-                'alt': variant_t[2]
-            }, {'$set': {'annotation': annotation},
-            }, upsert=True)
+        vep_annotations_iter = self._vep_annotator.get_vep_annotations_for_variants(
+            variant_t_list, filter_batch=None if force_all else self._get_missing_annotations)
+        try:
+            while True:
+                annotated_variants = list(itertools.islice(vep_annotations_iter, ANNOTATION_LOOKUP_CHUNK_SIZE))
+                if not annotated_variants:
+                    break
+                # VEP output is keyed by the variants it parsed back, which normally match the input variants
+                annotated_variant_t_list = [variant_t for variant_t, _ in annotated_variants]
+                custom_annotations = None
+                if self._custom_annotator:
+                    custom_annotations = self._custom_annotator.get_annotations_for_variants(annotated_variant_t_list)
+                frequencies = self._population_frequency_store.get_frequencies_many(annotated_variant_t_list)
+                for variant_t, vep_annotation in annotated_variants:
+                    annotation = {
+                        'vep_annotation': vep_annotation,
+                        'freqs': frequencies[variant_t],
+                    }
+                    add_convenience_annotations(annotation)
+                    if self._custom_annotator:
+                        annotation.update(custom_annotations[variant_t])
+                    self.get_annotator_datastore().variants.update({
+                        'xpos': variant_t[0],
+                        'ref': variant_t[1],
+                        'alt': variant_t[2]
+                    }, {'$set': {'annotation': annotation},
+                    }, upsert=True)
+        finally:
+            # stop any running VEP batches right away if loading the annotations fails
+            vep_annotations_iter.close()
 
     def add_vcf_file_to_annotator(self, vcf_file_path, force_all=False):
         """
@@ -119,15 +163,11 @@ class VariantAnnotator():
         if not force_all and self.get_annotator_datastore().vcf_files.find_one({'vcf_file_path': vcf_file_path}):
             print "VCF already annotated"
             return
-        print "Scanning VCF file first..."
-        variant_t_list = []
-        for variant_t in vcf_stuff.iterate_tuples(compressed_file(vcf_file_path)):
-            variant_t_list.append(variant_t)
-            if len(variant_t_list) == 100000:
-                print "Adding another 100000 variants, through {}".format(variant_t_list[-1][0])
-                self.add_variants_to_annotator(variant_t_list, force_all)
-                variant_t_list = []
-        self.add_variants_to_annotator(variant_t_list, force_all)
+        if vcf_stuff.is_tabix_indexed(vcf_file_path):
+            variant_tuples = vcf_stuff.iterate_tuples_parallel(vcf_file_path, processes=settings.VCF_PARSER_PROCESSES)
+        else:
+            variant_tuples = vcf_stuff.iterate_tuples(compressed_file(vcf_file_path))
+        self.add_variants_to_annotator(variant_tuples, force_all)
         self.get_annotator_datastore().vcf_files.insert({'vcf_file_path': vcf_file_path, 'date_added': datetime.datetime.utcnow()})
 
     def get_vcf_file_from_annotator(self, vcf_file_path):
@@ -221,14 +261,11 @@ class VariantAnnotator():
             {'vcf_file_path': vcf_file_path, 'date_added': datetime.datetime.utcnow()}, upsert=True)
 
     def _get_missing_annotations(self, variant_t_list):
-        ret = []
-        for variant_t in variant_t_list:
-            if not self.get_annotator_datastore().variants.find_one(
-                {'xpos': variant_t[0],
-                 'ref': variant_t[1],
-                 'alt': variant_t[2]}):
-                ret.append(variant_t)
-        return ret
+        annotated_variant_t_set = {
+            (doc['xpos'], doc['ref'], doc['alt'])
+            for doc in self._find_variant_docs(variant_t_list, {'xpos': True, 'ref': True, 'alt': True, '_id': False})
+        }
+        return [variant_t for variant_t in variant_t_list if variant_t not in annotated_variant_t_set]
 
     def annotate_variant(self, variant, populations=None):
         if not hasattr(variant, 'annotation') or not variant.annotation:
@@ -0,0 +1,79 @@
+import mock
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from xbrowse.annotation import annotator
+from xbrowse.annotation.vep_annotations import HackedVEPAnnotator
+from xbrowse.annotation.vep_annotations_tests import FAKE_VEP_SCRIPT
+
+
+class MockCollection(object):
+    """Holds the docs written to a mongo collection, and fails after a given number of updates"""
+
+    def __init__(self, max_updates=None):
+        self.docs = {}
+        self.max_updates = max_updates
+
+    def find(self, query, projection=None):
+        docs = mock.MagicMock()
+        docs.batch_size.return_value = [
+            dict(doc) for doc in self.docs.values() if doc['xpos'] in query['xpos']['$in']]
+        return docs
+
+    def update(self, query, update, upsert=False):
+        if self.max_updates is not None:
+            if self.max_updates == 0:
+                raise Exception('Lost connection to mongo')
+            self.max_updates -= 1
+        doc = self.docs.setdefault((query['xpos'], query['ref'], query['alt']), dict(query))
+        doc.update(update['$set'])
+
+
+class VariantAnnotatorTest(TestCase):
+
+    @mock.patch('xbrowse.annotation.annotator.ANNOTATION_LOOKUP_CHUNK_SIZE', 2)
+    @mock.patch('xbrowse.annotation.annotator.VariantAnnotator.get_annotator_datastore')
+    def test_add_variants_to_annotator(self, mock_get_datastore):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            vep_script_path = os.path.join(temp_dir, 'fake_vep.pl')
+            with open(vep_script_path, 'w') as f:
+                f.write(FAKE_VEP_SCRIPT)
+            vep_batch_cache_dir = os.path.join(temp_dir, 'vep_batches')
+
+            mock_get_datastore.return_value.pop_variants = MockCollection()
+            mock_get_datastore.return_value.variants = MockCollection(max_updates=3)
+            variant_annotator = annotator.VariantAnnotator()
+            variant_annotator._vep_annotator = HackedVEPAnnotator(
+                vep_script_path, temp_dir, vep_batch_size=2, vep_processes=2, vep_batch_cache_dir=vep_batch_cache_dir)
+            variant_t_list = [(1000000000 + i * 100, 'A', 'G') for i in range(1, 6)]
+
+            # a load that is interrupted part way through the second batch keeps the output of the finished batches
+            with self.assertRaises(Exception):
+                variant_annotator.add_variants_to_annotator(iter(variant_t_list))
+            variants = mock_get_datastore.return_value.variants
+            self.assertSetEqual(set(variants.docs.keys()), set(variant_t_list[:3]))
+            self.assertEqual(len(os.listdir(vep_batch_cache_dir)), 2)
+
+            # resuming uses the cached batches, even though some of their variants were already added, and only runs
+            # VEP on the variants in the last batch
+            variants.max_updates = None
+            with mock.patch.object(
+                    variant_annotator._vep_annotator, '_start_vep',
+                    wraps=variant_annotator._vep_annotator._start_vep) as mock_start_vep:
+                variant_annotator.add_variants_to_annotator(iter(variant_t_list))
+            self.assertEqual(mock_start_vep.call_count, 1)
+            self.assertSetEqual(set(variants.docs.keys()), set(variant_t_list))
+            self.assertEqual(
+                variants.docs[variant_t_list[-1]]['annotation']['vep_annotation'][0]['consequence'], 'missense_variant')
+            self.assertListEqual(os.listdir(vep_batch_cache_dir), [])
+
+            # variants that are already annotated are not re-annotated
+            with mock.patch.object(variant_annotator._vep_annotator, '_start_vep') as mock_start_vep:
+                variant_annotator.add_variants_to_annotator(iter(variant_t_list))
+            mock_start_vep.assert_not_called()
+        finally:
+            shutil.rmtree(temp_dir)
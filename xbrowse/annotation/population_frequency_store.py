@@ -5,13 +5,20 @@ from xbrowse import vcf_stuff
 from xbrowse.utils import get_aaf
 from xbrowse.parsers.esp_vcf import get_variants_from_esp_file
 from xbrowse.core import genomeloc
+from pymongo import UpdateOne
+
+# number of frequency upserts to send to mongo at a time when loading a population
+BULK_WRITE_SIZE = 10000
+# max number of variants to look up frequencies for with a single query
+FREQUENCY_LOOKUP_CHUNK_SIZE = 5000
 
 
 class PopulationFrequencyStore():
 
-    def __init__(self, get_db, reference_populations):
+    def __init__(self, get_db, reference_populations, bulk_write_size=BULK_WRITE_SIZE):
         self._get_db = get_db
         self.reference_populations = reference_populations
+        self._bulk_write_size = bulk_write_size
 
     def get_frequencies(self, xpos, ref, alt):
         d = self._get_db().pop_variants.find_one({'xpos': xpos, 'ref': ref, 'alt': alt}, projection={'_id': False})
@@ -20,12 +27,30 @@ class PopulationFrequencyStore():
 
         return d
 
+    def get_frequencies_many(self, variant_t_list):
+        """
+        Batched version of get_frequencies, with one query per FREQUENCY_LOOKUP_CHUNK_SIZE variants
+        Returns a dict of (xpos, ref, alt) tuple -> frequencies, with an empty dict for variants not in the store
+        """
+        variant_t_list = list(variant_t_list)
+        frequencies = {variant_t: {} for variant_t in variant_t_list}
+        for i in range(0, len(variant_t_list), FREQUENCY_LOOKUP_CHUNK_SIZE):
+            xpos_list = list({variant_t[0] for variant_t in variant_t_list[i:i + FREQUENCY_LOOKUP_CHUNK_SIZE]})
+            docs = self._get_db().pop_variants.find(
+                {'xpos': {'$in': xpos_list}}, projection={'_id': False}).batch_size(FREQUENCY_LOOKUP_CHUNK_SIZE)
+            for d in docs:
+                variant_t = (d['xpos'], d['ref'], d['alt'])
+                if variant_t in frequencies:
+                    frequencies[variant_t] = d
+        return frequencies
+
     def add_populations_to_variants(self, variants, population_slug_list):
         """
         variants is a list of annotated variants, this adds more population frequencies to that annotation
         """
+        frequencies = self.get_frequencies_many([variant.unique_tuple() for variant in variants])
         for variant in variants:
-            freqs = self.get_frequencies(variant.xpos, variant.ref, variant.alt)
+            freqs = frequencies[variant.unique_tuple()]
             for slug in population_slug_list:
                 if slug in freqs:
                     variant.annotation['freqs'][slug] = freqs[slug]
@@ -42,13 +67,6 @@ class PopulationFrequencyStore():
     def _ensure_indices(self):
         self._get_db().pop_variants.ensure_index([('xpos', 1), ('ref', 1), ('alt', 1)])
 
-    def _add_population_frequency(self, xpos, ref, alt, population, freq):
-        self._get_db().pop_variants.update(
-            {'xpos': xpos, 'ref': ref, 'alt': alt},
-            {'$set': {population: freq}},
-            upsert=True
-        )
-
     def load_populations(self, population_list):
         """
         Load all the populations described in population_list into annotator
@@ -61,6 +79,46 @@ class PopulationFrequencyStore():
         """
         Take a population and a data source; extract and load it into annotator
         Data source can be VCF file, VCF Counts file, or a counts dir (in the case of ESP data)
+
+        Frequencies are upserted in bulk batches, and a checkpoint with the number of records committed so far is saved
+        after each batch. If a load is interrupted, loading the same population file again resumes from the checkpoint
+        """
+        slug = population['slug']
+        source_path = population.get('file_path') or population.get('dir_path')
+        checkpoints = self._get_db().pop_variants_checkpoints
+        checkpoint = checkpoints.find_one({'population': slug, 'source_path': source_path})
+        resume_from_record = checkpoint['records'] if checkpoint else 0
+        if resume_from_record:
+            print("Resuming %s after record %d (xpos %s)" % (slug, resume_from_record, checkpoint['xpos']))
+
+        records = 0
+        requests = []
+        for xpos, ref, alt, freq in self._iterate_population_frequencies(population):
+            records += 1
+            if records <= resume_from_record:
+                continue
+            requests.append(UpdateOne({'xpos': xpos, 'ref': ref, 'alt': alt}, {'$set': {slug: freq}}, upsert=True))
+            if len(requests) >= self._bulk_write_size:
+                self._write_population_frequencies(requests, slug, source_path, records, xpos)
+                requests = []
+
+        if requests:
+            self._write_population_frequencies(requests, slug, source_path, records, xpos)
+        checkpoints.delete_one({'population': slug, 'source_path': source_path})
+        print("Finished loading %d %s records" % (records, slug))
+
+    def _write_population_frequencies(self, requests, slug, source_path, records, xpos):
+        self._get_db().pop_variants.bulk_write(requests, ordered=False)
+        self._get_db().pop_variants_checkpoints.update_one(
+            {'population': slug, 'source_path': source_path},
+            {'$set': {'records': records, 'xpos': xpos}},
+            upsert=True
+        )
+        print("Loaded %d %s records, through xpos %s" % (records, slug, xpos))
+
+    def _iterate_population_frequencies(self, population):
+        """
+        Yields (xpos, ref, alt, freq) tuples for the given population's data source, in file order
         """
         if population['file_type'] == 'vcf':
             if population['file_path'].endswith('.gz'):
@@ -75,7 +133,7 @@ class PopulationFrequencyStore():
             for variant in vcf_stuff.iterate_vcf(vcf_file, genotypes=True, genotype_meta=False):
                 progress.update(progress_file.tell())
                 freq = get_aaf(variant)
-                self._add_population_frequency(variant.xpos, variant.ref, variant.alt, population['slug'], freq)
+                yield variant.xpos, variant.ref, variant.alt, freq
             vcf_file.close()
 
         elif population['file_type'] == 'sites_vcf':
@@ -112,13 +170,7 @@ class PopulationFrequencyStore():
                 else:
                     freq = float(variant.extras.get(meta_key, 0).split(',')[variant.extras['alt_allele_pos']])
 
-                self._add_population_frequency(
-                    variant.xpos,
-                    variant.ref,
-                    variant.alt,
-                    population['slug'],
-                    freq
-                )
+                yield variant.xpos, variant.ref, variant.alt, freq
             vcf_file.close()
 
         #
@@ -132,13 +184,7 @@ class PopulationFrequencyStore():
                 progress = get_progressbar(file_size, 'Loading ESP file: {}'.format(filename))
                 for variant in get_variants_from_esp_file(f):
                     progress.update(f.tell())
-                    self._add_population_frequency(
-                        variant['xpos'],
-                        variant['ref'],
-                        variant['alt'],
-                        population['slug'],
-                        variant[population['counts_key']]
-                    )
+                    yield variant['xpos'], variant['ref'], variant['alt'], variant[population['counts_key']]
                 f.close()
         #
         # text file of allele counts, as Monkol has been using for the joint calling data
@@ -165,13 +211,7 @@ class PopulationFrequencyStore():
                 if int(fields[5]) == 0:
                     continue
                 freq = float(fields[4]) / float(fields[5])
-                self._add_population_frequency(
-                    xpos,
-                    ref,
-                    alt,
-                    population['slug'],
-                    freq
-                )
+                yield xpos, ref, alt, freq
             counts_file.close()
 
         # this is now the canonical allele frequency file -
@@ -193,13 +233,7 @@ class PopulationFrequencyStore():
                 ref = fields[1]
                 alt = fields[2]
                 freq = float(fields[3])
-                self._add_population_frequency(
-                    xpos,
-                    ref,
-                    alt,
-                    population['slug'],
-                    freq
-                )
+                yield xpos, ref, alt, freq
             counts_file.close()
 
         elif population['file_type'] == 'tsv_file':
@@ -223,13 +257,7 @@ class PopulationFrequencyStore():
                 freq = float(fields[4])
 
                 xpos = genomeloc.get_single_location(chrom, pos)
-                self._add_population_frequency(
-                    xpos,
-                    ref,
-                    alt,
-                    population['slug'],
-                    freq
-                )
+                yield xpos, ref, alt, freq
             freq_file.close()
 
         elif population['file_type'] == 'sites_vcf_with_counts':
@@ -270,13 +298,7 @@ class PopulationFrequencyStore():
                     freq = 0.0
                 else:
                     freq = float(ac)/an
-                self._add_population_frequency(
-                    variant.xpos,
-                    variant.ref,
-                    variant.alt,
-                    population['slug'],
-                    freq
-                )
+                yield variant.xpos, variant.ref, variant.alt, freq
             vcf_file.close()
         else:
             raise ValueError("Unexpected population['file_type']: " + population['file_type'])
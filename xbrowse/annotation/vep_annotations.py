@@ -1,9 +1,12 @@
 import datetime
+import hashlib
+import itertools
 import os
 import re
-#import sh
+import subprocess
 import tempfile
-from collections import defaultdict
+from collections import defaultdict, deque
+from operator import itemgetter
 from xbrowse import vcf_stuff
 from tqdm import tqdm
 
@@ -52,6 +55,39 @@ CODING_POS_CUTOFF = SO_SEVERITY_ORDER_POS['coding_sequence_variant']
 
 NUM_SO_TERMS = len(SO_SEVERITY_ORDER)
 
+# the CSQ fields that are stored in the vep_annotation for each transcript - other fields are not used anywhere
+VEP_ANNOTATION_FIELDS = [
+    'allele_num',
+    'consequence',
+    'gene',
+    'feature',
+    'biotype',
+    'canonical',
+    'symbol',
+    'hgvsc',
+    'hgvsp',
+    'amino_acids',
+    'protein_position',
+    'codons',
+    'cdna_position',
+    'cds_position',
+    'lof',
+    'lof_flags',
+    'lof_filter',
+    'polyphen',
+    'sift',
+    'clin_sig',
+    'cadd_phred',
+    'polyphen2_hvar_pred',
+    'sift_pred',
+    'fathmm_pred',
+    'mutationtaster_pred',
+    'metasvm_pred',
+]
+
+# map of '&'-separated VEP consequence string -> the worst consequence in it
+WORST_CONSEQUENCE_CACHE = {}
+
 
 class HackedVEPAnnotator():
     """
@@ -59,16 +95,21 @@ class HackedVEPAnnotator():
     This class is a wrapper around VEP that provides a pythonic interface to VEP annotations
     It should just call the REST API, but that is slow, so it spins out subprocesses :(
     """
-    def __init__(self, vep_perl_path, vep_cache_dir, vep_batch_size=20000, human_ancestor_fa=None):
+    def __init__(self, vep_perl_path, vep_cache_dir, vep_batch_size=20000, human_ancestor_fa=None, vep_processes=1, vep_batch_cache_dir=None):
+        """
+        vep_processes: number of VEP subprocesses to run at the same time, each on a separate batch
+        vep_batch_cache_dir: if set, the VEP output for each batch is kept in this directory until all the batches
+            are loaded, so that a load that crashed can be re-run without re-annotating the batches that finished
+        """
         self._vep_perl_path = vep_perl_path
         self._vep_cache_dir = vep_cache_dir
         self._vep_batch_size = vep_batch_size
         self._human_ancestor_fa = human_ancestor_fa
+        self._vep_processes = vep_processes
+        self._vep_batch_cache_dir = vep_batch_cache_dir
+        self._vep_config_hash = None
 
-    def _run_vep(self, input_vcf, output_vcf):
-        """
-        Just run VEP to the xbrowse configurations
-        """
+    def _get_vep_command(self, input_vcf, output_vcf):
         vep_command = [
             self._vep_perl_path,
             "--offline",
@@ -87,48 +128,163 @@ class HackedVEPAnnotator():
             vep_command += [
                 "--plugin", "LoF,human_ancestor_fa:{}".format(self._human_ancestor_fa),
             ]
+        return vep_command
 
+    def _start_vep(self, input_vcf, output_vcf):
+        """
+        Just start VEP to the xbrowse configurations, returns the subprocess
+        """
+        vep_command = self._get_vep_command(input_vcf, output_vcf)
         print("Running VEP:\n" + " ".join(vep_command))
-        sh.perl(vep_command)
+        return subprocess.Popen(["perl"] + vep_command)
 
-    def get_vep_annotations_for_variants(self, variant_t_list):
+    def _get_vep_config_hash(self):
         """
-        Load annotations for a set of variants
-        - write these annotations to a temporary vcf file
-        - runs VEP on the temp VCF file
-        - loads newly annotated VCF to annotator
-        Obviously there should be a better way to do this, but this is what we have for now
+        Hash of the VEP command and script, so output cached by a different VEP version or configuration is not used
         """
+        if self._vep_config_hash is None:
+            config_hash = hashlib.sha1('\t'.join(self._get_vep_command('', '')))
+            with open(self._vep_perl_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    config_hash.update(chunk)
+            self._vep_config_hash = config_hash.hexdigest()
+        return self._vep_config_hash
+
+    def _get_batch_output_path(self, variant_t_batch):
+        batch_hash = hashlib.sha1(self._get_vep_config_hash())
+        batch_hash.update('\n'.join('%s\t%s\t%s' % variant_t for variant_t in variant_t_batch))
+        return os.path.join(self._vep_batch_cache_dir, 'vep_batch_%s.vcf' % batch_hash.hexdigest())
+
+    def _start_batch(self, variant_t_batch, filter_batch=None):
+        """
+        Start running VEP on a batch, unless its output is already cached
+        Returns a dict with the batch's VEP process and files, which _finish_batch takes
+        """
+        batch = {'process': None, 'input_path': None, 'vep_output_path': None, 'output_path': None}
+        if self._vep_batch_cache_dir:
+            # the cache is keyed by the unfiltered batch, so batch boundaries and cache keys stay the same when an
+            # interrupted load is re-run, even though some of the variants were annotated in the meantime
+            batch['output_path'] = self._get_batch_output_path(variant_t_batch)
+            if os.path.isfile(batch['output_path']):
+                print "Using cached VEP output for {} variants: {}".format(len(variant_t_batch), batch['output_path'])
+                return batch
+
+        if filter_batch:
+            variant_t_batch = filter_batch(variant_t_batch)
+        if not variant_t_batch:
+            batch['output_path'] = None
+            return batch
+
+        if self._vep_batch_cache_dir:
+            # VEP writes to a temp file that is only moved to the cache path once VEP finishes, so partial output
+            # from a crashed run is never used
+            batch['vep_output_path'] = batch['output_path'] + '.tmp'
+        else:
+            batch['output_path'] = batch['vep_output_path'] = _make_temp_file()
 
-        def process_batch(variant_t_batch):
-            vep_input_file_path = tempfile.mkstemp()[1]
-            vep_output_file_path = tempfile.mkstemp()[1]
-
-            vep_input_file = open(vep_input_file_path, 'w')
+        batch['input_path'] = _make_temp_file()
+        with open(batch['input_path'], 'w') as vep_input_file:
             vcf_stuff.write_sites_vcf(vep_input_file, variant_t_batch)
-            vep_input_file.close()
-
-            self._run_vep(vep_input_file_path, vep_output_file_path)
-
-            with open(vep_output_file_path) as f:
-                ret = list(parse_vep_annotations_from_vcf(f))
-            os.remove(vep_input_file_path)
-            os.remove(vep_output_file_path)
-            return ret
-
-        batch = []
-        for variant_t in variant_t_list:
-            batch.append(variant_t)
-            if len(batch) == self._vep_batch_size:
-                print "Running VEP on next {} variants, through {}".format(self._vep_batch_size, variant_t[0])
-                annotations = process_batch(batch)
+
+        print "Running VEP on next {} variants, through {}".format(len(variant_t_batch), variant_t_batch[-1][0])
+        batch['process'] = self._start_vep(batch['input_path'], batch['vep_output_path'])
+        return batch
+
+    def _finish_batch(self, batch):
+        """
+        Wait for the VEP process of a batch started by _start_batch, and return its parsed annotations
+        """
+        if batch['process'] is not None:
+            try:
+                _wait_for_vep(batch['process'], batch['input_path'])
+            except Exception:
+                _remove_file(batch['vep_output_path'])
+                raise
+            finally:
+                os.remove(batch['input_path'])
+            if batch['vep_output_path'] != batch['output_path']:
+                os.rename(batch['vep_output_path'], batch['output_path'])
+
+        if batch['output_path'] is None:
+            # none of the variants in the batch needed to be annotated
+            return []
+
+        with open(batch['output_path']) as f:
+            ret = list(parse_vep_annotations_from_vcf(f))
+        if not self._vep_batch_cache_dir:
+            os.remove(batch['output_path'])
+        return ret
+
+    def get_vep_annotations_for_variants(self, variant_t_list, filter_batch=None):
+        """
+        Load annotations for a set of variants
+        - write these annotations to temporary vcf files, one per batch
+        - runs VEP on the temp VCF files, with up to vep_processes batches at a time
+        - loads newly annotated VCFs to annotator, in the same order as the batches
+        variant_t_list can be a generator, eg. over a whole VCF, so that VEP keeps running on the next batches while the
+        annotations are loaded
+        filter_batch: optional function that returns the variants in a batch that need to be annotated, eg. the ones
+            that are not annotated yet. It is only called for batches that are not cached
+        Cached batch output is only kept until all the annotations have been loaded
+        Obviously there should be a better way to do this, but this is what we have for now
+        """
+        def iterate_batches():
+            batch = []
+            for variant_t in variant_t_list:
+                batch.append(variant_t)
+                if len(batch) == self._vep_batch_size:
+                    yield batch
+                    batch = []
+            if len(batch) > 0:
+                yield batch
+
+        if self._vep_batch_cache_dir and not os.path.isdir(self._vep_batch_cache_dir):
+            os.makedirs(self._vep_batch_cache_dir)
+
+        batches = iterate_batches()
+        running_batches = deque()
+        cached_output_paths = []
+        try:
+            for variant_t_batch in itertools.islice(batches, self._vep_processes):
+                running_batches.append(self._start_batch(variant_t_batch, filter_batch))
+
+            while running_batches:
+                batch = running_batches.popleft()
+                annotations = self._finish_batch(batch)
+                if self._vep_batch_cache_dir and batch['output_path']:
+                    cached_output_paths.append(batch['output_path'])
+                # start the next batch before handing back the annotations, so VEP keeps running meanwhile
+                for variant_t_batch in itertools.islice(batches, 1):
+                    running_batches.append(self._start_batch(variant_t_batch, filter_batch))
                 for variant, annotation in annotations:
                     yield variant.unique_tuple(), annotation
-                batch = []
-        if len(batch) > 0:
-            annotations = process_batch(batch)
-            for variant, annotation in annotations:
-                yield variant.unique_tuple(), annotation
+        finally:
+            for batch in running_batches:
+                if batch['process'] is not None:
+                    if batch['process'].poll() is None:
+                        batch['process'].kill()
+                        batch['process'].wait()
+                    os.remove(batch['input_path'])
+                    _remove_file(batch['vep_output_path'])
+
+        for output_path in cached_output_paths:
+            _remove_file(output_path)
+
+
+def _make_temp_file():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    return path
+
+
+def _remove_file(path):
+    if path and os.path.isfile(path):
+        os.remove(path)
+
+
+def _wait_for_vep(process, input_vcf):
+    if process.wait() != 0:
+        raise Exception("VEP failed with exit code %s on %s" % (process.returncode, input_vcf))
 
 
 def parse_vep_annotations_from_vcf(vcf_file_obj):
@@ -148,20 +304,25 @@ def parse_vep_annotations_from_vcf(vcf_file_obj):
 
     csq_field_names = csq_header_line.strip().strip('">').split("Format: ")[1].split("|")
     csq_field_names = map(lambda s: s.lower(), csq_field_names)
+    num_csq_fields = len(csq_field_names)
+
+    # only the used CSQ fields are added to the annotations, so look up their positions once
+    for field in ['allele_num', 'consequence']:
+        if field not in csq_field_names:
+            raise ValueError("CSQ field %s not found in %s header" % (field, vcf_file_obj))
+    annotation_fields = [field for field in VEP_ANNOTATION_FIELDS if field in csq_field_names]
+    get_annotation_values = itemgetter(*[csq_field_names.index(field) for field in annotation_fields])
+    allele_num_index = csq_field_names.index('allele_num')
+    consequence_index = csq_field_names.index('consequence')
 
     total_sites_counter = 0
     missing_csq_counter = 0
     for vcf_row in tqdm(vcf_file_obj, unit=' variants'):
         total_sites_counter += 1
-        vcf_row_fields = vcf_row.rstrip('\n').split("\t")
-        chrom_field = vcf_row_fields[0]
-        pos_field = vcf_row_fields[1]
-        ref_field = vcf_row_fields[3]
-        alt_field = vcf_row_fields[4]
-        filter_field = vcf_row_fields[6]
-        info_field = vcf_row_fields[7]
-        info_field_dict = dict([tuple(key_value.split("=")) if "=" in key_value else (key_value, '') for key_value in info_field.split(";")])
-        if "CSQ" not in info_field_dict:
+        # genotype columns are not needed
+        vcf_row_fields = vcf_row.rstrip('\n').split("\t", 8)
+        csq_string = _get_csq_info_value(vcf_row_fields[7])
+        if csq_string is None:
             missing_csq_counter += 1
             if total_sites_counter > 10000 and missing_csq_counter / float(total_sites_counter) > 0.2:
                 raise Exception("%d out of %d vcf rows processed so far are missing the CSQ INFO field. Something probably went wrong with VEP annotation." % (missing_csq_counter, total_sites_counter))
@@ -169,24 +330,27 @@ def parse_vep_annotations_from_vcf(vcf_file_obj):
                 continue  # Skip the occasional sites where, due to subsetting, the alt allele is *
 
         vep_annotations = defaultdict(list)  # map allele num to vep annotation
-        for i, per_transcript_csq_string in enumerate(info_field_dict['CSQ'].split(",")):
+        for i, per_transcript_csq_string in enumerate(csq_string.split(",")):
             csq_values = per_transcript_csq_string.split('|')
 
             # sanity-check the csq_values
-            if len(csq_values) != len(csq_field_names):
+            if len(csq_values) != num_csq_fields:
                 raise ValueError("CSQ per-transcript string %s contains %s values instead of %s:\n%s" % (
-                    i, len(csq_values), len(csq_field_names), per_transcript_csq_string))
+                    i, len(csq_values), num_csq_fields, per_transcript_csq_string))
 
-            vep_annotation = dict(zip(csq_field_names, csq_values))
-            vep_annotation['is_nmd'] = "NMD_transcript_variant" in csq_values
+            consequence = get_worst_vep_consequence(csq_values[consequence_index])
+            if not consequence:
+                continue
+
+            vep_annotation = dict(zip(annotation_fields, get_annotation_values(csq_values)))
+            vep_annotation['consequence'] = consequence
+            # checks whether any CSQ value is exactly the given term
+            delimited_csq_string = '|%s|' % per_transcript_csq_string
+            vep_annotation['is_nmd'] = "|NMD_transcript_variant|" in delimited_csq_string
             # 2 kinds of 'nc_transcript_variant' label due to name change in Ensembl v77
-            vep_annotation['is_nc'] = "nc_transcript_variant" in csq_values or "non_coding_transcript_variant" in csq_values
+            vep_annotation['is_nc'] = "|nc_transcript_variant|" in delimited_csq_string or "|non_coding_transcript_variant|" in delimited_csq_string
 
-            variant_consequence_strings = vep_annotation["consequence"].split("&")
-            vep_annotation["consequence"] = get_worst_vep_annotation(variant_consequence_strings)
-            if not vep_annotation["consequence"]:
-                continue
-            allele_num = int(vep_annotation['allele_num']) - 1
+            allele_num = int(csq_values[allele_num_index]) - 1
             vep_annotations[allele_num].append(vep_annotation)
 
         variant_objects = vcf_stuff.get_variants_from_vcf_fields(vcf_row_fields[:5])
@@ -211,6 +375,22 @@ def parse_vep_annotations_from_vcf(vcf_file_obj):
 
 
 
+def _get_csq_info_value(info_field):
+    """
+    Returns the value of the CSQ key in a VCF INFO field, without parsing the rest of the field
+    """
+    if info_field.startswith('CSQ='):
+        start = 4
+    else:
+        start = info_field.find(';CSQ=')
+        if start == -1:
+            return None
+        start += 5
+
+    end = info_field.find(';', start)
+    return info_field[start:end] if end != -1 else info_field[start:]
+
+
 def parse_csq_info(csq_string, csq_field_names):
     """
     Parses the CSQ string added by VEP to the VCF INFO field.
@@ -238,8 +418,7 @@ def parse_csq_info(csq_string, csq_field_names):
         # 2 kinds of 'nc_transcript_variant' label due to name change in Ensembl v77
         d['is_nc'] = "nc_transcript_variant" in csq_values or "non_coding_transcript_variant" in csq_values
 
-        variant_consequence_strings = d["consequence"].split("&")
-        d["consequence"] = get_worst_vep_annotation(variant_consequence_strings)
+        d["consequence"] = get_worst_vep_consequence(d["consequence"])
         if not d["consequence"]:
             continue
 
@@ -270,6 +449,18 @@ def get_worst_vep_annotation(vep_variant_consequence_strings):
     return SO_SEVERITY_ORDER[worst_i]
 
 
+def get_worst_vep_consequence(consequence_string):
+    """
+    Cached get_worst_vep_annotation for an '&'-separated VEP consequence string, as there are few distinct ones
+    """
+    try:
+        return WORST_CONSEQUENCE_CACHE[consequence_string]
+    except KeyError:
+        worst_consequence = get_worst_vep_annotation(consequence_string.split("&"))
+        WORST_CONSEQUENCE_CACHE[consequence_string] = worst_consequence
+        return worst_consequence
+
+
 def get_csq_fields_from_vcf_desc(csq_desc):
     """
     Runs a regex on meta line and gives back list of CSQ fields
@@ -0,0 +1,127 @@
+import itertools
+import mock
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from xbrowse.annotation import vep_annotations
+
+CSQ_FORMAT = 'Allele|Consequence|Gene|Feature|BIOTYPE|CANONICAL|EXON|ALLELE_NUM|HGVSc'
+
+VEP_VCF_LINES = [
+    '##fileformat=VCFv4.1\n',
+    '##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence annotations from Ensembl VEP. Format: {}">\n'.format(CSQ_FORMAT),
+    '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n',
+    '1\t1000\t.\tA\tG,T\t50\tPASS\tAC=1;CSQ=G|missense_variant&splice_region_variant|ENSG1|ENST1|protein_coding|YES|2/5|1|c.1A>G,'
+    'T|intron_variant|ENSG1|ENST2|nonsense_mediated_decay||NMD_transcript_variant|2|c.1-5A>T,'
+    'G|non_coding_transcript_variant|ENSG2|ENST3|lincRNA|||1|;AN=4\n',
+    '1\t2000\t.\tC\tA\t50\tPASS\tCSQ=A|unknown_variant|ENSG1|ENST1|protein_coding|YES||1|\n',
+    '1\t3000\t.\tC\tA\t50\tPASS\tAC=1\n',
+]
+
+# writes the sites in the -i VCF to the -o VCF, with a missense CSQ annotation
+FAKE_VEP_SCRIPT = """
+my %args;
+for my $i (0..$#ARGV - 1) { $args{$ARGV[$i]} = $ARGV[$i + 1]; }
+open(IN, '<', $args{'-i'}) or die;
+open(OUT, '>', $args{'-o'}) or die;
+print OUT '##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence annotations from Ensembl VEP. Format: """ + CSQ_FORMAT + """">' . "\\n";
+while (my $line = <IN>) {
+    if ($line =~ /^#/) { print OUT $line; next; }
+    chomp $line;
+    my @fields = split(/\\t/, $line);
+    $fields[7] = "CSQ=$fields[4]|missense_variant|ENSG1|ENST1|protein_coding|YES|1/2|1|";
+    print OUT join("\\t", @fields) . "\\n";
+}
+"""
+
+
+class VepAnnotationsTest(TestCase):
+
+    def test_parse_vep_annotations_from_vcf(self):
+        annotations = [
+            (variant.unique_tuple(), annotation)
+            for variant, annotation in vep_annotations.parse_vep_annotations_from_vcf(iter(VEP_VCF_LINES))
+        ]
+
+        self.assertListEqual(annotations, [
+            ((1000001000, 'A', 'G'), [
+                {'allele_num': '1', 'consequence': 'missense_variant', 'gene': 'ENSG1', 'feature': 'ENST1',
+                 'biotype': 'protein_coding', 'canonical': 'YES', 'hgvsc': 'c.1A>G', 'is_nmd': False, 'is_nc': False},
+                {'allele_num': '1', 'consequence': 'non_coding_transcript_variant', 'gene': 'ENSG2', 'feature': 'ENST3',
+                 'biotype': 'lincRNA', 'canonical': '', 'hgvsc': '', 'is_nmd': False, 'is_nc': True},
+            ]),
+            ((1000001000, 'A', 'T'), [
+                {'allele_num': '2', 'consequence': 'intron_variant', 'gene': 'ENSG1', 'feature': 'ENST2',
+                 'biotype': 'nonsense_mediated_decay', 'canonical': '', 'hgvsc': 'c.1-5A>T', 'is_nmd': True,
+                 'is_nc': False},
+            ]),
+        ])
+
+    def test_get_csq_info_value(self):
+        self.assertEqual(vep_annotations._get_csq_info_value('CSQ=a|b'), 'a|b')
+        self.assertEqual(vep_annotations._get_csq_info_value('AC=1;CSQ=a|b;AN=2'), 'a|b')
+        self.assertIsNone(vep_annotations._get_csq_info_value('AC=1;XCSQ=a|b'))
+
+    def test_get_vep_annotations_for_variants(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            vep_script_path = os.path.join(temp_dir, 'fake_vep.pl')
+            with open(vep_script_path, 'w') as f:
+                f.write(FAKE_VEP_SCRIPT)
+            vep_batch_cache_dir = os.path.join(temp_dir, 'vep_batches')
+            vep_temp_dir = os.path.join(temp_dir, 'tmp')
+            os.mkdir(vep_temp_dir)
+
+            annotator = vep_annotations.HackedVEPAnnotator(
+                vep_script_path, temp_dir, vep_batch_size=2, vep_processes=2, vep_batch_cache_dir=vep_batch_cache_dir)
+            variant_t_list = [(1000000000 + i * 100, 'A', 'G') for i in range(1, 6)]
+
+            with mock.patch('tempfile.tempdir', vep_temp_dir):
+                annotations = list(annotator.get_vep_annotations_for_variants(variant_t_list))
+                self.assertListEqual([variant_t for variant_t, _ in annotations], variant_t_list)
+                self.assertEqual(annotations[0][1][0]['consequence'], 'missense_variant')
+                # cached output is removed once all the batches are loaded
+                self.assertListEqual(os.listdir(vep_batch_cache_dir), [])
+
+                # an interrupted load keeps the output of finished batches, and cleans up the rest
+                annotations_iter = annotator.get_vep_annotations_for_variants(variant_t_list)
+                self.assertListEqual(list(itertools.islice(annotations_iter, 2)), annotations[:2])
+                annotations_iter.close()
+                cached_files = os.listdir(vep_batch_cache_dir)
+                self.assertListEqual(cached_files, [os.path.basename(annotator._get_batch_output_path(variant_t_list[:2]))])
+                self.assertListEqual(os.listdir(vep_temp_dir), [])
+
+                # finished batches are not re-annotated
+                with mock.patch.object(annotator, '_start_vep', wraps=annotator._start_vep) as mock_start_vep:
+                    self.assertListEqual(list(annotator.get_vep_annotations_for_variants(variant_t_list)), annotations)
+                self.assertEqual(mock_start_vep.call_count, 2)
+                self.assertListEqual(os.listdir(vep_batch_cache_dir), [])
+
+                # temp files are removed without a cache dir
+                no_cache_annotator = vep_annotations.HackedVEPAnnotator(vep_script_path, temp_dir, vep_batch_size=2)
+                self.assertListEqual(list(no_cache_annotator.get_vep_annotations_for_variants(variant_t_list)), annotations)
+                self.assertListEqual(os.listdir(vep_temp_dir), [])
+
+                # output cached with a different VEP configuration is not used
+                other_annotator = vep_annotations.HackedVEPAnnotator(
+                    vep_script_path, vep_temp_dir, vep_batch_size=2, vep_batch_cache_dir=vep_batch_cache_dir)
+                self.assertNotEqual(
+                    other_annotator._get_batch_output_path(variant_t_list[:2]),
+                    annotator._get_batch_output_path(variant_t_list[:2]))
+
+                # failed batches do not leave any output behind, with or without a cache dir
+                with open(vep_script_path, 'w') as f:
+                    f.write('exit 1;\n')
+                for vep_batch_cache_dir in [vep_batch_cache_dir, None]:
+                    annotator = vep_annotations.HackedVEPAnnotator(
+                        vep_script_path, temp_dir, vep_batch_size=2, vep_processes=2,
+                        vep_batch_cache_dir=vep_batch_cache_dir)
+                    with self.assertRaises(Exception):
+                        list(annotator.get_vep_annotations_for_variants(variant_t_list))
+                    self.assertListEqual(os.listdir(vep_temp_dir), [])
+                self.assertListEqual(os.listdir(os.path.join(temp_dir, 'vep_batches')), [])
+        finally:
+            shutil.rmtree(temp_dir)
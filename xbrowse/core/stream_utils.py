@@ -6,6 +6,11 @@ Streams themselves can be operated on with these utils
 import Queue
 import heapq
 import itertools
+import logging
+
+from xbrowse.core.constants import GENOME_VERSION_GRCh37
+
+logger = logging.getLogger(__name__)
 
 
 def combine_variant_streams(stream_list):
@@ -50,37 +55,70 @@ def unique_variant_stream(stream):
     raise NotImplementedError
 
 
+# a gene's variants are yielded once the variant stream is this far past the end of the gene, as VEP also assigns
+# variants up to 5kb upstream or downstream of a gene to it
+GENE_END_FLUSH_MARGIN = 10000
+
+
 def variant_stream_to_gene_stream(stream, reference):
     """
-    Turns a variant stream into a stream of tuples (gene, variant_list)
-    Allows multiple gene annotations, but requires gene annotations to be contiguous
+    Turns a variant stream in genomic order into a stream of tuples (gene, variant_list)
+    Allows multiple gene annotations per variant
     TODO: should switch to generic regions instead of gene
-    TODO: check this for corner cases - what if variant / gene order is awkward?
 
     Algorithm: look through genome, keep track of which genes you are currently reading (current_genes)
     For each variant:
-    -- get list of genes
-    -- add variant to each in current_genes
-    -- if any genes didn't get a variant added, yield them
-
+    -- yield the genes that the stream is now past the end of, in order of gene start
+    -- add variant to each of its genes, looking up the bounds of genes that are new
+    Only the variants for genes around the current position are kept in memory. Genes with unknown bounds are
+    yielded at the end of the stream. Gene bounds are looked up in the genome build of the variants, and a gene's end
+    is extended to the furthest variant in it, as VEP gene annotations can extend past the reference gene bounds.
+    A variant in a gene that was already yielded is logged and yielded in a new group for that gene. A ValueError is
+    raised if the stream is out of order
     """
-    current_genes = {}
-    while True:
-        try:
-            variant = stream.next()
-        except StopIteration:
-            for gene, variants in current_genes.items():
-                yield (gene, variants)
-            raise StopIteration
-
-        genes = variant.gene_ids
-        for gene in genes:
+    current_genes = {}  # map from gene -> variant list
+    gene_queue = []  # priority queue of (gene start, gene) for the current genes with known bounds
+    gene_ends = {}  # map from gene -> the furthest of its end and its variants, for the current genes with known bounds
+    flushed_genes = set()
+    last_xpos = None
+
+    def flush_to(xpos):
+        while gene_queue and gene_ends[gene_queue[0][1]] + GENE_END_FLUSH_MARGIN < xpos:
+            _, gene = heapq.heappop(gene_queue)
+            del gene_ends[gene]
+            flushed_genes.add(gene)
+            yield (gene, current_genes.pop(gene))
+
+    for variant in stream:
+        if last_xpos is not None and variant.xpos < last_xpos:
+            raise ValueError('Variant stream is not in genomic order: {} after {}'.format(variant.xpos, last_xpos))
+        last_xpos = variant.xpos
+
+        for item in flush_to(variant.xpos):
+            yield item
+
+        genome_version = (variant.annotation or {}).get('genome_version') or GENOME_VERSION_GRCh37
+        for gene in variant.gene_ids:
             if gene == '':
                 continue
-            if not gene in current_genes:
+            if gene not in current_genes:
+                if gene in flushed_genes:
+                    logger.warning('Variant {} is more than {} bp past the end of gene {}, which was already yielded'
+                                   .format(variant.xpos, GENE_END_FLUSH_MARGIN, gene))
                 current_genes[gene] = []
+                gene_start, gene_end = reference.get_gene_bounds(gene, genome_version=genome_version)[:2]
+                if gene_start is not None:
+                    heapq.heappush(gene_queue, (gene_start, gene))
+                    gene_ends[gene] = gene_end
+            if gene in gene_ends and variant.xpos > gene_ends[gene]:
+                gene_ends[gene] = variant.xpos
             current_genes[gene].append(variant)
 
+    for item in flush_to(float('inf')):
+        yield item
+    for gene, variants in current_genes.items():
+        yield (gene, variants)
+
 
 # TODO: tests for ref/alt corner cases
 # TODO: make public
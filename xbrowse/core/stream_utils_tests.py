@@ -0,0 +1,93 @@
+import mock
+from django.test import TestCase
+
+from xbrowse.core import stream_utils
+from xbrowse.core.variants import Variant
+
+GENE_BOUNDS = {
+    'ENSG1': (1000001000, 1000005000),
+    'ENSG2': (1000004000, 1000200000),
+    'ENSG3': (1000100000, 1000110000),
+}
+
+GRCH38_GENE_BOUNDS = {
+    'ENSG1': (1000501000, 1000505000),
+}
+
+
+class MockReference(object):
+
+    def get_gene_bounds(self, gene_id, genome_version=None):
+        gene_bounds = GRCH38_GENE_BOUNDS if genome_version == '38' else GENE_BOUNDS
+        return gene_bounds.get(gene_id, (None, None, None))
+
+
+def _variant(xpos, gene_ids, genome_version='37'):
+    variant = Variant(xpos, 'A', 'G')
+    variant.gene_ids = gene_ids
+    variant.annotation = {'genome_version': genome_version}
+    return variant
+
+
+class StreamUtilsTest(TestCase):
+
+    def test_variant_stream_to_gene_stream(self):
+        variants = [
+            _variant(1000001500, ['ENSG1']),
+            _variant(1000004500, ['ENSG1', 'ENSG2', '']),
+            _variant(1000008000, ['ENSG1']),
+            _variant(1000105000, ['ENSG2', 'ENSG3', 'ENSG_UNKNOWN']),
+            _variant(1000150000, ['ENSG2']),
+            _variant(2000001000, []),
+        ]
+
+        streamed_variants = []
+
+        def variant_stream():
+            for variant in variants:
+                streamed_variants.append(variant)
+                yield variant
+
+        gene_stream = stream_utils.variant_stream_to_gene_stream(variant_stream(), MockReference())
+
+        # genes are yielded as soon as the stream is past their end
+        gene_id, gene_variants = next(gene_stream)
+        self.assertEqual(gene_id, 'ENSG1')
+        self.assertListEqual(gene_variants, variants[:3])
+        self.assertListEqual(streamed_variants, variants[:4])
+
+        # ENSG3 ends first, but is yielded after ENSG2, which starts before it
+        self.assertListEqual(list(gene_stream), [
+            ('ENSG2', [variants[1], variants[3], variants[4]]),
+            ('ENSG3', [variants[3]]),
+            ('ENSG_UNKNOWN', [variants[3]]),
+        ])
+
+    def test_variant_stream_to_gene_stream_genome_version(self):
+        # GRCh38 variants past the GRCh37 end of the gene are still in it
+        variants = [_variant(1000501500, ['ENSG1'], '38'), _variant(1000504500, ['ENSG1'], '38')]
+        self.assertListEqual(
+            list(stream_utils.variant_stream_to_gene_stream(iter(variants), MockReference())), [('ENSG1', variants)])
+
+    def test_variant_stream_to_gene_stream_unsorted(self):
+        variants = [_variant(1000004500, ['ENSG1']), _variant(1000001500, ['ENSG1'])]
+        with self.assertRaises(ValueError):
+            list(stream_utils.variant_stream_to_gene_stream(iter(variants), MockReference()))
+
+    def test_variant_stream_to_gene_stream_past_gene_end(self):
+        # variants past the reference end of a gene keep it from being yielded until the stream is past them
+        variants = [
+            _variant(1000001500, ['ENSG1']),
+            _variant(1000014000, ['ENSG1']),
+            _variant(1000023000, ['ENSG1']),
+            _variant(1000050000, ['ENSG2']),
+            _variant(1000070000, ['ENSG1']),
+        ]
+        gene_stream = stream_utils.variant_stream_to_gene_stream(iter(variants), MockReference())
+        self.assertTupleEqual(next(gene_stream), ('ENSG1', variants[:3]))
+
+        # a variant further past the end of a gene that was already yielded is yielded in a new group for the gene
+        with mock.patch('xbrowse.core.stream_utils.logger') as mock_logger:
+            self.assertListEqual(list(gene_stream), [('ENSG1', [variants[4]]), ('ENSG2', [variants[3]])])
+        mock_logger.warning.assert_called_with(
+            'Variant 1000070000 is more than 10000 bp past the end of gene ENSG1, which was already yielded')
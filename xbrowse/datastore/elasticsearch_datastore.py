@@ -104,6 +104,15 @@ def _add_index_fields_to_variant(variant_dict, annotation=None):
         variant_dict['db_gene_ids'] = annotation['gene_ids']
 
 
+def _variants_from_json(variant_results):
+    """
+    Variants are returned in genomic order, which elasticsearch doesn't return hits in, as the gene streams built
+    from them depend on it
+    """
+    variants = [Variant.fromJSON(variant_json) for variant_json in variant_results]
+    return sorted(variants, key=lambda variant: (variant.xpos, variant.ref, variant.alt))
+
+
 class ElasticsearchDatastore(datastore.Datastore):
 
     def __init__(self, annotator):
@@ -126,7 +135,7 @@ class ElasticsearchDatastore(datastore.Datastore):
         ):
         from xbrowse_server.base.models import Project, Family, Individual
         from seqr.models import Sample
-        from seqr.utils.es_utils import _liftover_grch38_to_grch37
+        from seqr.utils.es_utils import liftover_grch38_to_grch37_many
         from xbrowse_server.mall import get_reference
 
         redis_client = None
@@ -154,7 +163,7 @@ class ElasticsearchDatastore(datastore.Datastore):
         cached_results = redis_client and redis_client.get(cache_key)
         if cached_results is not None:
             variant_results = json.loads(cached_results)
-            return [Variant.fromJSON(variant_json) for variant_json in variant_results]
+            return _variants_from_json(variant_results)
 
         if family_id is None:
             project = Project.objects.get(project_id=project_id)
@@ -591,6 +600,11 @@ class ElasticsearchDatastore(datastore.Datastore):
 
         reference = get_reference()
 
+        lifted_over_positions = {}
+        if project.genome_version == GENOME_VERSION_GRCh38:
+            lifted_over_positions = liftover_grch38_to_grch37_many(
+                [(hit["contig"], int(hit["start"])) for hit in response])
+
         #for i, hit in enumerate(response.hits):
         variant_results = []
         for i, hit in enumerate(response):  # preserve_order=True
@@ -670,14 +684,9 @@ class ElasticsearchDatastore(datastore.Datastore):
                 grch38_coord = hit["variantId"]
 
             if project.genome_version == GENOME_VERSION_GRCh38:
-                grch37_coord = None
-                liftover_grch38_to_grch37 = _liftover_grch38_to_grch37()
-                if liftover_grch38_to_grch37:
-                    grch37_coord = liftover_grch38_to_grch37.convert_coordinate("chr%s" % hit["contig"].replace("chr", ""), int(hit["start"]))
-                    if grch37_coord and grch37_coord[0]:
-                        grch37_coord = "%s-%s-%s-%s "% (grch37_coord[0][0], grch37_coord[0][1], hit["ref"], hit["alt"])
-                    else:
-                        grch37_coord = None
+                grch37_coord = lifted_over_positions.get((hit["contig"], int(hit["start"])))
+                if grch37_coord:
+                    grch37_coord = "%s-%s-%s-%s "% (grch37_coord[0], grch37_coord[1], hit["ref"], hit["alt"])
             else:
                 grch37_coord = hit["variantId"]
 
@@ -836,7 +845,7 @@ class ElasticsearchDatastore(datastore.Datastore):
         if redis_client:
             redis_client.set(cache_key, json.dumps(variant_results))
 
-        return [Variant.fromJSON(variant_json) for variant_json in variant_results]
+        return _variants_from_json(variant_results)
 
     def get_variants(self, project_id, family_id, genotype_filter=None, variant_filter=None, quality_filter=None, indivs_to_consider=None, user=None):
         for variant in self.get_elasticsearch_variants(
@@ -1,13 +1,16 @@
 from collections import defaultdict, OrderedDict
 import copy
 from datetime import date, datetime
+import functools
 import itertools
 import logging
 import os
-import pysam
+import bson
+from bson.raw_bson import RawBSONDocument
 import pymongo
 import random
 import string
+import struct
 import sys
 
 from django.conf import settings
@@ -58,6 +61,62 @@ def _add_index_fields_to_variant(variant_dict, annotation=None):
         variant_dict['db_gene_ids'] = annotation['gene_ids']
 
 
+# number of family-variants to accumulate across all families before inserting them
+VARIANT_INSERT_BUFFER_SIZE = 20000
+# number of VCF variants to look up annotations for at a time
+VCF_ANNOTATION_CHUNK_SIZE = 5000
+
+
+def _encode_family_variants(family_info_list, variant):
+    """
+    Returns the variant's (xpos, ref, alt) tuple and a list of (family_id, BSON encoded variant dict) tuples for the
+    families the variant is relevant for, with the genotypes restricted to each family. This runs in the VCF parser
+    worker processes, and the variants are sent back BSON encoded so that the loading process does not have to rebuild
+    or encode their genotypes before inserting them
+    """
+    family_variants = []
+    for family in family_info_list:
+        try:
+            family_variant = variant.make_copy(restrict_to_genotypes=family['individuals'])
+            if xbrowse_utils.is_variant_relevant_for_individuals(family_variant, family['individuals']):
+                family_variants.append(
+                    (family['family_id'], bson.BSON.encode(family_variant.toJSON(), check_keys=True)))
+        except Exception, e:
+            sys.stderr.write("ERROR: on variant %s, family: %s - %s\n" % (variant.toJSON(), family, e))
+    return variant.unique_tuple(), family_variants
+
+
+def _add_encoded_fields(encoded_variant, encoded_fields):
+    """
+    Returns a RawBSONDocument of the BSON encoded variant with the fields in the BSON encoded fields document added
+    """
+    elements = encoded_variant[4:-1] + encoded_fields[4:-1]
+    return RawBSONDocument(struct.pack('<i', len(elements) + 5) + elements + b'\x00')
+
+
+def _insert_new_variants(collection, keyed_variants):
+    """
+    Insert the given (xpos, ref, alt), variant document tuples into a family collection in one unordered batch,
+    skipping variants that are already in the collection (eg. when resuming a load) or that are repeated within
+    the batch
+    """
+    existing_variants = collection.find(
+        {'xpos': {'$in': list({key[0] for key, _ in keyed_variants})}},
+        {'xpos': True, 'ref': True, 'alt': True, '_id': False},
+    )
+    loaded_keys = {(v['xpos'], v['ref'], v['alt']) for v in existing_variants}
+
+    new_variants = []
+    for key, variant in keyed_variants:
+        if key not in loaded_keys:
+            loaded_keys.add(key)
+            new_variants.append(variant)
+
+    if new_variants:
+        collection.insert_many(new_variants, ordered=False)
+    return len(new_variants)
+
+
 class MongoDatastore(datastore.Datastore):
 
     def __init__(self, db_name, annotator, custom_population_store=None, custom_populations_map=None):
@@ -382,8 +441,7 @@ class MongoDatastore(datastore.Datastore):
             start_from_pos = int(position_per_chrom[chr_idx])
 
             logger.info("Start from: %s - %s (%0.1f%% done)" % (chr_idx, start_from_pos, 100.*start_from_pos/CHROMOSOME_SIZES[variant.chr.replace("chr", "")]))
-            tabix_file = pysam.TabixFile(vcf_file_path)
-            vcf_iter = itertools.chain(tabix_file.header, tabix_file.fetch(variant.chr.replace("chr", ""), start_from_pos, int(2.5e8)))
+            vcf_regions = vcf_stuff.get_vcf_regions(vcf_file_path, chroms=[variant.chr], start=start_from_pos)
         elif start_from_chrom or end_with_chrom:
             if start_from_chrom:
                 logger.info("Start chrom: chr%s" % start_from_chrom)
@@ -399,71 +457,56 @@ class MongoDatastore(datastore.Datastore):
             if end_with_chrom:
                 chrom_list_end_index = chrom_list.index(end_with_chrom.replace("chr", "").upper())
 
-            tabix_file = pysam.TabixFile(vcf_file_path)
-            vcf_iter = tabix_file.header
-            for chrom in chrom_list[chrom_list_start_index:chrom_list_end_index+1]:
-                logger.info("Will load chrom: " + chrom)
-                try:
-                    vcf_iter = itertools.chain(vcf_iter, tabix_file.fetch(chrom))
-                except ValueError as e:
-                    logger.warn("WARNING: _add_vcf_file_for_family_set: " + str(e))
+            chroms_to_load = chrom_list[chrom_list_start_index:chrom_list_end_index+1]
+            logger.info("Will load chroms: " + ", ".join(chroms_to_load))
+            vcf_regions = vcf_stuff.get_vcf_regions(vcf_file_path, chroms=chroms_to_load)
+
+        elif vcf_stuff.is_tabix_indexed(vcf_file_path):
+            vcf_regions = vcf_stuff.get_vcf_regions(vcf_file_path)
 
         else:
-            vcf_iter = vcf_file = compressed_file(vcf_file_path)
+            vcf_regions = None
             # TODO handle case where it's one vcf file, not split by chromosome
 
         size = os.path.getsize(vcf_file_path)
         #progress = get_progressbar(size, 'Loading VCF: {}'.format(vcf_file_path))
 
         def insert_all_variants_in_buffer(buff, collections_dict):
-            for family_id in buff:
-                if len(buff[family_id]) == 0:  # defensive programming
+            for family_id, family_variants in buff.items():
+                if len(family_variants) == 0:  # defensive programming
                     raise ValueError("%s has zero variants to insert. Should not be in buff." % family_id)
 
-            while len(buff) > 0:
-                # choose a random family for which to insert a variant from among families that still have variants to insert
-                family_id = random.choice(buff.keys())
-
-                # pop a variant off the list for this family, and insert it
-                family_variant_dict_to_insert = buff[family_id].pop()
-                c = collections_dict[family_id]
-                c.insert(family_variant_dict_to_insert)
-
-                if len(buff[family_id]) == 0:
-                    del buff[family_id]  # if no more variants for this family, delete it
+                _insert_new_variants(collections_dict[family_id], family_variants)
+                del buff[family_id]
 
         vcf_rows_counter = 0
         variants_buffered_counter = 0
         family_id_to_variant_list = defaultdict(list)  # will accumulate variants to be inserted all at once
-        for variant in vcf_stuff.iterate_vcf(vcf_iter, genotypes=True, indiv_id_list=indiv_id_list, vcf_id_map=vcf_id_map):
-            if variant.alt == "*":
-                #print("Skipping GATK 3.4 * alt allele: " + str(variant.unique_tuple()))
-                continue
-
-            try:
-                annotation = self._annotator.get_annotation(variant.xpos, variant.ref, variant.alt, populations=reference_populations)
-            except ValueError, e:
-                logger.warn("WARNING: _annotator.get_annotation: " + str(e) + "\n")
-                continue
-
+        encode_family_variants = functools.partial(_encode_family_variants, family_info_list)
+        if vcf_regions is not None:
+            # parse regions of the tabix-indexed VCF and encode the variants for each family in worker processes
+            family_variants = vcf_stuff.iterate_vcf_parallel(
+                vcf_file_path, regions=vcf_regions, processes=settings.VCF_PARSER_PROCESSES,
+                process_variant=encode_family_variants, genotypes=True, indiv_id_list=indiv_id_list,
+                vcf_id_map=vcf_id_map)
+        else:
+            family_variants = itertools.imap(encode_family_variants, vcf_stuff.iterate_vcf(
+                compressed_file(vcf_file_path), genotypes=True, indiv_id_list=indiv_id_list, vcf_id_map=vcf_id_map))
+        annotated_variants = self._iterate_annotated_variants(family_variants, reference_populations)
+        for (variant_t, encoded_family_variants), annotation in annotated_variants:
             vcf_rows_counter += 1
-            for family in family_info_list:
-                # TODO: can we move this inside the if relevant clause below?
-                try:
-                    family_variant = variant.make_copy(restrict_to_genotypes=family['individuals'])
-                    family_variant_dict = family_variant.toJSON()
-                    _add_index_fields_to_variant(family_variant_dict, annotation)
-                    if xbrowse_utils.is_variant_relevant_for_individuals(family_variant, family['individuals']):
-                        collection = collections[family['family_id']]
-                        if not collection.find_one({'xpos': family_variant.xpos, 'ref': family_variant.ref, 'alt': family_variant.alt}):
-                            family_id_to_variant_list[family['family_id']].append(family_variant_dict)
-                            variants_buffered_counter += 1
-                except Exception, e:
-                    sys.stderr.write("ERROR: on variant %s, family: %s - %s\n" % (variant.toJSON(), family, e))
-
-
-            if variants_buffered_counter > 2000:
-                logger.info(date.strftime(datetime.now(), "%m/%d/%Y %H:%M:%S") + "-- %s:%s-%s-%s (%0.1f%% done) - inserting %d family-variants from %d vcf rows into %s families" % (variant.chr, variant.pos, variant.ref, variant.alt, 100*variant.pos / CHROMOSOME_SIZES[variant.chr.replace("chr", "")], variants_buffered_counter, vcf_rows_counter, len(family_id_to_variant_list)))
+            index_fields = {}
+            _add_index_fields_to_variant(index_fields, annotation)
+            encoded_index_fields = bson.BSON.encode(index_fields)
+            for family_id, encoded_variant in encoded_family_variants:
+                # variants that are already loaded are skipped when the buffer is inserted
+                family_id_to_variant_list[family_id].append(
+                    (variant_t, _add_encoded_fields(encoded_variant, encoded_index_fields)))
+                variants_buffered_counter += 1
+
+            if variants_buffered_counter > VARIANT_INSERT_BUFFER_SIZE:
+                chrom, pos = genomeloc.get_chr_pos(variant_t[0])
+                logger.info(date.strftime(datetime.now(), "%m/%d/%Y %H:%M:%S") + "-- %s:%s-%s-%s (%0.1f%% done) - inserting %d family-variants from %d vcf rows into %s families" % (chrom, pos, variant_t[1], variant_t[2], 100*pos / CHROMOSOME_SIZES[chrom.replace("chr", "")], variants_buffered_counter, vcf_rows_counter, len(family_id_to_variant_list)))
 
                 insert_all_variants_in_buffer(family_id_to_variant_list, collections)
 
@@ -477,6 +520,32 @@ class MongoDatastore(datastore.Datastore):
             assert len(family_id_to_variant_list) == 0
 
 
+    def _iterate_annotated_variants(self, family_variants, reference_populations):
+        """
+        Yields ((variant tuple, family variants), annotation) tuples for the given (variant tuple, family variants)
+        tuples, looking up annotations for VCF_ANNOTATION_CHUNK_SIZE variants at a time. Variants that are not
+        relevant for any family or that do not have annotations are skipped
+        """
+        family_variants = iter(family_variants)
+        while True:
+            family_variant_chunk = list(itertools.islice(family_variants, VCF_ANNOTATION_CHUNK_SIZE))
+            if not family_variant_chunk:
+                return
+
+            # skip GATK 3.4 * alt alleles
+            family_variant_chunk = [
+                (variant_t, family_variants) for variant_t, family_variants in family_variant_chunk
+                if family_variants and variant_t[2] != "*"
+            ]
+            annotations = self._annotator.get_annotations_many(
+                [variant_t for variant_t, _ in family_variant_chunk], populations=reference_populations)
+            for family_variant in family_variant_chunk:
+                annotation = annotations.get(family_variant[0])
+                if annotation is None:
+                    logger.warn("WARNING: _annotator.get_annotation: Could not find annotations for variant: " + str(family_variant[0]) + "\n")
+                    continue
+                yield family_variant, annotation
+
     def _finalize_family_load(self, project_id, family_id):
         """
         Call after family is loaded. Sets status and possibly more in the future
@@ -4,11 +4,19 @@
 
 import sys
 import gzip
+import itertools
+import marshal
+import multiprocessing
+import os
+from collections import deque
+
+import pysam
 import vcf as pyvcf
 
 from xbrowse import genomeloc
 from xbrowse import family_utils
 from xbrowse.utils import slugify
+from xbrowse.core.constants import CHROMOSOME_SIZES
 from xbrowse.core.variants import Variant, Genotype
 from xbrowse.utils.minirep import get_minimal_representation
 
@@ -171,11 +179,15 @@ def get_allele_balance(genotype_dict, alt_allele_pos):
     Or '.' if ab does not apply
     """
 
+    return _get_allele_balance_from_ad(genotype_dict['extras'].get('ad'), alt_allele_pos)
+
+
+def _get_allele_balance_from_ad(ad, alt_allele_pos):
     # can't compute ab without ad
-    if genotype_dict['extras'].get('ad') is None or genotype_dict['extras']['ad'] == '.':
+    if ad is None or ad == '.':
         return None
 
-    ad_fields = [int(s) for s in genotype_dict['extras']['ad'].split(',')]
+    ad_fields = [int(s) for s in ad.split(',')]
 
     # TODO: should we still compute AD for
     if len(ad_fields) == 1: return '.'
@@ -292,11 +304,67 @@ def get_genotype_from_str(geno_str, format_map, alt_allele_pos, allele_position_
     return Genotype(**geno_dict)
 
 
+# the FORMAT of almost all genotypes, which has a specialized parser
+STANDARD_GENOTYPE_FORMAT = 'GT:AD:DP:GQ:PL'
+
+
+def _new_genotype(fields):
+    # skips the argument handling of the Genotype namedtuple constructor
+    return tuple.__new__(Genotype, fields)
+
+
+def _get_genotype_from_standard_str(geno_str, alt_allele_pos, allele_position_map, vcf_filter=None):
+    """
+    Same as get_genotype_from_str, specialized for the GT:AD:DP:GQ:PL format that almost all callsets use
+    """
+    if geno_str == '.' or geno_str == './.':
+        return _new_genotype(([], None, None, vcf_filter, None, {'dp': None, 'pl': None, 'ad': None}))
+
+    geno_fields = geno_str.split(':')
+    num_fields = len(geno_fields)
+    if num_fields < 5:
+        # accommodate the fact that VCF can skip trailing genotype fields
+        geno_fields += [None] * (5 - num_fields)
+    gt, ad, dp, gq, pl = geno_fields[:5]
+
+    # inlined get_num_alt_from_str, assuming GT field is always first
+    alleles = []
+    num_alt = None
+    if gt != '.' and gt != './.':
+        a1, a2 = gt.split('/')
+        if a1 != '.' and a2 != '.':
+            alt_allele_num = alt_allele_pos + 1
+            num_alt = (int(a1) == alt_allele_num) + (int(a2) == alt_allele_num)
+            if a1 in allele_position_map and a2 in allele_position_map:
+                alleles = [allele_position_map[a1], allele_position_map[a2]]
+            else:
+                sys.stdout.write("WARNING: Could not parse genotype from string: %s with format: %s. Allele_position_map: %s" % (geno_str, STANDARD_GENOTYPE_FORMAT, allele_position_map))
+
+    if gq is not None:
+        try:
+            gq = float(gq)
+        except ValueError:
+            gq = None
+
+    ab = _get_allele_balance_from_ad(ad, alt_allele_pos)
+
+    return _new_genotype((alleles, gq, num_alt, vcf_filter, ab, {'dp': dp, 'pl': pl, 'ad': ad}))
+
+
+
+# map of VCF FORMAT string -> format map, as the FORMAT is almost always the same for every row in a VCF
+FORMAT_MAP_CACHE = {}
+
+
 def get_format_map(format_str):
     """
     Get a map of key -> pos from the VCF format
     Note that I treat all format strings lowercase; not sure why
     """
+    formats = FORMAT_MAP_CACHE.get(format_str)
+    if formats is not None:
+        return formats
+
     formats = {}
 
     for i, item in enumerate(format_str.split(':')):
@@ -309,6 +377,7 @@ def get_format_map(format_str):
         elif item == 'PL':
             formats['pl'] = i
 
+    FORMAT_MAP_CACHE[format_str] = formats
     return formats
 
 
@@ -327,13 +396,36 @@ def get_allele_position_map(ref_allele, alt_allele_str):
     return d
 
 
-def set_genotypes_from_vcf_fields(vcf_fields, variant, alt_allele_pos, vcf_header_fields, genotype_meta=True, indivs_to_include=None, vcf_id_map=None):
+def get_sample_columns(vcf_header_fields, indivs_to_include=None, vcf_id_map=None):
+    """
+    Get the (column index, individual ID) of the genotype columns to parse from a VCF
+
+    vcf_id_map: dict of [ID in the VCF file] -> [Individual ID]
+    """
+    if indivs_to_include:
+        indivs_to_include = {slugify(indiv_id, separator='_', replace_dot=True) for indiv_id in indivs_to_include}
+
+    sample_columns = []
+    for col_index in range(9, len(vcf_header_fields)):
+        vcf_id = slugify(vcf_header_fields[col_index], separator='_', replace_dot=True)
+        if vcf_id_map:
+            indiv_id = vcf_id_map.get(vcf_id, vcf_id)
+        else:
+            indiv_id = vcf_id
+        if indivs_to_include and indiv_id not in indivs_to_include:
+            continue
+        sample_columns.append((col_index, indiv_id))
+    return sample_columns
+
+
+def set_genotypes_from_vcf_fields(vcf_fields, variant, alt_allele_pos, vcf_header_fields, genotype_meta=True, indivs_to_include=None, vcf_id_map=None, sample_columns=None):
     """
     if variant is a basic variants, initialize its genotypes from vcf_fields
     vcf_header_fields is just a list of the headers in the vcf
     (with the # stripped of the #CHROM in the first column)
 
     vcf_id_map: dict of [ID in the VCF file] -> [Individual ID]
+    sample_columns: precomputed result of get_sample_columns for these headers, so it is not recomputed per row
     """
     num_columns = len(vcf_fields)
     if num_columns != len(vcf_header_fields):
@@ -344,31 +436,16 @@ def set_genotypes_from_vcf_fields(vcf_fields, variant, alt_allele_pos, vcf_heade
     allele_position_map = get_allele_position_map(vcf_fields[3], vcf_fields[4])
     vcf_filter = vcf_fields[6].lower()
 
-    formats = {}
-    for i, item in enumerate(format_str.split(':')):
-        if item == 'AD':
-            formats['ad'] = i
-        elif item == 'DP':
-            formats['dp'] = i
-        elif item == 'GQ':
-            formats['gq'] = i
-        elif item == 'PL':
-            formats['pl'] = i
-
-    if indivs_to_include:
-        indivs_to_include = [slugify(indiv_id, separator='_', replace_dot=True) for indiv_id in indivs_to_include]
-    for col_index in range(9, num_columns):
+    formats = get_format_map(format_str)
 
-        vcf_id = slugify(vcf_header_fields[col_index], separator='_', replace_dot=True)
-        if vcf_id_map:
-            indiv_id = vcf_id_map.get(vcf_id, vcf_id)
-        else:
-            indiv_id = vcf_id
-        if indivs_to_include and indiv_id not in indivs_to_include:
-            continue
+    if sample_columns is None:
+        sample_columns = get_sample_columns(vcf_header_fields, indivs_to_include=indivs_to_include, vcf_id_map=vcf_id_map)
+    for col_index, indiv_id in sample_columns:
         geno_str = vcf_fields[col_index]
         try:
-            if genotype_meta:
+            if genotype_meta and format_str == STANDARD_GENOTYPE_FORMAT:
+                genotypes[indiv_id] = _get_genotype_from_standard_str(geno_str, alt_allele_pos, allele_position_map, vcf_filter=vcf_filter)
+            elif genotype_meta:
                 genotypes[indiv_id] = get_genotype_from_str(geno_str, formats, alt_allele_pos, allele_position_map, vcf_filter=vcf_filter)
             else:
                 raise Exception("genotypes without meta not implemented - need to add kwarg")
@@ -417,6 +494,7 @@ def iterate_vcf(
     pyvcf_meta_parser = pyvcf.parser._vcf_metadata_parser()
 
     vcf_headers = None
+    sample_columns = None
     if header_info is None:
         header_info = {}
 
@@ -426,6 +504,8 @@ def iterate_vcf(
 
         if line.startswith('#CHROM'):
             vcf_headers = get_vcf_headers(line)
+            if genotypes:
+                sample_columns = get_sample_columns(vcf_headers, indivs_to_include=indivs_to_include, vcf_id_map=vcf_id_map)
 
         if line.startswith('##INFO'):
             k, v = pyvcf_meta_parser.read_info(_line)
@@ -461,7 +541,8 @@ def iterate_vcf(
                     vcf_headers,
                     genotype_meta=genotype_meta,
                     indivs_to_include=indivs_to_include,
-                    vcf_id_map=vcf_id_map
+                    vcf_id_map=vcf_id_map,
+                    sample_columns=sample_columns,
                 )
 
                 if not any([g for g in variant.genotypes.values() if g.num_alt is not None and g.num_alt > 0]):
@@ -472,6 +553,159 @@ def iterate_vcf(
             yield variant
 
 
+# max size of the genomic regions that a tabix-indexed VCF is split into for parallel parsing
+VCF_PARALLEL_REGION_SIZE = int(1e7)
+MIN_VCF_PARALLEL_REGION_SIZE = int(1e5)
+# each region is parsed into a single list of variants in memory, so regions get smaller as the number of samples
+# grows. At the density of a whole genome callset (about a variant per 100 bases) this is about 1M genotypes per region
+VCF_PARALLEL_REGION_SAMPLE_BASES = int(1e8)
+# used as the end of the region for contigs with an unknown size
+MAX_CONTIG_SIZE = int(2.5e8)
+
+
+def is_tabix_indexed(vcf_file_path):
+    """
+    Whether vcf_file_path is a bgzipped VCF with a tabix index next to it
+    """
+    return vcf_file_path.endswith('.gz') and os.path.isfile(vcf_file_path + '.tbi')
+
+
+def get_vcf_region_size(num_samples):
+    """
+    Size of the regions to parse a VCF with the given number of samples in
+    """
+    region_size = VCF_PARALLEL_REGION_SAMPLE_BASES // max(num_samples, 1)
+    return max(MIN_VCF_PARALLEL_REGION_SIZE, min(region_size, VCF_PARALLEL_REGION_SIZE))
+
+
+def get_vcf_regions(vcf_file_path, chroms=None, start=0, end=None, region_size=None):
+    """
+    Split a tabix-indexed VCF into (chrom, start, end) regions, in the order of the contigs in the index
+
+    Args:
+        chroms (list): Only include these contigs, with or without the 'chr' prefix
+        start (int): 0-based start of the regions in each contig
+        end (int): end of the regions in each contig - defaults to the contig size
+        region_size (int): defaults to get_vcf_region_size for the number of samples in the VCF
+    """
+    tabix_file = pysam.TabixFile(vcf_file_path)
+    contigs = tabix_file.contigs
+    if region_size is None:
+        header_fields = get_vcf_headers(list(tabix_file.header)[-1])
+        region_size = get_vcf_region_size(len(header_fields) - 9)
+    tabix_file.close()
+
+    if chroms is not None:
+        chroms = {chrom.replace('chr', '').upper() for chrom in chroms}
+        contigs = [contig for contig in contigs if contig.replace('chr', '').upper() in chroms]
+
+    regions = []
+    for contig in contigs:
+        contig_end = end or CHROMOSOME_SIZES.get(contig.replace('chr', ''), MAX_CONTIG_SIZE)
+        for region_start in range(start, contig_end, region_size):
+            regions.append((contig, region_start, min(region_start + region_size, contig_end)))
+        # catch any records past the expected end of the contig
+        if end is None and contig_end < MAX_CONTIG_SIZE:
+            regions.append((contig, max(start, contig_end), MAX_CONTIG_SIZE))
+    return regions
+
+
+def _iterate_vcf_region(vcf_file_path, region, **kwargs):
+    chrom, start, end = region
+    tabix_file = pysam.TabixFile(vcf_file_path)
+    try:
+        rows = tabix_file.fetch(chrom, start, end)
+    except ValueError:
+        # the contig has no records
+        rows = []
+
+    # tabix returns every record overlapping the region, so only keep the ones starting in it to make
+    # sure that records spanning a region boundary are not parsed twice
+    rows = (row for row in rows if start < int(row.split('\t', 2)[1]) <= end)
+
+    return iterate_vcf(itertools.chain(tabix_file.header, rows), **kwargs)
+
+
+def _pack_variant(variant):
+    return variant.xpos, variant.ref, variant.alt, variant.vcf_id, variant.extras, [
+        (indiv_id, tuple(genotype)) for indiv_id, genotype in variant.genotypes.iteritems()]
+
+
+def _unpack_variant(packed_variant):
+    xpos, ref, alt, vcf_id, extras, genotypes = packed_variant
+    variant = Variant(xpos, ref, alt)
+    variant.vcf_id = vcf_id
+    variant.extras = extras
+    variant.genotypes = {indiv_id: _new_genotype(genotype) for indiv_id, genotype in genotypes}
+    return variant
+
+
+def _parse_vcf_region(args):
+    """
+    Parse a region of a VCF in a worker process. Variants are sent back to the parent process as marshalled
+    tuples, which is several times cheaper to serialize and load than pickled Variants
+    """
+    vcf_file_path, region, process_variant, kwargs = args
+    variants = _iterate_vcf_region(vcf_file_path, region, **kwargs)
+    if process_variant:
+        return marshal.dumps([process_variant(variant) for variant in variants])
+    return marshal.dumps([_pack_variant(variant) for variant in variants])
+
+
+def iterate_vcf_parallel(vcf_file_path, regions=None, processes=None, process_variant=None, **kwargs):
+    """
+    Get the variants in a bgzipped, tabix-indexed VCF file, parsing regions of the file in worker processes
+
+    Args:
+        vcf_file_path (str): path to the VCF file - must have a tabix index
+        regions (list): (chrom, start, end) regions to parse - defaults to the whole file
+        processes (int): number of worker processes - defaults to the number of CPUs. Regions are parsed
+            in this process if 1
+        process_variant (function): optional function that is called on each Variant in the worker processes. Its
+            return value, which has to be marshallable, is yielded instead of the Variant. The function must be
+            picklable, ie. a module-level function or a functools.partial of one. Doing the per-variant work in the
+            workers saves the parent process from rebuilding every Variant, which otherwise limits the speedup
+        **kwargs: passed to iterate_vcf
+
+    Returns:
+        Iterator of Variants, or of the values returned by process_variant, in the order of the regions
+    """
+    if regions is None:
+        regions = get_vcf_regions(vcf_file_path)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if processes <= 1:
+        for region in regions:
+            for variant in _iterate_vcf_region(vcf_file_path, region, **kwargs):
+                yield process_variant(variant) if process_variant else variant
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        # keep a bounded number of regions in flight so that parsed variants don't pile up in memory while
+        # the caller is still consuming earlier regions
+        region_args = ((vcf_file_path, region, process_variant, kwargs) for region in regions)
+        pending = deque()
+        for args in itertools.islice(region_args, processes * 2):
+            pending.append(pool.apply_async(_parse_vcf_region, (args,)))
+
+        while pending:
+            values = marshal.loads(pending.popleft().get())
+            for args in itertools.islice(region_args, 1):
+                pending.append(pool.apply_async(_parse_vcf_region, (args,)))
+            if process_variant:
+                for value in values:
+                    yield value
+            else:
+                for packed_variant in values:
+                    yield _unpack_variant(packed_variant)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 def write_sites_vcf(f, sites_list):
     """
     Write a sites VCF file to file_path
@@ -484,7 +718,7 @@ def write_sites_vcf(f, sites_list):
     f.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
     for site in sites_list:
         chrom, pos = genomeloc.get_chr_pos(site[0])
-        fields = [chrom[3:], str(pos), '.', site[1], site[2], '.', '.', '.']
+        fields = [chrom.replace('chr', ''), str(pos), '.', site[1], site[2], '.', '.', '.']
         f.write('\t'.join(fields) + '\n')
     return True
 
@@ -495,3 +729,14 @@ def iterate_tuples(vcf_file):
     """
     for variant in iterate_vcf(vcf_file):
         yield variant.unique_tuple()
+
+
+def iterate_tuples_parallel(vcf_file_path, processes=None):
+    """
+    Iterate variant tuples in a bgzipped, tabix-indexed VCF file, parsing it in worker processes
+    """
+    return iterate_vcf_parallel(vcf_file_path, processes=processes, process_variant=_get_variant_tuple)
+
+
+def _get_variant_tuple(variant):
+    return variant.unique_tuple()
@@ -0,0 +1,101 @@
+import functools
+import os
+import shutil
+import tempfile
+
+import pysam
+from django.test import TestCase
+
+from xbrowse.parsers import vcf_stuff
+
+VCF_HEADER = """##fileformat=VCFv4.1
+##INFO=<ID=AC,Number=A,Type=Integer,Description="Allele count in genotypes">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=AD,Number=.,Type=Integer,Description="Allelic depths">
+##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">
+##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype quality">
+#CHROM	POS	ID	REF	ALT	QUAL	FILTER	INFO	FORMAT	NA19675	NA19678
+"""
+
+VCF_ROWS = [
+    ['1', '1000', '.', 'A', 'G', '50', 'PASS', 'AC=1', 'GT:AD:DP:GQ', '0/1:5,5:10:99', '0/0:10,0:10:99'],
+    ['1', '9999998', '.', 'ACGTA', 'A', '50', 'PASS', 'AC=2', 'GT:AD:DP:GQ', '1/1:0,9:9:30', '0/1:4,5:9:60'],
+    ['1', '10000005', '.', 'C', 'T,G', '50', 'PASS', 'AC=1,1', 'GT:AD:DP:GQ', '0/1:5,5,0:10:99', '0/2:6,0,4:10:80'],
+    ['2', '500', '.', 'T', 'C', '50', 'PASS', 'AC=1', 'GT:AD:DP:GQ', './.', '0/1:3,3:6:40'],
+    ['X', '2000000', '.', 'G', 'A', '50', 'PASS', 'AC=1', 'GT:AD:DP:GQ', '0/1:2,2:4:20', '0/0:4,0:4:20'],
+]
+
+
+def _get_num_alt(indiv_id, variant):
+    return variant.unique_tuple(), variant.get_genotype(indiv_id).num_alt
+
+
+class VcfStuffTest(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        vcf_path = os.path.join(self.temp_dir, 'test.vcf')
+        with open(vcf_path, 'w') as f:
+            f.write(VCF_HEADER)
+            for row in VCF_ROWS:
+                f.write('\t'.join(row) + '\n')
+        self.vcf_file_path = pysam.tabix_index(vcf_path, preset='vcf', keep_original=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_iterate_vcf_parallel(self):
+        self.assertTrue(vcf_stuff.is_tabix_indexed(self.vcf_file_path))
+
+        regions = vcf_stuff.get_vcf_regions(self.vcf_file_path, chroms=['chr1', 'X'])
+        self.assertListEqual([region for region in regions if region[0] == '1'][:2], [('1', 0, 10000000), ('1', 10000000, 20000000)])
+        self.assertSetEqual({region[0] for region in regions}, {'1', 'X'})
+        self.assertListEqual(
+            vcf_stuff.get_vcf_regions(self.vcf_file_path, chroms=['2'], start=int(2.4e8), region_size=int(2e6)),
+            [('2', 240000000, 242000000), ('2', 242000000, 243199373), ('2', 243199373, vcf_stuff.MAX_CONTIG_SIZE)])
+
+        # regions are smaller for VCFs with more samples, so each parsed region has a bounded number of genotypes
+        self.assertEqual(vcf_stuff.get_vcf_region_size(2), vcf_stuff.VCF_PARALLEL_REGION_SIZE)
+        self.assertEqual(vcf_stuff.get_vcf_region_size(1000), int(1e5))
+        self.assertEqual(vcf_stuff.get_vcf_region_size(20), int(5e6))
+
+        with open(os.path.join(self.temp_dir, 'test.vcf')) as f:
+            expected_variants = [v.toJSON() for v in vcf_stuff.iterate_vcf(f, genotypes=True)]
+        self.assertEqual(len(expected_variants), 6)
+
+        for processes in [1, 2]:
+            variants = vcf_stuff.iterate_vcf_parallel(self.vcf_file_path, processes=processes, genotypes=True)
+            self.assertListEqual([v.toJSON() for v in variants], expected_variants)
+
+        variants = vcf_stuff.iterate_vcf_parallel(
+            self.vcf_file_path, regions=regions, processes=2, genotypes=True, indiv_id_list=['NA19678'])
+        self.assertListEqual(
+            [v.unique_tuple() for v in variants],
+            [(1009999998, 'ACGTA', 'A'), (1010000005, 'C', 'G')])
+
+        self.assertListEqual(
+            list(vcf_stuff.iterate_tuples_parallel(self.vcf_file_path, processes=2)),
+            [(v['xpos'], v['ref'], v['alt']) for v in expected_variants])
+
+        # the workers return the values of process_variant instead of the variants
+        for processes in [1, 2]:
+            num_alts = vcf_stuff.iterate_vcf_parallel(
+                self.vcf_file_path, processes=processes, process_variant=functools.partial(_get_num_alt, 'NA19678'),
+                genotypes=True)
+            self.assertListEqual(list(num_alts), [
+                ((v['xpos'], v['ref'], v['alt']), v['genotypes']['NA19678']['num_alt']) for v in expected_variants])
+
+    def test_get_genotype_from_standard_str(self):
+        allele_position_map = vcf_stuff.get_allele_position_map('A', 'G,T')
+        format_map = vcf_stuff.get_format_map(vcf_stuff.STANDARD_GENOTYPE_FORMAT)
+        self.assertIs(vcf_stuff.get_format_map(vcf_stuff.STANDARD_GENOTYPE_FORMAT), format_map)
+
+        for geno_str in [
+            '0/1:10,9:19:99:200,0,250', '1/1:0,15:15:45:400,45,0', '0/2:3,0,4:7:50:1,2,3,4,5,6', './.', '.',
+            './.:0,0:0', '0/1:.:5', '0/1:4,5', '1/1:0,3:3:.:1', '.:5,5:10:20:1',
+        ]:
+            for alt_allele_pos in [0, 1]:
+                self.assertEqual(
+                    vcf_stuff._get_genotype_from_standard_str(geno_str, alt_allele_pos, allele_position_map, vcf_filter='pass'),
+                    vcf_stuff.get_genotype_from_str(geno_str, format_map, alt_allele_pos, allele_position_map, vcf_filter='pass'),
+                )
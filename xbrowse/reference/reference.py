@@ -2,11 +2,17 @@ import os
 import itertools
 import logging
 import pymongo
+from threading import Lock
+import time
 from xbrowse import genomeloc
 from xbrowse.reference.clinvar import parse_clinvar_vcf
 
 logger = logging.getLogger(__name__)
 
+# how often to check whether the in-memory gene table is out of date
+GENE_TABLE_VERSION_CHECK_INTERVAL = 60
+
+
 class Reference(object):
     """
     Reference is a workhorse - it provides an API for looking up any information about the human genome
@@ -22,6 +28,11 @@ class Reference(object):
 
         self._db = pymongo.MongoClient(host=os.environ.get('MONGO_SERVICE_HOSTNAME', 'localhost'))[settings_module.db_name]
 
+        self._gene_table = None
+        self._gene_table_version = None
+        self._gene_table_checked_time = None
+        self._gene_table_lock = Lock()
+
     def load(self):
         raise Exception('Attempting to load deprecated MongoDB reference data')
 
@@ -68,18 +79,47 @@ class Reference(object):
     def get_all_exon_ids(self):
         raise NotImplementedError
 
-    def get_gene_bounds(self, gene_id):
-        gene = self.gene_utils.get_genes([gene_id]).get(gene_id)
+    def _get_gene_table(self):
+        """
+        Map of gene_id -> {'gene', 'symbol', 'summary'} for all genes, with 'bounds' added once they are looked up.
+        The table is loaded once and shared by all lookups in this process, and is reloaded when the gene reference
+        data changes (ie. after update_gencode)
+        """
+        now = time.time()
+        if self._gene_table is not None and now - self._gene_table_checked_time < GENE_TABLE_VERSION_CHECK_INTERVAL:
+            return self._gene_table
+
+        from reference_data.models import GeneInfo, GeneConstraint
+        with self._gene_table_lock:
+            if self._gene_table is None or now - self._gene_table_checked_time >= GENE_TABLE_VERSION_CHECK_INTERVAL:
+                version = self.gene_utils.get_reference_data_version(GeneInfo, GeneConstraint)
+                if self._gene_table is None or version != self._gene_table_version:
+                    self._gene_table = {
+                        gene_id: {
+                            'gene': gene,
+                            'symbol': gene['geneSymbol'],
+                            'summary': _get_gene_summary(gene),
+                        } for gene_id, gene in self.gene_utils.get_all_gene_summaries().items()
+                    }
+                    self._gene_table_version = version
+                self._gene_table_checked_time = now
+        return self._gene_table
+
+    def get_gene_bounds(self, gene_id, genome_version=None):
+        """
+        Returns the (start, end) xpos of the gene in the given genome build. If no build is given, the GRCh37 bounds
+        are used if the gene has any, otherwise the GRCh38 ones
+        """
+        gene = self._get_gene_table().get(gene_id)
         if not gene:
             return (None, None, None)
-        build = 'Grch37' if gene['chromGrch37'] else 'Grch38'
-        chrom = gene['chrom{}'.format(build)]
-        start = gene['start{}'.format(build)]
-        end = gene['end{}'.format(build)]
-        return (genomeloc.get_xpos(chrom, start), genomeloc.get_xpos(chrom, end))
+        bounds_key = 'bounds_{}'.format(genome_version) if genome_version else 'bounds'
+        if bounds_key not in gene:
+            gene[bounds_key] = _get_gene_bounds(gene['gene'], genome_version=genome_version)
+        return gene[bounds_key]
 
     def get_gene_symbol(self, gene_id):
-        return self.gene_utils.get_genes([gene_id]).get(gene_id, {}).get('geneSymbol')
+        return self._get_gene_table().get(gene_id, {}).get('symbol')
 
     def get_gene_id_from_symbol(self, symbol, use_latest_gene_if_multiple=False):
         gene_ids = self.gene_utils.get_gene_ids_for_gene_symbols([symbol]).get(symbol, [])
@@ -147,26 +187,16 @@ class Reference(object):
         })
 
     def get_gene_summary(self, gene_id):
-        gene = self.gene_utils.get_genes([gene_id], add_constraints=True).get(gene_id)
-
-        return {
-            'gene_id': gene['geneId'],
-            'symbol': gene['geneSymbol'],
-            'coding_size': gene['codingRegionSizeGrch37'],
-            'tags': {
-                'missense_constraint': gene['constraints'].get('misZ'),
-                'missense_constraint_rank': [gene['constraints'].get('misZRank'),
-                                             gene['constraints'].get('totalGenes')],
-                'lof_constraint': gene['constraints'].get('pli'),
-                'lof_constraint_rank': [gene['constraints'].get('pliRank'), gene['constraints'].get('totalGenes')],
-            },
-        } if gene else {}
+        """
+        The returned summary is shared by all lookups, so should not be modified
+        """
+        return self._get_gene_table().get(gene_id, {}).get('summary', {})
 
     def get_gene_symbols(self):
         """
         Map of gene_id -> gene symbol for all genes
         """
-        return {gene_id: gene['geneSymbol'] for gene_id, gene in self.gene_utils.get_genes(None).values()}
+        return {gene_id: gene['symbol'] for gene_id, gene in self._get_gene_table().items()}
 
     def get_ordered_exons(self):
         """
@@ -199,3 +229,31 @@ class Reference(object):
             return None, ''
         else:
             return doc['variant_id'], doc['clinsig']
+
+
+def _get_gene_bounds(gene, genome_version=None):
+    if genome_version:
+        build = 'Grch{}'.format(genome_version)
+        if not gene['chrom{}'.format(build)]:
+            return (None, None, None)
+    else:
+        build = 'Grch37' if gene['chromGrch37'] else 'Grch38'
+    chrom = gene['chrom{}'.format(build)]
+    start = gene['start{}'.format(build)]
+    end = gene['end{}'.format(build)]
+    return (genomeloc.get_xpos(chrom, start), genomeloc.get_xpos(chrom, end))
+
+
+def _get_gene_summary(gene):
+    return {
+        'gene_id': gene['geneId'],
+        'symbol': gene['geneSymbol'],
+        'coding_size': gene['codingRegionSizeGrch37'],
+        'tags': {
+            'missense_constraint': gene['constraints'].get('misZ'),
+            'missense_constraint_rank': [gene['constraints'].get('misZRank'),
+                                         gene['constraints'].get('totalGenes')],
+            'lof_constraint': gene['constraints'].get('pli'),
+            'lof_constraint_rank': [gene['constraints'].get('pliRank'), gene['constraints'].get('totalGenes')],
+        },
+    }
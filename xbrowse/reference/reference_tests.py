@@ -0,0 +1,47 @@
+import mock
+
+from django.test import TestCase
+
+from reference_data.models import GeneInfo
+from xbrowse.reference import reference
+from xbrowse.reference.reference import Reference
+
+
+class ReferenceTest(TestCase):
+    fixtures = ['reference_data']
+
+    @mock.patch('xbrowse.reference.reference.time')
+    @mock.patch('xbrowse.reference.reference.pymongo')
+    def test_gene_lookups(self, mock_pymongo, mock_time):
+        mock_time.time.return_value = 1000
+        ref = Reference(mock.MagicMock())
+
+        self.assertEqual(ref.get_gene_symbol('ENSG00000223972'), 'DDX11L1')
+        self.assertTupleEqual(ref.get_gene_bounds('ENSG00000223972'), (1000011869, 1000014409))
+        self.assertDictEqual(ref.get_gene_summary('ENSG00000223972'), {
+            'gene_id': 'ENSG00000223972',
+            'symbol': 'DDX11L1',
+            'coding_size': 0,
+            'tags': {
+                'missense_constraint': None,
+                'missense_constraint_rank': [None, None],
+                'lof_constraint': None,
+                'lof_constraint_rank': [None, None],
+            },
+        })
+        self.assertIsNone(ref.get_gene_symbol('ENSG00000000000'))
+        self.assertDictEqual(ref.get_gene_summary('ENSG00000000000'), {})
+        self.assertTupleEqual(ref.get_gene_bounds('ENSG00000000000'), (None, None, None))
+
+        # lookups do not query the database
+        with self.assertNumQueries(0):
+            self.assertEqual(ref.get_gene_symbol('ENSG00000227232'), 'WASH7P')
+
+        # reloaded genes are used once the version is rechecked
+        GeneInfo.objects.create(gene_id='ENSG00000000000', gene_symbol='NEW_GENE', chrom_grch37='2', start_grch37=5, end_grch37=10)
+        self.assertIsNone(ref.get_gene_symbol('ENSG00000000000'))
+        mock_time.time.return_value += reference.GENE_TABLE_VERSION_CHECK_INTERVAL
+        self.assertEqual(ref.get_gene_symbol('ENSG00000000000'), 'NEW_GENE')
+        self.assertTupleEqual(ref.get_gene_bounds('ENSG00000000000'), (2000000005, 2000000010))
+        self.assertTupleEqual(ref.get_gene_bounds('ENSG00000000000', genome_version='37'), (2000000005, 2000000010))
+        self.assertTupleEqual(ref.get_gene_bounds('ENSG00000000000', genome_version='38'), (None, None, None))